@@ -0,0 +1,549 @@
+#
+# A client for the projectors' "op" protocol, written with asyncio so
+# that one process can talk to every projector in the YURT at once.
+#
+# The projectors hang off ports on the serial switches, and you talk to
+# one by opening a telnet session to its port, sending a command like
+# 'op status.check ?' and reading what comes back.  The projector
+# answers with a line starting 'ACK:' or 'ERR:', or just 'NoErr', or
+# (for things like 'op prerr') a dump with no marker at all.  This is
+# what pjexpect does with expect and telnet; here we do it directly,
+# without spawning anything.
+#
+# Use it from asyncio code like this:
+#
+#   client = OpClient()
+#   replies = await client.transact("switch03", "10014",
+#                                   ["op status.check ?", "op lamp.hours ?"],
+#                                   deadline=loop.time() + 30)
+#
+# or from ordinary code through BlockingClient, which runs the event
+# loop in a thread of its own.
+#
+# Normally we connect to the switch and port we're given.  For testing
+# against the simulator (pjsim.py), PJSWITCHMAP can name a JSON file
+# that maps "switch:port" to the "host:port" to use instead.
+#
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+# How long to wait for a reply, by default.  (Same as expect.)
+TIMEOUT = 10.0
+
+# How long a reply with no ACK (like an error dump) can go quiet before
+# we decide it's finished.
+QUIET = 1.0
+
+# Whoever uses this can decide where the log goes.
+log = logging.getLogger("opclient")
+log.addHandler(logging.NullHandler())
+
+# Telnet protocol bytes.  We don't want any telnet options, so we
+# refuse everything the switch offers.
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# Commands that don't change anything, even though they aren't
+# queries with a '?'.
+READONLY = ["op prerr"]
+
+
+# The switch map, once we've read it, indexed by file name.
+switchMaps = dict()
+
+
+def switchAddress(serialSwitch, switchPort):
+    """
+    Returns the (host, port) to connect to for the given switch port.
+    """
+    mapFile = os.environ.get("PJSWITCHMAP", "")
+    if mapFile != "":
+        if mapFile not in switchMaps:
+            with open(mapFile, "r") as f:
+                switchMaps[mapFile] = json.load(f)
+        key = "{0}:{1}".format(serialSwitch, switchPort)
+        if key in switchMaps[mapFile]:
+            host, port = switchMaps[mapFile][key].rsplit(":", 1)
+            return (host, int(port))
+
+    return (serialSwitch, int(switchPort))
+
+
+class SwitchUnreachable(OSError):
+    """
+    Raised when we can't get a telnet session to a switch port at all.
+    """
+    pass
+
+
+class OpReply(object):
+    """
+    Holds a projector's reply to one "op" command.
+    """
+    def __init__(self, status, text):
+        """
+        status -- one of 'ACK', 'ERR', 'NoErr' or 'timeout', depending
+          on what the projector said, or didn't.
+
+        text -- whatever came after the ACK: or ERR:, up to the end of
+          the line.  For a timeout, everything the projector sent.
+        """
+        self.status = status
+        self.text = text
+
+    def format(self, proj, cmd):
+        """
+        Returns the reply the way pjexpect would have printed it, so
+        the callers that pick it apart don't know the difference.
+        """
+        if self.status == "ERR":
+            return "Error attempting command {0} on {1}: {2}".format(cmd, proj, self.text)
+        elif self.status == "NoErr":
+            return "{0}: NoErr\n".format(proj)
+        else:
+            return "{0}: {1}".format(proj, self.text)
+
+    def formatRaw(self, proj, cmd):
+        """
+        Returns the reply the way pjexpect-raw would have printed it,
+        which is the same except that an ACK comes without the
+        projector name in front.
+        """
+        if self.status == "ACK":
+            return self.text
+        return self.format(proj, cmd)
+
+    def toDict(self):
+        return {"status": self.status, "text": self.text}
+
+    @staticmethod
+    def parse(output, proj):
+        """
+        Makes an OpReply out of the output pjexpect printed.  pjexpect
+        doesn't tell us whether a reply was an ACK or just whatever
+        arrived before the timeout, so anything that isn't an error or
+        a NoErr and fits on one line is taken to be an ACK.
+        """
+        if output.startswith("Error attempting command"):
+            return OpReply("ERR", output.split(": ", 1)[-1])
+        elif output == "{0}: NoErr\n".format(proj):
+            return OpReply("NoErr", "")
+
+        prefix = "{0}: ".format(proj)
+        if output.startswith(prefix):
+            output = output[len(prefix):]
+
+        if output.endswith("\n") and output.count("\n") == 1:
+            return OpReply("ACK", output)
+        return OpReply("timeout", output)
+
+
+def parseReply(text):
+    """
+    Returns an OpReply if the text holds a complete reply, or None if
+    we should keep waiting.  The order is the same as in pjexpect:
+    ERR: first, then ACK:, then NoErr.
+    """
+    for status in ("ERR:", "ACK:"):
+        start = text.find(status)
+        if start >= 0:
+            end = text.find("\n", start)
+            if end < 0:
+                return None
+            return OpReply(status[:-1], text[start + len(status):end + 1])
+
+    if "NoErr" in text:
+        return OpReply("NoErr", "")
+
+    return None
+
+
+def queryName(cmd):
+    """
+    Returns the name of the thing a query asks about, like
+    'status.check' for 'op status.check ?', or None if the command
+    isn't a query.
+    """
+    words = cmd.split()
+    if (len(words) == 3) and (words[0] == "op") and (words[2] == "?"):
+        return words[1].lower()
+    return None
+
+
+def isWrite(cmd):
+    """
+    Returns True if the command might change something on the
+    projector, which means it mustn't be sent twice.
+    """
+    return (queryName(cmd) is None) and (" ".join(cmd.split()) not in READONLY)
+
+
+class SwitchSession(object):
+    """
+    A telnet session to one port on a serial switch, which is to say a
+    connection to one projector.  Only one command can be in flight
+    on a session at a time.
+    """
+    def __init__(self, serialSwitch, switchPort):
+        self.serialSwitch = serialSwitch
+        self.switchPort = switchPort
+
+        self.reader = None
+        self.writer = None
+        self.pump = None
+
+        # The bytes received from the projector and not yet used.
+        self.buffer = bytearray()
+        self.pending = b""
+        self.dataReady = None
+        self.lock = None
+
+        self.lastUsed = time.time()
+
+    def isOpen(self):
+        return (self.writer is not None) and not self.pump.done()
+
+    def isBusy(self):
+        return (self.lock is not None) and self.lock.locked()
+
+    async def open(self):
+        host, port = switchAddress(self.serialSwitch, self.switchPort)
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.buffer = bytearray()
+        self.pending = b""
+        self.dataReady = asyncio.Event()
+        self.pump = asyncio.ensure_future(self.readForever())
+        log.info("opened %s/%s", self.serialSwitch, self.switchPort)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.pump.cancel()
+            self.writer = None
+            log.info("closed %s/%s", self.serialSwitch, self.switchPort)
+
+    async def readForever(self):
+        """
+        Copies everything the projector says into the session buffer,
+        with the telnet negotiation stripped out.
+        """
+        try:
+            while True:
+                data = await self.reader.read(1024)
+                if not data:
+                    break
+                self.buffer.extend(self.filterTelnet(data))
+                self.dataReady.set()
+        finally:
+            # Wake up anybody waiting, so they notice the session died.
+            self.dataReady.set()
+
+    def filterTelnet(self, data):
+        """
+        Strips telnet commands out of the incoming data, and refuses
+        whatever options the switch asks for.  A command split across
+        two reads is held over until the next one.
+        """
+        data = self.pending + data
+        self.pending = b""
+
+        out = bytearray()
+        i = 0
+        while i < len(data):
+            b = data[i]
+            if b != IAC:
+                out.append(b)
+                i += 1
+                continue
+
+            if i + 1 >= len(data):
+                self.pending = data[i:]
+                break
+
+            verb = data[i + 1]
+            if verb == IAC:
+                out.append(IAC)
+                i += 2
+            elif verb in (DO, DONT, WILL, WONT):
+                if i + 2 >= len(data):
+                    self.pending = data[i:]
+                    break
+                if verb == DO:
+                    self.writer.write(bytes([IAC, WONT, data[i + 2]]))
+                elif verb == WILL:
+                    self.writer.write(bytes([IAC, DONT, data[i + 2]]))
+                i += 3
+            elif verb == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                if end < 0:
+                    self.pending = data[i:]
+                    break
+                i = end + 2
+            else:
+                i += 2
+
+        return bytes(out)
+
+    async def transact(self, cmds, timeout=TIMEOUT, quiet=QUIET, deadline=None):
+        """
+        Sends a list of commands, one after the other, and returns a
+        list of the replies.  Nobody else gets to use the session until
+        we're done with the whole list.  An ERR from one command doesn't
+        stop the rest.
+
+        Each command gets the given timeout, but none of them will run
+        past the deadline, if there is one.  (The deadline is in the
+        event loop's time.)  Commands we don't get to before the
+        deadline come back as a timeout with no text, and are never
+        sent.
+
+        SwitchUnreachable is only raised if we couldn't get the first
+        command through.  After that, the caller can't just try the
+        whole list again some other way, so the rest come back as ERR.
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        loop = asyncio.get_event_loop()
+
+        # Waiting for somebody else to finish with the session counts
+        # against the deadline, too.
+        try:
+            if deadline is None:
+                await self.lock.acquire()
+            else:
+                await asyncio.wait_for(self.lock.acquire(), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            return [OpReply("timeout", "") for cmd in cmds]
+
+        replies = []
+        try:
+            for cmd in cmds:
+                wait = timeout
+                if deadline is not None:
+                    wait = min(wait, deadline - loop.time())
+                if wait <= 0:
+                    replies.append(OpReply("timeout", ""))
+                    continue
+                try:
+                    replies.append(await self.exchange(cmd, wait, quiet))
+                except SwitchUnreachable as e:
+                    if len(replies) == 0:
+                        raise
+                    replies += [OpReply("ERR", "{0}\n".format(e))] * (len(cmds) - len(replies))
+                    break
+        finally:
+            self.lock.release()
+        return replies
+
+    async def exchange(self, cmd, timeout, quiet):
+        """
+        Sends a command and waits for the reply.  Replies that don't
+        have an ACK: (like the error dump from 'op prerr') are
+        considered finished once the projector has been quiet for the
+        given time.
+
+        If the session turns out to have died since the last time we
+        used it, we open it again and retry once.  If we can't open it
+        at all, that's a SwitchUnreachable.  A command that changes
+        something is never sent twice, though: if the session dies
+        after it went out, it may or may not have got to the projector,
+        and the reply is an ERR saying so.
+        """
+        sent = False
+        for attempt in range(2):
+            self.lastUsed = time.time()
+            try:
+                if not self.isOpen():
+                    await asyncio.wait_for(self.open(), timeout)
+
+                # Anything left over from a previous command is stale.
+                del self.buffer[:]
+                self.dataReady.clear()
+
+                sent = True
+                self.writer.write((cmd + "\r").encode("utf-8"))
+                await self.writer.drain()
+
+                reply = await self.collect(cmd, timeout, quiet)
+                self.lastUsed = time.time()
+                return reply
+
+            except (OSError, asyncio.TimeoutError) as e:
+                log.warning("%s/%s: %s", self.serialSwitch, self.switchPort, e)
+                self.close()
+                error = e
+                if sent and isWrite(cmd):
+                    return OpReply("ERR", "'{0}' may or may not have got through, so it was not sent again: {1}\n".format(cmd, e))
+
+        raise SwitchUnreachable("cannot reach {0}/{1}: {2}".format(self.serialSwitch,
+                                                                   self.switchPort,
+                                                                   error))
+
+    async def collect(self, cmd, timeout, quiet):
+        """
+        Reads from the session buffer until the reply is complete.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        heardSomething = False
+
+        while True:
+            text = self.buffer.decode("utf-8", "replace")
+            reply = parseReply(text)
+            if reply is not None:
+                return reply
+
+            # Is there anything there besides the echo of our command?
+            if text.replace(cmd, "").strip():
+                heardSomething = True
+
+            if not self.isOpen():
+                self.close()
+                if not heardSomething:
+                    raise ConnectionResetError("connection closed by the switch")
+                return OpReply("timeout", text)
+
+            wait = deadline - loop.time()
+            if heardSomething:
+                wait = min(wait, quiet)
+            if wait <= 0:
+                return OpReply("timeout", text)
+
+            self.dataReady.clear()
+            try:
+                await asyncio.wait_for(self.dataReady.wait(), wait)
+            except asyncio.TimeoutError:
+                return OpReply("timeout", self.buffer.decode("utf-8", "replace"))
+
+
+class OpClient(object):
+    """
+    Keeps a collection of switch sessions, one for each switch port
+    we have talked to, and sends commands over them.  Sessions stay
+    open between commands.
+    """
+    def __init__(self, timeout=TIMEOUT, quiet=QUIET):
+        self.timeout = timeout
+        self.quiet = quiet
+
+        # Sessions, indexed by (serialSwitch, switchPort).
+        self.sessions = dict()
+
+    def getSession(self, serialSwitch, switchPort):
+        key = (serialSwitch, str(switchPort))
+        if key not in self.sessions:
+            self.sessions[key] = SwitchSession(serialSwitch, str(switchPort))
+        return self.sessions[key]
+
+    async def transact(self, serialSwitch, switchPort, cmds, timeout=None,
+                       deadline=None, budget=None):
+        """
+        Sends a list of commands to the projector on the given switch
+        port and returns the list of OpReply objects.  Raises
+        SwitchUnreachable if we can't get through to the port.
+
+        The deadline is in the event loop's time.  Instead, you can
+        give a budget, which is the number of seconds from now that
+        the whole list can take.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        if (deadline is None) and (budget is not None):
+            deadline = asyncio.get_event_loop().time() + budget
+
+        session = self.getSession(serialSwitch, switchPort)
+        return await session.transact(cmds, timeout, self.quiet, deadline)
+
+    async def send(self, serialSwitch, switchPort, cmd, timeout=None, deadline=None):
+        """
+        Sends one command, and returns the OpReply.
+        """
+        replies = await self.transact(serialSwitch, switchPort, [cmd], timeout, deadline)
+        return replies[0]
+
+    async def gather(self, requests, timeout=None, deadline=None):
+        """
+        Runs a collection of requests at the same time, and returns
+        the replies in the same order.  Each request is a tuple of
+        (serialSwitch, switchPort, cmds).  A request for a port we
+        can't reach comes back as the SwitchUnreachable exception in
+        place of its list of replies.
+        """
+        return await asyncio.gather(*[self.transact(serialSwitch, switchPort, cmds,
+                                                    timeout, deadline)
+                                      for serialSwitch, switchPort, cmds in requests],
+                                    return_exceptions=True)
+
+    def closeIdle(self, idle):
+        """
+        Closes the sessions that haven't been used in the last 'idle'
+        seconds, so we don't hog switch ports nobody is using.
+        """
+        now = time.time()
+        for session in self.sessions.values():
+            if session.isOpen() and (now - session.lastUsed > idle) and not session.isBusy():
+                session.close()
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+
+    async def shutdown(self):
+        """
+        Closes all the sessions, and waits for them to finish.
+        """
+        pumps = [session.pump for session in self.sessions.values() if session.isOpen()]
+        self.close()
+        if pumps:
+            await asyncio.wait(pumps)
+
+
+class BlockingClient(object):
+    """
+    An OpClient for code that isn't written for asyncio.  It runs its
+    own event loop in a background thread, and the methods here block
+    until the replies are in.  It's fine to call them from several
+    threads at once.
+    """
+    def __init__(self, timeout=TIMEOUT, quiet=QUIET):
+        self.loop = asyncio.new_event_loop()
+        self.client = OpClient(timeout, quiet)
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def transact(self, serialSwitch, switchPort, cmds, timeout=None, budget=None):
+        """
+        Sends a list of commands to a projector, and returns the list
+        of OpReply objects.  If there's a budget, the whole list gets
+        no more than that many seconds.  Raises SwitchUnreachable if we
+        can't get through.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.client.transact(serialSwitch,
+                                                                       switchPort,
+                                                                       cmds,
+                                                                       timeout,
+                                                                       budget=budget),
+                                                  self.loop)
+        return future.result()
+
+    def close(self):
+        """
+        Closes the sessions and stops the event loop thread.
+        """
+        asyncio.run_coroutine_threadsafe(self.client.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
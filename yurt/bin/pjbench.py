@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+#
+# Times the projector control tools against the simulator (pjsim.py),
+# so we can tell whether a change made things faster or slower before
+# trying it on the YURT.  It starts a simulator, makes a projector
+# database to match it, and then measures:
+#
+#   send    -- the round trip for one query, one projector at a time,
+#              from inside pjcontrol (ProjectorControl.send), and the
+#              time to ask every projector at once.
+#
+#   gather  -- the wall-clock time of 'pjcontrol -G'.
+#
+#   range   -- the wall-clock time of range commands, like
+#              'pjcontrol 0-68 pow'.
+#
+# Each of these runs with pjcontrol talking to the switches directly,
+# and with --broker, through pjbroker as well.  For example:
+#
+#   pjbench.py --latency 0.1 --jitter 0.05 --repeat 5 --broker
+#
+# The query cache is turned off throughout, so every answer comes from
+# the simulator.  A pjcontrol run that fails (exits with anything but
+# 0) isn't timed; it's counted separately, and its last line of stderr
+# is printed.
+#
+
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pjsim
+
+BINDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(times, fraction):
+    """
+    Returns the given fraction (0.95, say) percentile of a list of
+    times.
+    """
+    ordered = sorted(times)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(name, runs):
+    """
+    Prints a line of statistics about a list of times, in seconds.
+    The runs that failed are None in the list, and are only counted.
+    """
+    times = [t for t in runs if t is not None]
+    failed = len(runs) - len(times)
+    if len(times) == 0:
+        print("{0:<28} no runs {1:>41}".format(name, failed))
+        return
+    print("{0:<28} {1:>5} {2:>9.4f} {3:>9.4f} {4:>9.4f} {5:>9.4f} {6:>6}".format(name,
+                                                                                  len(times),
+                                                                                  sum(times) / len(times),
+                                                                                  percentile(times, 0.5),
+                                                                                  percentile(times, 0.95),
+                                                                                  max(times),
+                                                                                  failed))
+
+
+def waitForFile(path, process, timeout=30.0):
+    """
+    Waits for a process to write a file, which is how we know it's
+    ready.
+    """
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None:
+            sys.exit("ERR: {0} exited early.".format(" ".join(process.args)))
+        if time.time() > deadline:
+            sys.exit("ERR: gave up waiting for {0}.".format(path))
+        time.sleep(0.1)
+
+
+def pjcontrol(args, env):
+    """
+    Runs pjcontrol with the given arguments, and returns how long it
+    took, or None if it failed, after saying why.
+    """
+    start = time.time()
+    result = subprocess.run([sys.executable, os.path.join(BINDIR, "pjcontrol.py")] + args,
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.time() - start
+
+    if result.returncode != 0:
+        lines = result.stderr.decode("utf-8", "replace").strip().splitlines()
+        print("ERR: 'pjcontrol {0}' exited with {1}{2}".format(" ".join(args), result.returncode,
+                                                               (": " + lines[-1]) if lines else ""),
+              file=sys.stderr)
+        return None
+    return elapsed
+
+
+def makeDatabase(count, env):
+    """
+    Adds a projector for each simulated one to the database, and
+    installs it at the matching switch and port.
+    """
+    for n, serialSwitch, switchPort in pjsim.layout(count):
+        serialNo = "SIM{0:05d}".format(n)
+        if (pjcontrol(["-a", "-s", serialNo, "-d", "2016-01-01"], env) is None) or \
+           (pjcontrol([str(n), "install", serialNo, serialSwitch, switchPort, "wall"], env) is None):
+            sys.exit("ERR: could not add {0} to the database.".format(serialNo))
+
+
+def benchSend(count, sends, repeat):
+    """
+    Times ProjectorControl.send() inside this process, one projector
+    after another, and then every projector at once.
+    """
+    import pjcontrol
+
+    controls = dict()
+    for n, serialSwitch, switchPort in pjsim.layout(count):
+        serialNo = "SIM{0:05d}".format(n)
+        pjcontrol.projs[serialNo] = pjcontrol.Projector(serialNo, "2016-01-01", "long")
+        controls[n] = pjcontrol.ProjectorControl(n, serialNo, serialSwitch, switchPort, "wall")
+
+    sequential = []
+    together = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+
+        # The first one opens the sessions, so don't count it.
+        pjcontrol.runConcurrently(sorted(controls),
+                                  lambda n: controls[n].send("op status.check ?"))
+
+        for i in range(sends):
+            start = time.time()
+            controls[i % count].send("op status.check ?")
+            sequential.append(time.time() - start)
+
+        for i in range(repeat):
+            start = time.time()
+            pjcontrol.runConcurrently(sorted(controls),
+                                      lambda n: controls[n].send("op status.check ?"))
+            together.append(time.time() - start)
+
+    pjcontrol.directClient.close()
+    return sequential, together
+
+
+def benchmark(label, count, args, env):
+    """
+    Runs all the benchmarks asked for, with the given environment, and
+    prints the results.
+    """
+    last = str(count - 1)
+    results = []
+
+    if "send" in args.tests:
+        # The send benchmark runs in this process, so it needs the
+        # environment here.
+        saved = dict(os.environ)
+        os.environ.update(env)
+        try:
+            sequential, together = benchSend(count, args.sends, args.repeat)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        results.append(("send (one at a time)", sequential))
+        results.append(("send (all {0})".format(count), together))
+
+    if "gather" in args.tests:
+        results.append(("pjcontrol -G",
+                        [pjcontrol(["-G"], env) for i in range(args.repeat)]))
+
+    if "range" in args.tests:
+        for cmd in ["pow", "stereo", "version"]:
+            results.append(("pjcontrol 0-{0} {1}".format(last, cmd),
+                            [pjcontrol(["0-" + last, cmd], env) for i in range(args.repeat)]))
+
+    print("")
+    print("{0:<28} {1:>5} {2:>9} {3:>9} {4:>9} {5:>9} {6:>6}".format(label, "runs", "mean", "p50", "p95", "max", "failed"))
+    for name, runs in results:
+        summarize(name, runs)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Times pjcontrol and friends against the projector simulator.')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=69,
+                        help='How many projectors to simulate.')
+    parser.add_argument('-l', '--latency', dest='latency', type=float, default=0.05,
+                        help='Seconds a simulated projector takes to answer.')
+    parser.add_argument('-j', '--jitter', dest='jitter', type=float, default=0.05,
+                        help='Up to this many more seconds, at random.')
+    parser.add_argument('--stuck', dest='stuck', default='',
+                        help='Projectors that never answer, like 6,40-42.')
+    parser.add_argument('--base', dest='base', type=int, default=17000,
+                        help='Simulated projector n listens on port base + n.')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='How many times to run each benchmark.')
+    parser.add_argument('-s', '--sends', dest='sends', type=int, default=100,
+                        help='How many single queries to time.')
+    parser.add_argument('-t', '--tests', dest='tests', default='send,gather,range',
+                        help='Which benchmarks to run, out of send, gather and range.')
+    parser.add_argument('--broker', dest='broker', action='store_true',
+                        help='Run the benchmarks through pjbroker, too.')
+    parser.add_argument('--brokerPort', dest='brokerPort', type=int, default=15460,
+                        help='Port for the broker to listen on.')
+    parser.add_argument('-d', '--dir', dest='dir', default=None,
+                        help='Directory for the database and switch map.  A new temporary one if not given.  If it already has a database, we use it.')
+    args = parser.parse_args()
+    args.tests = args.tests.split(",")
+
+    if args.dir is None:
+        workDir = tempfile.mkdtemp(prefix="pjbench")
+    else:
+        workDir = args.dir
+        os.makedirs(workDir, exist_ok=True)
+    switchMap = os.path.join(workDir, "switchmap.json")
+    database = os.path.join(workDir, "projector.db")
+    if os.path.exists(switchMap):
+        os.remove(switchMap)
+
+    env = dict(os.environ)
+    env.update({"PROJECTORDB": database,
+                "PJSWITCHMAP": switchMap,
+                "PJCONTROLLOG": "",
+                "PJCACHE": "",
+                "PJBROKER": ""})
+
+    processes = []
+    try:
+        sim = subprocess.Popen([sys.executable, os.path.join(BINDIR, "pjsim.py"),
+                                "--count", str(args.count),
+                                "--base", str(args.base),
+                                "--map", switchMap,
+                                "--latency", str(args.latency),
+                                "--jitter", str(args.jitter),
+                                "--stuck", args.stuck,
+                                "--on"],
+                               stdout=subprocess.DEVNULL)
+        processes.append(sim)
+        waitForFile(switchMap, sim)
+
+        if not any(os.path.exists(name) for name in [database, database + ".db", database + ".dat"]):
+            print("making a database of {0} projectors in {1}".format(args.count, workDir))
+            makeDatabase(args.count, env)
+
+        benchmark("direct", args.count, args, env)
+
+        if args.broker:
+            brokerAddress = "localhost:{0}".format(args.brokerPort)
+            brokerLog = os.path.join(workDir, "pjbroker.log")
+            broker = subprocess.Popen([sys.executable, os.path.join(BINDIR, "pjbroker.py"),
+                                       "--listen", brokerAddress,
+                                       "--log", brokerLog],
+                                      env=env, stdout=subprocess.DEVNULL)
+            processes.append(broker)
+            waitForFile(brokerLog, broker)
+
+            brokerEnv = dict(env)
+            brokerEnv["PJBROKER"] = brokerAddress
+            benchmark("broker", args.count, args, brokerEnv)
+
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+#
+# A broker for the serial switches.  Every projector in the YURT hangs
+# off a port on one of the serial switches, and the only way to talk
+# to it is to telnet to that port on the switch.  Without the broker,
+# each pjcontrol command does an ssh to cave001, runs pjexpect, which
+# opens a telnet session, sends one command, and then tears it all
+# down again.  That costs a couple of seconds per command before the
+# projector even hears about it.
+#
+# The broker runs on the head node and keeps the telnet sessions to the
+# switch ports open.  Clients (pjcontrol, mostly) connect to it and
+# send one request per line, as JSON:
+#
+#   {"proj": "proj42", "switch": "switch03", "port": "10014", "cmd": "op powon"}
+#
+# and get back one line of JSON with the projector's reply:
+#
+#   {"status": "ACK", "text": " POWON\r\n"}
+#
+# where the status is one of ACK, ERR, NoErr or timeout, just the way
+# pjexpect sorts them out.  A request can also carry a list of
+# commands, as "cmds", which are run one after the other on the same
+# session.  The answer to that is a list of replies, as "replies".  If
+# the request has a "budget", the whole list gets no more than that
+# many seconds, and the commands we don't get to come back as timeouts.
+#
+# The talking to the projectors is done by opclient.py.  Run the
+# broker like this:
+#
+#   pjbroker.py -l cave001:5460
+#
+# and set PJBROKER=cave001:5460 in the environment of pjcontrol.
+#
+
+import asyncio
+import json
+import logging
+import socket
+
+from opclient import OpClient, OpReply, SwitchUnreachable, isWrite
+
+# The default place to listen, if neither the command line nor the
+# environment says otherwise.
+BROKERADDRESS = "localhost:5460"
+
+
+def parseAddress(address):
+    """
+    Splits a 'host:port' string into a (host, port) tuple.
+    """
+    host, port = address.rsplit(":", 1)
+    return (host, int(port))
+
+
+class RequestLost(Exception):
+    """
+    The broker went away after a request was sent to it, so its
+    commands may or may not have got to the projector.
+    """
+    pass
+
+
+def lostReplies(error, cmds):
+    """
+    Decides what to do about a RequestLost.  If the commands only ask
+    for things, it does no harm to send them again, so it's an OSError
+    like any other, and the caller can try another way.  Otherwise,
+    rather than risk sending them twice, the replies are ERR.
+    """
+    if not any(isWrite(cmd) for cmd in cmds):
+        raise ConnectionError(str(error))
+    return [OpReply("ERR", "{0}  Not sent again.\n".format(error))] * len(cmds)
+
+
+def brokerRequest(address, request, timeout):
+    """
+    Sends a request to the broker at the given address, and returns
+    its answer.  Raises OSError if the broker can't be reached, and
+    RequestLost if it goes away once it has the request.
+    """
+    with socket.create_connection(parseAddress(address), timeout) as s:
+        try:
+            s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            line = s.makefile("r", encoding="utf-8").readline()
+        except OSError as e:
+            raise RequestLost("Lost the broker at {0}: {1}.".format(address, e))
+
+    if not line:
+        raise RequestLost("The broker at {0} hung up.".format(address))
+
+    return json.loads(line)
+
+
+def brokerSend(address, proj, serialSwitch, switchPort, cmd, timeout=30.0):
+    """
+    Sends one command to a projector through the broker at the given
+    address, and returns the reply as an OpReply.  Raises OSError if
+    the broker can't be reached.
+    """
+    try:
+        reply = brokerRequest(address,
+                              {"proj": proj,
+                               "switch": serialSwitch,
+                               "port": switchPort,
+                               "cmd": cmd},
+                              timeout)
+    except RequestLost as e:
+        return lostReplies(e, [cmd])[0]
+    return OpReply(reply["status"], reply["text"])
+
+
+def brokerSendMany(address, proj, serialSwitch, switchPort, cmds, timeout=30.0,
+                   budget=None):
+    """
+    Sends a list of commands to a projector through the broker, all in
+    one session, and returns a list of OpReply objects, one for each
+    command.  The timeout applies to each command.  If there's a
+    budget, the broker gives the whole list no more than that many
+    seconds.  Raises OSError if the broker can't be reached, or if it
+    goes away while working on commands that only ask for things.
+    """
+    request = {"proj": proj,
+               "switch": serialSwitch,
+               "port": switchPort,
+               "cmds": list(cmds)}
+    if budget is None:
+        timeout = timeout * max(1, len(cmds))
+    else:
+        request["budget"] = budget
+        timeout = budget + timeout
+
+    try:
+        answer = brokerRequest(address, request, timeout)
+    except RequestLost as e:
+        return lostReplies(e, cmds)
+    if "replies" not in answer:
+        # The whole request failed.
+        return [OpReply(answer["status"], answer["text"])] * len(cmds)
+
+    return [OpReply(reply["status"], reply["text"]) for reply in answer["replies"]]
+
+
+class BrokerSession(object):
+    """
+    A connection to the broker for asyncio code, kept open from one
+    request to the next.  Requests go one at a time; use a session
+    for each thing (each projector, say) that shouldn't wait for the
+    others.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.reader = None
+        self.writer = None
+        self.lock = None
+
+    async def request(self, request, resend=True):
+        """
+        Sends a request, and returns the broker's answer.  If the
+        connection has gone away since the last one, we open it again
+        and try once more.  Raises OSError if the broker can't be
+        reached.  If it goes away after it has the request, and
+        'resend' is False, that's a RequestLost instead.
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        async with self.lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    if (self.writer is not None) and self.reader.at_eof():
+                        # The broker hung up while we weren't looking.
+                        self.close()
+                    if self.writer is None:
+                        self.reader, self.writer = await asyncio.open_connection(*parseAddress(self.address))
+                    sent = True
+                    self.writer.write((json.dumps(request) + "\n").encode("utf-8"))
+                    await self.writer.drain()
+                    line = await self.reader.readline()
+                    if line:
+                        return json.loads(line.decode("utf-8"))
+                    error = ConnectionError("The broker at {0} hung up.".format(self.address))
+                except OSError as e:
+                    error = e
+                    if sent:
+                        error = ConnectionError("Lost the broker at {0}: {1}.".format(self.address, e))
+
+                self.close()
+                if sent and not resend:
+                    raise RequestLost(str(error))
+
+            raise error
+
+    async def sendMany(self, proj, serialSwitch, switchPort, cmds, budget=None):
+        """
+        The same as brokerSendMany(), for asyncio code.  Commands that
+        change something aren't sent again if the broker goes away.
+        """
+        request = {"proj": proj,
+                   "switch": serialSwitch,
+                   "port": switchPort,
+                   "cmds": list(cmds)}
+        if budget is not None:
+            request["budget"] = budget
+
+        resend = not any(isWrite(cmd) for cmd in cmds)
+        try:
+            answer = await self.request(request, resend)
+        except RequestLost as e:
+            return lostReplies(e, cmds)
+        if "replies" not in answer:
+            return [OpReply(answer["status"], answer["text"])] * len(cmds)
+
+        return [OpReply(reply["status"], reply["text"]) for reply in answer["replies"]]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class Broker(object):
+    """
+    Serves requests from clients, using one OpClient for all of them,
+    so the switch sessions stay open from one client to the next.
+    """
+    def __init__(self, timeout, quiet, idle):
+        self.client = OpClient(timeout, quiet)
+        self.idle = idle
+
+    async def handleClient(self, reader, writer):
+        """
+        Serves one client connection.  Each line is a request, and gets
+        one line of reply.
+        """
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            try:
+                request = json.loads(line.decode("utf-8"))
+
+                # A request has either one command, or a list of them.
+                if "cmds" in request:
+                    cmds = list(request["cmds"])
+                else:
+                    cmds = [request["cmd"]]
+
+                try:
+                    replies = await self.client.transact(request["switch"],
+                                                         request["port"],
+                                                         cmds,
+                                                         budget=request.get("budget"))
+                except SwitchUnreachable as e:
+                    replies = [OpReply("ERR", "{0}\n".format(e))] * len(cmds)
+
+                for cmd, reply in zip(cmds, replies):
+                    logging.info("%s %s/%s %s -> %s", request.get("proj", "?"),
+                                 request["switch"], request["port"],
+                                 cmd, reply.status)
+
+                if "cmds" in request:
+                    answer = {"replies": [reply.toDict() for reply in replies]}
+                else:
+                    answer = replies[0].toDict()
+            except (ValueError, KeyError, TypeError) as e:
+                answer = {"status": "ERR", "text": "bad request: {0}\n".format(e)}
+
+            writer.write((json.dumps(answer) + "\n").encode("utf-8"))
+            await writer.drain()
+
+        writer.close()
+
+    async def closeIdleSessions(self):
+        """
+        Every so often, close the sessions that haven't been used in a
+        while.
+        """
+        while True:
+            await asyncio.sleep(self.idle / 4.0)
+            self.client.closeIdle(self.idle)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Keeps telnet sessions to the serial switch ports open and forwards projector commands to them.')
+    parser.add_argument('-l', '--listen', dest='listen',
+                        default=os.environ.get("PJBROKER", BROKERADDRESS),
+                        help='Address to listen on, as host:port.  Defaults to $PJBROKER or {0}.'.format(BROKERADDRESS))
+    parser.add_argument('-t', '--timeout', dest='timeout', type=float, default=10.0,
+                        help='Seconds to wait for a projector to answer. (Same as pjexpect.)')
+    parser.add_argument('-q', '--quiet', dest='quiet', type=float, default=1.0,
+                        help='Seconds of silence after which a reply without an ACK (like an error dump) is considered complete.')
+    parser.add_argument('-i', '--idle', dest='idle', type=float, default=300.0,
+                        help='Seconds after which an unused switch session is closed.')
+    parser.add_argument('--log', dest='log', default='/tmp/pjbroker.log',
+                        help='Log file.')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,
+                        format='%(asctime)s pjbroker: %(message)s',
+                        level=logging.INFO)
+
+    broker = Broker(args.timeout, args.quiet, args.idle)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    host, port = parseAddress(args.listen)
+    server = loop.run_until_complete(asyncio.start_server(broker.handleClient, host, port))
+    asyncio.ensure_future(broker.closeIdleSessions())
+
+    print("listening on ", args.listen)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.close()
+    broker.client.close()
+    loop.close()
@@ -0,0 +1,204 @@
+#
+# A cache of the projectors' answers to status queries, shared by
+# every process that uses the same cache directory.  pjcontrol, the
+# projd clients and yurtcol ask the same few questions ('op
+# status.check ?', 'op lamp.hours ?' and so on) over and over, and
+# each one costs a trip over the serial line.  The answers don't
+# change that quickly, so we keep them for a while.
+#
+# Each answer is kept in its own little file, under a directory for
+# the projector number:
+#
+#   /tmp/pjcache-jdoe/42/status.check
+#
+# which makes it easy for different processes to share the cache
+# without any locking.  The cache directory belongs to one user, and
+# nobody else can read or write it, since whatever is in there is
+# taken to be what the projector said.  If it turns out to belong to
+# somebody else, or anybody else can get at it, we don't use it.
+#
+# Any command that changes something on a projector throws away
+# everything cached for that projector, and bumps its generation (a
+# token kept next to its directory).  An answer that was asked for
+# before the generation changed isn't stored, since it might be stale
+# already.
+#
+# How long an answer is good for depends on the query, see TTLS.  You
+# can change them with the PJCACHETTL environment variable, like this:
+#
+#   PJCACHETTL="status.check=2,lamp.hours=300"
+#
+
+import json
+import os
+import stat
+import tempfile
+import time
+import uuid
+
+from opclient import OpReply, queryName
+
+# The queries we cache, and the number of seconds their answers are
+# good for.
+TTLS = {"status.check": 5,
+        "lamp.pow": 60,
+        "s3d.mode": 60,
+        "lamp.hours": 600,
+        "soft.version": 86400}
+
+
+def parseTTLs(spec):
+    """
+    Reads a string like 'status.check=2,lamp.hours=300' into a
+    dictionary of TTLs.
+    """
+    ttls = dict()
+    for item in spec.split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            ttls[name.strip().lower()] = float(seconds)
+    return ttls
+
+
+class QueryCache(object):
+    """
+    The cache itself.  Set 'fresh' to True to skip the lookups (but
+    still remember the answers we get).  Raises OSError if the
+    directory can't be made, or isn't safe to use.
+    """
+    def __init__(self, directory, ttls=None):
+        self.directory = directory
+        self.ttls = dict(TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.fresh = False
+
+        self.makeDirectory(self.directory)
+        self.checkDirectory(self.directory)
+
+    def makeDirectory(self, path):
+        """
+        Makes a directory only we can get into.
+        """
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            # Somebody beat us to it, or it was there already.
+            pass
+
+    def checkDirectory(self, path):
+        """
+        Makes sure the cache directory is a real directory, that it's
+        ours, and that nobody else can read or write it.
+        """
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode):
+            raise NotADirectoryError("{0} is not a directory".format(path))
+        if info.st_uid != os.getuid():
+            raise PermissionError("{0} belongs to somebody else".format(path))
+        if info.st_mode & 0o077:
+            raise PermissionError("{0} can be used by other people (mode {1:o})".format(path, stat.S_IMODE(info.st_mode)))
+
+    def entryPath(self, number, name):
+        return os.path.join(self.directory, str(number), name)
+
+    def generationPath(self, number):
+        return os.path.join(self.directory, "{0}.generation".format(number))
+
+    def generation(self, number):
+        """
+        Returns the projector's generation, which changes every time
+        its entries are thrown away.  Get it before asking the
+        projector anything, and hand it to store() with the answer.
+        """
+        try:
+            with open(self.generationPath(number), "r") as f:
+                return f.read()
+        except OSError:
+            return ""
+
+    def cacheable(self, cmd):
+        name = queryName(cmd)
+        if (name is None) or (self.ttls.get(name, 0) <= 0):
+            return None
+        return name
+
+    def lookup(self, number, cmd):
+        """
+        Returns the cached OpReply for this query on this projector,
+        or None if we don't have one that's recent enough.
+        """
+        name = self.cacheable(cmd)
+        if self.fresh or (name is None):
+            return None
+
+        try:
+            with open(self.entryPath(number, name), "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry["recorded"] > self.ttls[name]:
+            return None
+
+        return OpReply(entry["status"], entry["text"])
+
+    def store(self, number, cmd, reply, generation=None):
+        """
+        Remembers the reply to a query.  Only proper answers (ACK) are
+        kept.  If the projector's generation isn't the one given any
+        more, something has changed it since we asked, and the answer
+        isn't kept.
+        """
+        name = self.cacheable(cmd)
+        if (name is None) or (reply.status != "ACK"):
+            return
+        if (generation is not None) and (self.generation(number) != generation):
+            return
+
+        directory = os.path.join(self.directory, str(number))
+        path = self.entryPath(number, name)
+
+        # Write it somewhere else and move it into place, so nobody
+        # ever reads half an entry.  (mkstemp makes it 0600.)
+        try:
+            self.makeDirectory(directory)
+            fd, tmpName = tempfile.mkstemp(dir=directory, prefix=".")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"status": reply.status,
+                           "text": reply.text,
+                           "recorded": time.time()}, f)
+            os.replace(tmpName, path)
+
+            # If it was thrown away while we were writing, invalidate()
+            # may have missed this entry, so it goes now.
+            if (generation is not None) and (self.generation(number) != generation):
+                os.remove(path)
+        except OSError:
+            pass
+
+    def invalidate(self, number):
+        """
+        Forgets everything we know about a projector.  The generation
+        changes first, so that anybody storing an answer right now
+        knows to throw it away.
+        """
+        try:
+            fd, tmpName = tempfile.mkstemp(dir=self.directory, prefix=".")
+            with os.fdopen(fd, "w") as f:
+                f.write(uuid.uuid4().hex)
+            os.replace(tmpName, self.generationPath(number))
+        except OSError:
+            pass
+
+        directory = os.path.join(self.directory, str(number))
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+
+        for name in names:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
@@ -42,23 +42,77 @@
 # Tom Sgouros 05/2015
 #
 
-import shelve
 import re
 
 import subprocess
 import datetime
+import time
 
 import logging
 import os
 import socket
 import sys
 
+import atexit
+import concurrent.futures
+import threading
+
+import opclient
+import pjbroker
+import pjcache
+import pjstore
+import telemetryStore
+
 # This holds a bunch of projector objects, indexed by serial number.
 projs = dict()
 
 # This holds a bunch of ProjectorControl objects, indexed by position number.
 projControls = dict()
 
+# The projectors' error logs.  (See pjstore.py.)
+errorLog = None
+
+# The queries used to record a projector's hours and color settings.
+# The colors are in the order of Projector.colorSettings.
+HOURSQUERIES = ["op total.hours ?", "op lamp.hours ?"]
+COLORQUERIES = ["op red.offset ?", "op green.offset ?", "op blue.offset ?",
+                "op red.gain ?", "op green.gain ?", "op blue.gain ?",
+                "op color.temp ?", "op gamma ?"]
+
+# The cache of answers to status queries, if we're using one.
+queryCache = None
+
+# The number of seconds each projector gets to answer everything in a
+# gather before we give up on it.
+GATHERBUDGET = float(os.environ.get("PJBUDGET", "60"))
+
+# If this names a file, every gather records the hours and color
+# settings there, as well, to keep track of them over time.  See
+# telemetryStore.py.
+TELEMETRY = os.environ.get("PJTELEMETRY", "")
+
+# How many projectors on the same serial switch we are willing to talk
+# to at once.  (Only one at a time per switch port, no matter what.)
+PERSWITCH = int(os.environ.get("PJPERSWITCH", "4"))
+
+# With --wait, the number of seconds we wait for the projectors to
+# finish warming up (or cooling down) before we give up on them.
+POWERDEADLINE = float(os.environ.get("PJPOWERDEADLINE", "300"))
+
+# How often to ask a projector whether it's warmed up yet.  We start
+# at POLLFIRST seconds between asks, and stretch it by POLLGROWTH each
+# time, up to POLLMAX.
+POLLFIRST = 2.0
+POLLGROWTH = 1.5
+POLLMAX = 10.0
+
+# How long a projector gets to answer one of those asks.  A projector
+# that doesn't answer shouldn't hold up the others for long.
+POLLTIMEOUT = 3.0
+
+# What the numbers from 'op status.check ?' mean.
+POWERSTATES = {0: "standby", 1: "warming up", 2: "on", 3: "cooling down"}
+
 
 class RepairRecord(object):
     """
@@ -122,25 +176,129 @@ class ProjectorControl(object):
         """
         Sends a command to the projector.
 
-        Should just become a subprocess.call(pjexpect...).
-
         Note that we need to return whatever the output is from
-        issuing this command.
+        issuing this command.  It looks just the way pjexpect prints
+        it.
         """
-        if self.projector != "none":
-            print("proj{0}".format(self.number), self.serialSwitch, self.switchPort, "cmd =", cmd)
+        if self.projector == "none":
+            return ""
+
+        print("proj{0}".format(self.number), self.serialSwitch, self.switchPort, "cmd =", cmd)
+
+        reply = self.transmit([cmd])[0]
+        return reply.format("proj{0:02d}".format(self.number), cmd)
+
+    def sendMany(self, cmds, budget=None):
+        """
+        Sends a list of commands to the projector, all in one session,
+        and returns a list of the replies, as opclient.OpReply objects.
+        An error on one command doesn't stop the others.
+
+        If there's a budget, the whole list gets no more than that
+        many seconds, and the commands that didn't get done in time
+        come back as timeouts.
+        """
+        if self.projector == "none":
+            return [opclient.OpReply("ERR", "no projector installed\n")] * len(cmds)
+
+        print("proj{0}".format(self.number), self.serialSwitch, self.switchPort, "cmds =", "; ".join(cmds))
+
+        return self.transmit(cmds, budget)
+
+    def transmit(self, cmds, budget=None, fresh=False):
+        """
+        Gets the commands to the projector, or gets the answers from
+        the query cache, if there is one (see pjcache.py and the
+        PJCACHE environment variable).  Only the queries we don't have
+        recent answers for are sent.  Any command that changes
+        something on the projector throws out what we have cached for
+        it, and in that case none of the answers in this batch come
+        from the cache.  Neither do they if 'fresh' is True, though
+        the answers are still cached for the next guy.
+        """
+        if queryCache is None:
+            return self.deliver(cmds, budget)
+
+        writes = [cmd for cmd in cmds if opclient.isWrite(cmd)]
+        generation = queryCache.generation(self.number)
+
+        replies = [None] * len(cmds)
+        if (len(writes) == 0) and not fresh:
+            replies = [queryCache.lookup(self.number, cmd) for cmd in cmds]
+
+        missing = [i for i, reply in enumerate(replies) if reply is None]
+        if len(missing) > 0:
+            delivered = self.deliver([cmds[i] for i in missing], budget)
+            for i, reply in zip(missing, delivered):
+                replies[i] = reply
+
+        if len(writes) > 0:
+            queryCache.invalidate(self.number)
+        else:
+            for i in missing:
+                queryCache.store(self.number, cmds[i], replies[i], generation)
+
+        return replies
+
+    def deliver(self, cmds, budget=None):
+        """
+        Gets the commands to the projector.  If there is a broker
+        running (see pjbroker.py and the PJBROKER environment
+        variable), they go through there, using a switch session that
+        is already open.  Otherwise we talk to the switch ourselves,
+        with opclient.py.  If we can't reach the switch from here
+        (or PJDIRECT is 0), we do it the old way, with ssh and
+        pjexpect.
+
+        We only move on to the next way if nothing that changes the
+        projector may have been sent already.  Otherwise, the broker
+        and opclient answer ERR for those commands instead.
+        """
+        proj = "proj{0:02d}".format(self.number)
+
+        broker = os.environ.get("PJBROKER", "")
+        if broker != "":
+            try:
+                return pjbroker.brokerSendMany(broker, proj,
+                                               self.serialSwitch,
+                                               self.switchPort,
+                                               cmds,
+                                               budget=budget)
+            except OSError:
+                # No broker, so try the next thing.
+                pass
+
+        if directClient.usable(self.serialSwitch):
+            try:
+                return directClient.transact(self.serialSwitch, self.switchPort, cmds, budget)
+            except opclient.SwitchUnreachable:
+                directClient.unreachable(self.serialSwitch)
+
+        try:
             cmdOut = subprocess.run(["ssh",
                                      "cave001",
-                                     "/gpfs/runtime/opt/cave-utils/yurt/bin/pjexpect", 
-                                     "proj{0:02d}".format(self.number),
+                                     "/gpfs/runtime/opt/cave-utils/yurt/bin/pjexpect",
+                                     proj,
                                      "do",
                                      self.serialSwitch,
-                                     self.switchPort,
-                                     "\"{0}\"".format(cmd),
-                                     "2>/dev/null"],
+                                     self.switchPort] +
+                                    ["\"{0}\"".format(cmd) for cmd in cmds] +
+                                    ["2>/dev/null"],
                                     stdout=subprocess.PIPE,
-                                    stderr=subprocess.DEVNULL)
-        return cmdOut.stdout.decode("utf-8")
+                                    stderr=subprocess.DEVNULL,
+                                    timeout=budget)
+            out = cmdOut.stdout.decode("utf-8")
+        except subprocess.TimeoutExpired as e:
+            out = (e.output or b"").decode("utf-8")
+
+        if len(cmds) > 1:
+            outputs = out.split("\n--pjexpect--\n")
+        else:
+            outputs = [out]
+        # If pjexpect died partway through, the rest get nothing.
+        outputs = (outputs + [""] * len(cmds))[:len(cmds)]
+
+        return [opclient.OpReply.parse(output, proj) for output in outputs]
 
     def getInt(self, string):
         """
@@ -163,7 +321,31 @@ class ProjectorControl(object):
         if self.projector == "none":
             return
 
-        errRecord = self.send("op prerr")
+        self.storeProjectorData(self.collectProjectorData(), override)
+
+    def collectProjectorData(self, budget=None):
+        """
+        Asks the projector for everything we keep track of, all in one
+        session: the error record, the power status, the hours and the
+        colors.  Returns the list of replies, to be handed to
+        storeProjectorData().  Nothing is recorded here.
+        """
+        return self.sendMany(["op prerr", "op status.check ?"] +
+                             HOURSQUERIES + COLORQUERIES, budget)
+
+    def storeProjectorData(self, replies, override):
+        """
+        Stores the replies from collectProjectorData() in the
+        projector's permanent record, after checking that this is the
+        projector we think it is (unless override is True).  Returns
+        True if the hours and colors were stored, too.
+        """
+        proj = "proj{0:02d}".format(self.number)
+        errRecord = replies[0].format(proj, "op prerr")
+        status = replies[1].format(proj, "op status.check ?")
+        hours = replies[2:2 + len(HOURSQUERIES)]
+        colors = replies[2 + len(HOURSQUERIES):]
+
         errs = errRecord.split("##")
 
         ## Check to see that this is the right projector.  It may have
@@ -173,38 +355,63 @@ class ProjectorControl(object):
         ## in the database.
 
         if (not override) & (len(projs[self.projector].errorRecord) > 0) & (self.projector != "TESTBENCH") :
-            if len(errs) > 0:
-                # This is a little bit of a cheat.  We are comparing the last
-                # few characters of the error record to see if this is the same
-                # projector as used to be here.  Really we should be doing a 
-                # serial number comparison, but that's not an option with this
-                # firmware.
-                if errs[1][-64:] not in projs[self.projector].errorRecord:
+            if len(errs) > 1:
+                # Really we should be doing a serial number comparison,
+                # but that's not an option with this firmware.  So we
+                # look for the first error this projector gives us in
+                # the log of the projector that used to be here.
+                if not errorLog.knows(self.projector, errRecord):
                     abandon("Please excuse me, but something is wrong. The projector gives an error record of {0}\nwhile the record reads {1}.\nAre you sure this is projector {2} we're talking about?".format(errs[1], projs[self.projector].errorRecord, self.projector))
             else:
                 abandon("I'm so sorry, but something is wrong. The projector gives an empty error record\nwhile the record reads {0}.\nAre you sure this is projector {1} we're talking about?".format(projs[self.projector].errorRecord, self.projector))
 
-        ## This appears to be the correct projector.
+        ## This appears to be the correct projector.  The new entries
+        ## in its record are added to its log when it's written.
         if len(errs) > 1:
-            projs[self.projector].setErrorRecord("##" + errRecord.split("##")[1])
+            projs[self.projector].setErrorRecord("##" + "##".join(errs[1:]))
 
         ## Check to see if the projector is on. They only respond
-        ## properly to the color queries when powered up.
-        status = self.send("op status.check ?")
-        if status.split()[-1] != '2':
+        ## properly to the color queries when powered up, so if it
+        ## isn't, we throw away the hours and colors we got.
+        if (len(status.split()) == 0) or (status.split()[-1] != '2'):
             print("ERR: Please power on the projector to gather color data and hours.")
+            return False
         else: 
-            self.recordHours()
-            self.recordColorSettings()
+            self.storeHours(hours)
+            self.storeColorSettings(colors)
+            return True
+
+    def powerState(self, budget=None):
+        """
+        Asks the projector (not the cache) for its power state, and
+        returns it as a number (see POWERSTATES), or None if we didn't
+        get a sensible answer within the budget.
+        """
+        if self.projector == "none":
+            return None
+
+        reply = self.transmit(["op status.check ?"], budget, fresh=True)[0]
+        if reply.status != "ACK":
+            return None
+
+        state = self.getInt(reply.text)
+        if state == "none":
+            return None
+        return state
 
     def recordHours(self):
         """
         Records the total number of hours usage, and the bulb timer, too.
         """
-        projs[self.projector].setTotalHours(self.getInt(self.send("op total.hours ?")))
-        projs[self.projector].setLampHours(self.getInt(self.send("op lamp.hours ?")))
+        self.storeHours(self.sendMany(HOURSQUERIES))
+
+    def storeHours(self, replies):
+        """
+        Stores the replies to the HOURSQUERIES in the projector's record.
+        """
+        projs[self.projector].setTotalHours(self.getInt(replies[0].text))
+        projs[self.projector].setLampHours(self.getInt(replies[1].text))
 
-    
     def recordColorSettings(self):
         """
         Records the color settings in use into the projector's
@@ -213,18 +420,22 @@ class ProjectorControl(object):
         if self.projector == "none":
             return
 
-        settings = [100, 100, 100, 100, 100, 100, 4, 4]
+        self.storeColorSettings(self.sendMany(COLORQUERIES))
 
-        settings[0] = self.getInt(self.send("op red.offset ?"))
-        settings[1] = self.getInt(self.send("op green.offset ?"))
-        settings[2] = self.getInt(self.send("op blue.offset ?"))
-
-        settings[3] = self.getInt(self.send("op red.gain ?"))
-        settings[4] = self.getInt(self.send("op green.gain ?"))
-        settings[5] = self.getInt(self.send("op blue.gain ?"))
+    def storeColorSettings(self, replies):
+        """
+        Stores the replies to the COLORQUERIES in the projector's
+        record, in the order of Projector.colorSettings.  An ERR comes
+        out as "none", same as anything else we can't read a number
+        out of.
+        """
+        settings = [100, 100, 100, 100, 100, 100, 4, 4]
 
-        settings[6] = self.getInt(self.send("op color.temp ?"))
-        settings[7] = self.getInt(self.send("op gamma ?"))
+        for i, reply in enumerate(replies):
+            if reply.status == "ERR":
+                settings[i] = "none"
+            else:
+                settings[i] = self.getInt(reply.text)
 
         projs[self.projector].setColorSettings(settings)
 
@@ -356,14 +567,321 @@ class Projector(object):
 
         return
 
-def gatherReportData(projectorControls):
+class OutputCollector(object):
+    """
+    Stands in for sys.stdout while projectors are being run in
+    parallel.  Whatever a worker thread prints is saved up, so it can
+    be printed later in the same order as it would have come out if
+    the projectors had been done one at a time.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def collect(self, buffer):
+        """
+        Send this thread's output to the given list, or back to the
+        real stream if the buffer is None.
+        """
+        self.local.buffer = buffer
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Progress(object):
+    """
+    A progress line, on stderr, for things that take a while.  It's
+    safe to tick it from several threads at once.  If stderr isn't a
+    terminal (as when run from cron) there's no progress line.
+    """
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        self.visible = sys.stderr.isatty()
+        self.show()
+
+    def show(self):
+        if not self.visible:
+            return
+        line = "{0}: {1}/{2}".format(self.label, self.done, self.total)
+        if self.failed > 0:
+            line += " ({0} timed out)".format(self.failed)
+        sys.stderr.write("\r" + line)
+        sys.stderr.flush()
+
+    def tick(self, failed=False):
+        with self.lock:
+            self.done += 1
+            if failed:
+                self.failed += 1
+            self.show()
+
+    def finish(self):
+        if self.visible:
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+
+
+def runConcurrently(numbers, task, perSwitch=None):
+    """
+    Runs task(n) for each projector number in the list, several at a
+    time.  We only do one transaction at a time on any switch port,
+    and no more than perSwitch at a time on any one serial switch.
+
+    Output printed by the tasks is collected and printed in the order
+    of the list, and the results are returned in the same order.  If a
+    task raises an exception, the output of the tasks before it is
+    printed and the exception is raised again here.
+    """
+    if perSwitch is None:
+        perSwitch = PERSWITCH
+
+    if len(numbers) == 0:
+        return []
+
+    switchLimits = dict()
+    portLocks = dict()
+    for n in numbers:
+        if n in projControls.keys():
+            key = (projControls[n].serialSwitch, projControls[n].switchPort)
+        else:
+            key = (None, n)
+        switchLimits.setdefault(key[0], threading.BoundedSemaphore(max(1, perSwitch)))
+        portLocks.setdefault(key, threading.Lock())
+
+    collector = OutputCollector(sys.stdout)
+
+    def runOne(n, buffer):
+        collector.collect(buffer)
+        if n in projControls.keys():
+            key = (projControls[n].serialSwitch, projControls[n].switchPort)
+        else:
+            key = (None, n)
+        try:
+            with switchLimits[key[0]], portLocks[key]:
+                return task(n)
+        finally:
+            collector.collect(None)
+
+    buffers = [[] for n in numbers]
+    results = []
+
+    sys.stdout = collector
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(numbers), 32)) as pool:
+            futures = [pool.submit(runOne, n, buffer) for n, buffer in zip(numbers, buffers)]
+
+            for future, buffer in zip(futures, buffers):
+                concurrent.futures.wait([future])
+                collector.stream.write("".join(buffer))
+                results.append(future.result())
+    finally:
+        sys.stdout = collector.stream
+
+    return results
+
+
+class DirectClient(object):
+    """
+    Talks to the serial switches directly from this process, with an
+    opclient.BlockingClient that is started the first time we need
+    it.  Switches that turn out to be unreachable from here are not
+    tried again.
+    """
+    def __init__(self):
+        self.client = None
+        self.lock = threading.Lock()
+        self.unreachableSwitches = set()
+
+    def usable(self, serialSwitch):
+        if os.environ.get("PJDIRECT", "1") == "0":
+            return False
+        return serialSwitch not in self.unreachableSwitches
+
+    def unreachable(self, serialSwitch):
+        self.unreachableSwitches.add(serialSwitch)
+
+    def transact(self, serialSwitch, switchPort, cmds, budget=None):
+        with self.lock:
+            if self.client is None:
+                self.client = opclient.BlockingClient()
+                atexit.register(self.close)
+        return self.client.transact(serialSwitch, switchPort, cmds, budget=budget)
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+directClient = DirectClient()
+
+
+def gatherReportData(projectorControls, budget=None, perSwitch=None):
     """
     Runs through all the installed projectors and gathers settings and
     the error log from each one, and stores them in the corresponding
     Projector object where it is accessible for reporting.
+
+    The projectors are asked in parallel, and each one gets 'budget'
+    seconds.  The ones that don't answer in time are reported and
+    skipped.  Nothing is stored until everybody is done, and then
+    everything is stored at once.
     """
-    for k in projectorControls.keys():
-        projectorControls[k].recordProjectorData(False)
+    if budget is None:
+        budget = GATHERBUDGET
+
+    numbers = sorted(k for k in projectorControls.keys()
+                     if projectorControls[k].projector != "none")
+
+    progress = Progress("gather", len(numbers))
+
+    def collect(n):
+        replies = projectorControls[n].collectProjectorData(budget)
+        # A query that timed out, even with part of an answer, wasn't
+        # answered properly, or wasn't sent for lack of time.  (Not the
+        # error dump, which never gets an ACK.)
+        if any(reply.status == "timeout" for reply in replies[1:]):
+            progress.tick(failed=True)
+            return None
+        progress.tick()
+        return replies
+
+    results = runConcurrently(numbers, collect, perSwitch)
+    progress.finish()
+
+    late = [n for n, replies in zip(numbers, results) if replies is None]
+    if len(late) > 0:
+        print("ERR: These projectors did not answer within {0} seconds, and were skipped: {1}".format(budget, ", ".join(str(n) for n in late)))
+
+    sampled = []
+    for n, replies in zip(numbers, results):
+        if replies is not None:
+            if projectorControls[n].storeProjectorData(replies, False):
+                sampled.append(projectorControls[n].projector)
+
+    if TELEMETRY != "":
+        recordTelemetry(sampled)
+
+
+def recordTelemetry(serialNos):
+    """
+    Records the hours and color settings of the given projectors, as
+    they are in their records now, in the TELEMETRY store.
+    """
+    samples = []
+    for serialNo in serialNos:
+        projector = projs[serialNo]
+        values = [projector.totalHours, projector.lampHours] + list(projector.colorSettings)
+        samples += [(serialNo, metric, value)
+                    for metric, value in zip(telemetryStore.METRICS, values)]
+
+    store = telemetryStore.TelemetryStore(TELEMETRY)
+    try:
+        store.record(samples)
+    finally:
+        store.close()
+
+
+def waitForPower(projectorControls, numbers, command, start, deadline=None, perSwitch=None):
+    """
+    After a power command (op powon or op powoff) has been sent to the
+    projectors in the list, asks them all for their power state until
+    they've all finished warming up (state 2) or cooling down (state
+    0), or until 'deadline' seconds after 'start' have passed.  We ask
+    the ones that aren't done yet every so often, less often as time
+    goes on.
+
+    A projector that is sitting in the wrong state (like one that was
+    still cooling down when it was told to turn on, and ignored it)
+    gets the command again.
+
+    Prints the time each projector took to get there, and a list of
+    the ones that didn't.
+    """
+    if deadline is None:
+        deadline = POWERDEADLINE
+
+    if command == "op powon":
+        target, opposite, label = 2, 0, "warm-up"
+    else:
+        target, opposite, label = 0, 2, "cool-down"
+
+    pending = [n for n in numbers
+               if (n in projectorControls.keys()) and (projectorControls[n].projector != "none")]
+    readyTimes = dict()
+    lastStates = dict()
+    resent = dict()
+
+    progress = Progress(label, len(pending))
+
+    # This runs in the worker threads, so it only reads 'resent', and
+    # says whether it sent the command again.  The counts are kept up
+    # to date back here, once the round is over.
+    def poll(n):
+        budget = max(1.0, min(POLLTIMEOUT, start + deadline - time.time()))
+        state = projectorControls[n].powerState(budget)
+        answered = time.time()
+        again = (state == opposite) and (resent.get(n, 0) < 3)
+        if again:
+            projectorControls[n].transmit([command], budget)
+        return (state, answered, again)
+
+    interval = POLLFIRST
+    while len(pending) > 0:
+        # Don't sleep past the deadline, but do ask one last time
+        # when we get there.
+        wait = min(interval, start + deadline - time.time())
+        if wait > 0:
+            time.sleep(wait)
+        interval = min(interval * POLLGROWTH, POLLMAX)
+
+        states = runConcurrently(pending, poll, perSwitch)
+
+        stillPending = []
+        for n, (state, answered, again) in zip(pending, states):
+            lastStates[n] = state
+            if again:
+                resent[n] = resent.get(n, 0) + 1
+            if state == target:
+                readyTimes[n] = answered - start
+                progress.tick()
+            else:
+                stillPending.append(n)
+        pending = stillPending
+
+        if time.time() - start >= deadline:
+            break
+
+    progress.finish()
+
+    for n in sorted(readyTimes.keys()):
+        print("proj{0:02d} {1} in {2:.1f} seconds".format(n, POWERSTATES[target], readyTimes[n]))
+
+    if len(readyTimes) > 0:
+        print("{0} projectors {1} after {2:.1f} seconds.".format(len(readyTimes), POWERSTATES[target], max(readyTimes.values())))
+
+    if len(pending) > 0:
+        print("ERR: These projectors were not {0} after {1:.0f} seconds:".format(POWERSTATES[target], time.time() - start))
+        for n in pending:
+            state = lastStates.get(n)
+            if state is None:
+                print("  proj{0:02d} (no answer)".format(n))
+            else:
+                print("  proj{0:02d} ({1})".format(n, POWERSTATES.get(state, "state {0}".format(state))))
+
+    return pending
 
 
 def fullReport(projectors, projectorControls):
@@ -389,14 +907,17 @@ def findRecord(serialFragment, projectors):
     """
     Find a serial number from a fragment of a serial number.  If the
     fragment does not define a unique serial number, a null value is
-    returned.
-    """
+    returned.  The fragment is just text, not a regular expression.
 
-    output = list()
+    The store's projectors keep an index of their serial numbers for
+    this (see pjstore.SerialIndex).  For a plain dictionary, one is
+    made on the spot.
+    """
 
-    for k in projectors.keys():
-        if re.search(serialFragment, k):
-            output.append(k)
+    if hasattr(projectors, "search"):
+        output = projectors.search(serialFragment)
+    else:
+        output = pjstore.SerialIndex(projectors.keys()).find(serialFragment)
 
     if len(output) == 1:
         return output[0]
@@ -455,7 +976,91 @@ def parseIntegers(inputStr=""):
 
     return list(selection)
 
-if __name__ == "__main__":
+class Abandoned(Exception):
+    """
+    Raised by abandon() to give up on a command.  main() catches it
+    and closes the database.
+    """
+    pass
+
+
+def abandon(errorString):
+    print("ERR:", errorString)
+    raise Abandoned(errorString)
+
+
+def registerClasses():
+    """
+    pjcontrol has always been run as a script, so the objects in the
+    database were pickled as __main__.Projector and so on.  A program
+    that imports pjcontrol and reads the database (like pjserver)
+    should call this first.  It makes those names mean our classes,
+    and has ours pickled the same way, so the database still works
+    for pjcontrol run on its own.
+    """
+    for cls in [RepairRecord, ProjectorControl, Projector]:
+        cls.__module__ = "__main__"
+        setattr(sys.modules["__main__"], cls.__name__, cls)
+
+
+def databasePath():
+    """
+    Returns the name of the projector database.  If PJINVENTORY names
+    an SQLite inventory database (see pjimport.py), that's where the
+    records are.  Otherwise they're in the PROJECTORDB shelf.
+    """
+    inventory = os.environ.get("PJINVENTORY", "")
+    if inventory != "":
+        return inventory
+    return os.path.expandvars("${PROJECTORDB}")
+
+
+def openStore():
+    """
+    Opens the projector database.  See pjstore.py and databasePath().
+    """
+    if os.environ.get("PJINVENTORY", "") != "":
+        return pjstore.InventoryStore(databasePath(),
+                                      {"Projector": Projector,
+                                       "ProjectorControl": ProjectorControl,
+                                       "RepairRecord": RepairRecord})
+
+    return pjstore.ProjectorStore(databasePath())
+
+
+def main(argv=None, store=None, username=None, machine=None):
+    """
+    Does what the command line (argv, without the program name) says.
+
+    Normally this opens the database, and closes it when done.  The
+    resident server (pjserver.py) keeps one around, and passes it in,
+    along with the name of the user and machine the command came from,
+    for the log.  Either way, what the command changed is written back
+    at the end.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if store is None:
+        try:
+            store = openStore()
+        except pjstore.OldDatabase as e:
+            print("ERR: {0}".format(e))
+            return
+
+    try:
+        runCommand(argv, store, username, machine)
+    except Abandoned:
+        pass
+    finally:
+        store.close()
+
+
+def runCommand(argv, store, username=None, machine=None):
+    """
+    The body of main(), with the database open.
+    """
+    global projs, projControls, errorLog, queryCache
 
     LOGFORMAT = '%(asctime)-15s %(machine)s %(username)s %(message)s'
 #    logging.basicConfig(filename='/gpfs/runtime/opt/cave-utils/yurt/log/pjcontrollog.txt', level=logging.DEBUG,format=LOGFORMAT)
@@ -463,16 +1068,13 @@ if __name__ == "__main__":
     logFile = os.path.expandvars('${PJCONTROLLOG}')
     if logFile != "":
         logging.basicConfig(filename=logFile, level=logging.DEBUG,format=LOGFORMAT)
-        logdata = {'username': os.getlogin(),
-                   'machine':  socket.gethostname()}
-        logging.info('pjcontrol %s', " ".join(sys.argv[1:]), extra=logdata)    
+        logdata = {'username': username if username is not None else os.getlogin(),
+                   'machine':  machine if machine is not None else socket.gethostname()}
+        logging.info('pjcontrol %s', " ".join(argv), extra=logdata)    
 
-    ## TODO: This should not exit, but throw some kind of exception
-    ## that if not handled, closes the shelf and exits.
-    def abandon(errorString):
-        print("ERR:", errorString)
-        shelf.close()
-        exit()
+        # This log is a record of who did what, and the messages from
+        # opclient don't have the machine and username to go with it.
+        logging.getLogger("opclient").propagate = False
 
     # Create a parser for the command line
     import argparse
@@ -480,7 +1082,7 @@ if __name__ == "__main__":
     # This is all just argparse nonsense. For a documentation-rich
     # system, they didn't go out of their way to make the use of this
     # wonderful package terribly easy to read.
-    parser = argparse.ArgumentParser(description='Projector control and tracking.  Use this script to turn projectors on and off, to adjust projector parameters for the projectors in use, and also to record repairs and other information about the projectors in the inventory.  See the script comments for more usage information.', epilog="Use 'pjcontrol 10-38 on' to turn on all the projectors from 10 to 38.  Try 'pjcontrol -s 00049 -r bulb -c 'shattered'' to record a bulb change.  You can also do 'pjcontrol 42 repair bulb 'shattered'")
+    parser = argparse.ArgumentParser(description='Projector control and tracking.  Use this script to turn projectors on and off, to adjust projector parameters for the projectors in use, and also to record repairs and other information about the projectors in the inventory.  See the script comments for more usage information.', epilog="Use 'pjcontrol 10-38 on' to turn on all the projectors from 10 to 38, and 'pjcontrol -w 10-38 on' to wait until they have all warmed up.  Try 'pjcontrol -s 00049 -r bulb -c 'shattered'' to record a bulb change.  You can also do 'pjcontrol 42 repair bulb 'shattered'")
     
     parser.add_argument('range', metavar='projs', nargs='?', default="none",
                         help="A comma-separated list of projector numbers or ranges.  Try '3,6,7' or '3-10' or '3,5,10-20'.")
@@ -489,6 +1091,15 @@ if __name__ == "__main__":
                         help='A projector serial number (or fraction thereof).  Use this to record actions on a projector that is not currently in use, or to add projectors to the system.')
     parser.add_argument('--clearErrs', dest='clearErrs', action='store_true',
                         help='Clear the error log for a projector.')
+    parser.add_argument('-E','--errorCode', dest='errorCode', nargs='?',
+                        default="none",
+                        help='List the projectors that logged this error code (like 0x0101), and when.  Ignores all other arguments, except --since and --until.')
+    parser.add_argument('--since', dest='since', nargs='?',
+                        default=None,
+                        help='With --errorCode, only list the errors logged on or after this date (2016-05-01).')
+    parser.add_argument('--until', dest='until', nargs='?',
+                        default=None,
+                        help='With --errorCode, only list the errors logged before this date (2016-06-01).')
     parser.add_argument('-d','--date', dest='mfgDate', nargs="?", 
                         default="none",
                         help='The projector serial number stickers have a manufacturing date on them.  Record it here, in the format 2012-04-17.')
@@ -513,11 +1124,26 @@ if __name__ == "__main__":
     parser.add_argument('-c','--comment', dest='comment', nargs='?', 
                         default='none', 
                         help='Commentary about the repair.')
+    parser.add_argument('-j','--perSwitch', dest='perSwitch', type=int,
+                        default=PERSWITCH,
+                        help='How many projectors on the same serial switch to talk to at once. (Default {0}, or $PJPERSWITCH.)'.format(PERSWITCH))
+    parser.add_argument('-b','--budget', dest='budget', type=float,
+                        default=GATHERBUDGET,
+                        help='With --gather, the number of seconds each projector gets to answer before it is skipped. (Default {0:g}, or $PJBUDGET.)'.format(GATHERBUDGET))
+    parser.add_argument('-w','--wait', dest='wait', action='store_true',
+                        help='With on or off, wait for the projectors to finish warming up or cooling down, and report how long each one took.')
+    parser.add_argument('--deadline', dest='deadline', type=float,
+                        default=POWERDEADLINE,
+                        help='With --wait, the number of seconds to wait before giving up. (Default {0:g}, or $PJPOWERDEADLINE.)'.format(POWERDEADLINE))
+    parser.add_argument('-f','--fresh', dest='fresh', action='store_true',
+                        help='Ask the projectors, even if there are recent answers in the query cache.')
+    parser.add_argument('--convert', dest='convert', metavar='OLDDB',
+                        help='Copy the projectors from a database in the old format (like projector3.db) into $PROJECTORDB, which should be new.  The old database is not changed.')
     parser.add_argument('args', nargs=argparse.REMAINDER, 
                         help="The remaining arguments in the command line: on|off|power|version|mode|mono|stereo|lamp|eco|std|hour|error|raw|repair|install|uninstall|report|gather.  Unique abbreviations are allowed.  Some of these arguments require further args.  For example 'install' requires a serial number, switch name and port, and location. And 'repair' needs a serial number.")
 
     # Execute the parser.
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # This is just a hack because argparse seems to behave slightly
     # differently in 2.7.3 than in 2.7.5 where the development was
@@ -535,39 +1161,44 @@ if __name__ == "__main__":
     # print(args.comment)
     # print(args.args)
 
-    #########################################################################
-    # Open the shelf file.  It might be empty, so check first.
-    shelf = shelve.open(os.path.expandvars("${PROJECTORDB}"), writeback=True)
-
-    # The next few lines were used in the transition from RH6 to RH7 and Python3,
-    # where the underlying db for shelve was replaced.  Left here as an aid to future
-    # efforts to upgrade the database.
-    # import pickle
-    # projsFile = open("projs.pkl", "rb")
-    # projsPKL = pickle.load(projsFile)
-    # projsFile.close()
-    
-    # projControlsFile = open("projControls.pkl", "rb")
-    # projControlsPKL = pickle.load(projControlsFile)
-    # projControlsFile.close()
-
-    # print(projControlsPKL)
-    # print(projsPKL)
-
-    # Prepare the items on the shelf.
-    if "projs" in shelf.keys():
-        projs = shelf["projs"]
-    else:
-        shelf["projs"] = projs
-
-    if "projControls" in shelf.keys():
-        projControls = shelf["projControls"]
+    # Use the query cache, if there is one.
+    cacheDir = os.environ.get("PJCACHE", "")
+    if cacheDir == "":
+        queryCache = None
     else:
-        shelf["projControls"] = projControls 
+        try:
+            queryCache = pjcache.QueryCache(cacheDir,
+                                            pjcache.parseTTLs(os.environ.get("PJCACHETTL", "")))
+            queryCache.fresh = args.fresh
+        except OSError as e:
+            queryCache = None
+            print("Not using the query cache: {0}".format(e), file=sys.stderr)
 
-#    shelf["projs"] = projsPKL
-#    shelf["projControls"] = projControlsPKL
-    
+    #########################################################################
+    # The database is open.  The records in it are read as they're
+    # needed, and the ones that change are written back at the end.
+    # (See pjstore.py.)
+
+    # In the transition from RH6 to RH7 and Python3, the underlying db
+    # for shelve was replaced, and the data moved through pickle files
+    # (projs.pkl and projControls.pkl).  To do that again, load the
+    # pickles and copy their items into store.projs and
+    # store.projControls.
+
+    projs = store.projs
+    projControls = store.projControls
+    errorLog = store.errorLog
+
+    # Copy an old database into this one.
+    if args.convert is not None:
+        if (len(projs) > 0) or (len(projControls) > 0):
+            abandon("{0} already has projectors in it.  Convert into a new file.".format(store.path))
+        try:
+            nProjs, nControls = pjstore.convert(args.convert, store)
+        except (OSError, ValueError) as e:
+            abandon("Cannot convert {0}: {1}".format(args.convert, e))
+        print("Copied {0} projectors and {1} projector controls from {2} to {3}.".format(nProjs, nControls, args.convert, store.path))
+        return
 
     #########################################################################
     # Run through the projectors gathering their data.
@@ -575,13 +1206,12 @@ if __name__ == "__main__":
 
         if args.serialNo == "none":
 
-            gatherReportData(projControls)
+            gatherReportData(projControls, args.budget, args.perSwitch)
         else:
 
             abandon("Please use the projector number (not the serial number) to\noperate the gather function.")
 
-        shelf.close()
-        exit()
+        return
 
     #########################################################################
     # Issue a report. Decide if it's just for one projector or for the whole
@@ -599,8 +1229,16 @@ if __name__ == "__main__":
 
             projs[sn].pretty()
 
-        shelf.close()
-        exit()
+        return
+
+    #########################################################################
+    # Find who logged an error.
+    if args.errorCode != "none":
+
+        for serialNo, errorTime, entry in errorLog.find(args.errorCode, args.since, args.until):
+            print("{0} {1} {2}".format(serialNo, errorTime, entry))
+
+        return
 
     #########################################################################
     # Clear a projector's error record.
@@ -615,8 +1253,7 @@ if __name__ == "__main__":
 
             projs[sn].errorRecord=""
 
-        shelf.close()
-        exit()
+        return
 
 
     #########################################################################
@@ -693,9 +1330,8 @@ if __name__ == "__main__":
                 projs[sn].pretty()
             ############### End Repair
 
-        #print(shelf)
-        shelf.close()
-        exit()
+        #print(store)
+        return
 
 
 #### TODO: Need rear.mode
@@ -821,12 +1457,21 @@ if __name__ == "__main__":
             command = "none"
 
         elif re.match("gat", args.args[0]):
-            for p in projectorsToControl:
+            # Do the projectors up to the first one we don't know
+            # about, then complain about that one.
+            known = projectorsToControl
+            for i, p in enumerate(projectorsToControl):
                 if p not in projControls.keys():
-                    abandon("I wish I knew a projector {0}, but I don't.".format(p))
-                # We assume the operator means to overwrite the projector
-                # data, since he or she has asked for it specifically.
-                projControls[p].recordProjectorData(True)
+                    known = projectorsToControl[:i]
+                    break
+
+            # We assume the operator means to overwrite the projector
+            # data, since he or she has asked for it specifically.
+            runConcurrently(known, lambda p: projControls[p].recordProjectorData(True),
+                            args.perSwitch)
+
+            if len(known) < len(projectorsToControl):
+                abandon("I wish I knew a projector {0}, but I don't.".format(projectorsToControl[len(known)]))
 
             command = "none"
 
@@ -837,17 +1482,34 @@ if __name__ == "__main__":
         # END of long if statement.
 
         if command != "none":
-            for p in projectorsToControl:
-                if p in projControls.keys():
-                    if projControls[p].projector == "none":
-                        print("ERR: I regret that there is no projector installed at {0} at the present.".format(p))
-                    else:
-                        if command == "op powoff":
-                            projControls[p].recordHours()
-                        print(projControls[p].send(command))
+            def sendCommand(p):
+                if projControls[p].projector == "none":
+                    print("ERR: I regret that there is no projector installed at {0} at the present.".format(p))
                 else:
-                    abandon("So sorry. I never heard of projector {0}.".format(p))
+                    if command == "op powoff":
+                        projControls[p].recordHours()
+                    print(projControls[p].send(command))
+
+            # As above, the projectors before the first unknown one get
+            # the command, and then we complain.
+            known = projectorsToControl
+            for i, p in enumerate(projectorsToControl):
+                if p not in projControls.keys():
+                    known = projectorsToControl[:i]
+                    break
+
+            start = time.time()
+            runConcurrently(known, sendCommand, args.perSwitch)
 
+            # Wait for them to come up (or go down), if asked.
+            if args.wait and (command in ["op powon", "op powoff"]):
+                waitForPower(projControls, known, command, start,
+                             args.deadline, args.perSwitch)
 
-    shelf.close()
+            if len(known) < len(projectorsToControl):
+                abandon("So sorry. I never heard of projector {0}.".format(projectorsToControl[len(known)]))
+
+
+if __name__ == "__main__":
+    main()
 
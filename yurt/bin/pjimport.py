@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+#
+# Moves the projector database from the pjcontrol shelf into the
+# SQLite inventory database (see projectorDbMethods.py).  Each
+# Projector goes into ProjectorStatus and ProjectorSettings, with its
+# lamp hours in BulbStatus and its repair records in ProjectorRepairs,
+# and each ProjectorControl goes into ProjectorNumbers.
+#
+# Run it once:
+#
+#   pjimport.py /gpfs/runtime/opt/cave-utils/yurt/etc/inventory.db
+#
+# and then set PJINVENTORY to the same file in the pjcontrol wrapper,
+# so pjcontrol reads and writes there instead of the shelf.  The shelf
+# itself isn't changed.
+#
+
+import os
+import sys
+
+import pjcontrol
+import pjstore
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Copies the pjcontrol projector shelf into an SQLite inventory database.')
+    parser.add_argument('inventory',
+                        help='The inventory database to make.  It should be new, or at least have no projectors in it.')
+    parser.add_argument('-s', '--shelf', dest='shelf',
+                        default=os.path.expandvars("${PROJECTORDB}"),
+                        help='The shelf to read.  Defaults to $PROJECTORDB.')
+    args = parser.parse_args()
+
+    pjcontrol.registerClasses()
+
+    try:
+        shelf = pjstore.ProjectorStore(args.shelf)
+    except pjstore.OldDatabase as e:
+        sys.exit("ERR: {0}".format(e))
+    inventory = pjstore.InventoryStore(args.inventory,
+                                       {"Projector": pjcontrol.Projector,
+                                        "ProjectorControl": pjcontrol.ProjectorControl,
+                                        "RepairRecord": pjcontrol.RepairRecord})
+
+    if (len(inventory.projs) > 0) or (len(inventory.projControls) > 0):
+        sys.exit("ERR: {0} already has projectors in it.".format(args.inventory))
+
+    for serialNo in sorted(shelf.projs.keys()):
+        inventory.projs[serialNo] = shelf.projs[serialNo]
+
+    for number in sorted(shelf.projControls.keys()):
+        inventory.projControls[number] = shelf.projControls[number]
+
+    inventory.close()
+    shelf.release()
+
+    print("copied {0} projectors and {1} positions from {2} to {3}.".format(len(shelf.projs),
+                                                                             len(shelf.projControls),
+                                                                             args.shelf,
+                                                                             args.inventory))
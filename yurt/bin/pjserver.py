@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+#
+# A resident pjcontrol.  Every pjcontrol command starts Python, opens
+# the projector database, and opens its own sessions to the serial
+# switches, even for a plain 'pow'.  yurtcol runs pjcontrol hundreds
+# of times in a session, so that adds up.
+#
+# pjserver does all that once, and then waits on a UNIX socket for
+# command lines.  The thin client (pjthin.py) sends it the arguments,
+# and gets back whatever pjcontrol would have printed, as it's printed.
+# The pjcontrol wrapper uses the thin client if the socket is there.
+#
+# The protocol is one line of JSON from the client:
+#
+#   {"argv": ["42", "pow"], "db": "/gpfs/.../projector4.db"}
+#
+# (The "db" is $PJINVENTORY if that's set, or else $PROJECTORDB.)
+#
+# and lines of JSON back, ending with the exit status:
+#
+#   {"out": "proj42 switch03 10014 cmd = op status.check ?\n"}
+#   {"exit": 0}
+#
+# The client's database has to be the same as ours, or we answer
+# {"refused": "..."} and the client runs pjcontrol itself.  Who is
+# asking (for pjcontrol's log) comes from the socket itself, not from
+# anything the client says.
+#
+# Only the user running the server can use the socket, unless it's
+# started with --group, in which case everybody in that group can.
+# Anybody else gets a permission error from connect(), and the thin
+# client runs pjcontrol itself.
+#
+# Commands are run one at a time, in the order they come in, and each
+# one has the server to itself from start to finish, talking to the
+# projectors included.  (pjcontrol keeps its state in module globals,
+# and we swap sys.stdout for the whole process while it runs.)  So a
+# slow command, like 'on --wait', holds up everybody else's until
+# it's done; their clients just wait.  The server keeps the projector
+# records it has read in memory, but doesn't keep the file open, so
+# pjcontrol can still be run on its own.  If something else changes
+# the file, we notice and read it again before the next command.
+#
+# Run it like this, with the same environment as pjcontrol:
+#
+#   pjserver.py -s /tmp/pjcontrol.sock --group cave
+#
+
+import grp
+import json
+import logging
+import os
+import pwd
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import traceback
+
+import pjcontrol
+
+# Where the socket goes, if neither the command line nor PJSERVER says.
+SERVERSOCKET = "/tmp/pjcontrol.sock"
+
+# pjcontrol's own log needs a username and machine with each message,
+# so ours is kept separate.
+log = logging.getLogger("pjserver")
+log.addHandler(logging.NullHandler())
+log.propagate = False
+
+pjcontrol.registerClasses()
+
+
+def fileStamp(path):
+    """
+    Returns something that changes when the database file changes.  The
+    dbm module underneath may add an extension or two to the name, and
+    the inventory database writes to its "-wal" log before the file
+    itself.
+    """
+    stamp = []
+    for name in [path, path + ".db", path + ".dat", path + ".dir", path + "-wal"]:
+        try:
+            info = os.stat(name)
+            stamp.append((name, info.st_mtime, info.st_size))
+        except OSError:
+            pass
+    return stamp
+
+
+def peerUser(connection):
+    """
+    Returns the name of the user at the other end of a UNIX socket.
+    """
+    creds = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", creds)
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class StreamWriter(object):
+    """
+    Stands in for stdout or stderr while a command runs, and sends
+    what's printed to the client, a line at a time.  If the client has
+    gone away, the output is thrown away, but the command carries on.
+    """
+    def __init__(self, wfile, name):
+        self.wfile = wfile
+        self.name = name
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.pending.append(text)
+            if "\n" in text:
+                self.send()
+        return len(text)
+
+    def send(self):
+        if len(self.pending) == 0:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        self.message({self.name: text})
+
+    def message(self, message):
+        if self.wfile is None:
+            return
+        try:
+            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except OSError:
+            self.wfile = None
+
+    def flush(self):
+        with self.lock:
+            self.send()
+
+    def isatty(self):
+        return False
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Runs one command line for one client.
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        out = StreamWriter(self.wfile, "out")
+        try:
+            request = json.loads(line.decode("utf-8"))
+            argv = [str(arg) for arg in request["argv"]]
+        except (ValueError, KeyError, TypeError) as e:
+            out.message({"refused": "bad request: {0}".format(e)})
+            return
+
+        if request.get("db", self.server.database) != self.server.database:
+            out.message({"refused": "this server uses {0}".format(self.server.database)})
+            return
+
+        user = peerUser(self.request)
+        machine = socket.gethostname()
+
+        # This is held for the whole command, see above.
+        err = StreamWriter(self.wfile, "err")
+        with self.server.lock:
+            self.server.refresh()
+
+            log.info("%s@%s: %s", user, machine, " ".join(argv))
+
+            status = 0
+            sys.stdout, sys.stderr = out, err
+            try:
+                pjcontrol.main(argv, self.server.store, user, machine)
+            except SystemExit as e:
+                # argparse does this, for --help or a bad option.
+                if e.code is None:
+                    status = 0
+                elif isinstance(e.code, int):
+                    status = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+                self.server.stamp = fileStamp(self.server.database)
+
+        out.flush()
+        err.flush()
+        out.message({"exit": status})
+
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Keeps the projector database, and hands the connections to
+    CommandHandler, one thread each.  They take turns with the lock,
+    one command at a time.
+
+    The socket is only for us, or for the given group, if there is
+    one.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, database, group=None):
+        self.database = database
+        self.lock = threading.Lock()
+        self.store = pjcontrol.openStore()
+        self.stamp = fileStamp(self.database)
+
+        # Make the socket private from the start, and only then let
+        # the group in.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, CommandHandler)
+        finally:
+            os.umask(umask)
+        if group is not None:
+            os.chown(path, -1, grp.getgrnam(group).gr_gid)
+            os.chmod(path, 0o660)
+
+    def refresh(self):
+        """
+        Forgets what we've read from the database if somebody else has
+        changed it since we last looked.
+        """
+        if fileStamp(self.database) != self.stamp:
+            log.info("%s changed, reading it again", self.database)
+            self.store.forget()
+            self.stamp = fileStamp(self.database)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.store.close()
+
+
+def clearStaleSocket(path):
+    """
+    Removes a socket left behind by a server that's gone.  Exits if
+    there's a server still using it.
+    """
+    if not os.path.exists(path):
+        return
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        s.close()
+
+    sys.exit("ERR: there is already a server on {0}".format(path))
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description='Keeps the projector database and switch sessions open, and runs pjcontrol command lines sent by the thin client (pjthin.py).')
+    parser.add_argument('-s', '--socket', dest='socket',
+                        default=os.environ.get("PJSERVER", SERVERSOCKET),
+                        help='The UNIX socket to listen on.  Defaults to $PJSERVER or {0}.'.format(SERVERSOCKET))
+    parser.add_argument('-g', '--group', dest='group',
+                        help='Let the members of this group use the server, too.  Otherwise only the user running it can.')
+    parser.add_argument('--log', dest='log', default='/tmp/pjserver.log',
+                        help='Log file.')
+    args = parser.parse_args()
+
+    handler = logging.FileHandler(args.log)
+    handler.setFormatter(logging.Formatter('%(asctime)s pjserver: %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+
+    clearStaleSocket(args.socket)
+
+    server = CommandServer(args.socket, pjcontrol.databasePath(), args.group)
+
+    # Make a kill act like a ^C, so we clean up either way.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate)
+
+    print("listening on", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
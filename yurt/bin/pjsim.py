@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+#
+# A simulator for the serial switches and the projectors on them, so we
+# can try out (and time) pjcontrol, the broker and projd without tying
+# up the real YURT.
+#
+# Each simulated projector gets a telnet port of its own on this
+# machine, and the simulator writes a switch map that says which local
+# port stands in for which switch and port.  Point the clients at it
+# with PJSWITCHMAP:
+#
+#   pjsim.py --map /tmp/switchmap.json &
+#   PJSWITCHMAP=/tmp/switchmap.json pjcontrol 0-68 pow
+#
+# The projectors answer "op" commands more or less the way the real
+# ones do: queries get 'ACK: NAME = value', settings get an ACK with the
+# new value, 'op prerr' gets a dump of the error log (or NoErr), and
+# nonsense gets an ERR.  They power up and down with a warm-up and
+# cool-down time, and only answer the color queries when they're on.
+# You can make them slow, jittery, or stuck.
+#
+# The layout is 16 projectors to a switch, on ports 10001 and up, with
+# the switches named switch01, switch02 and so on.
+#
+
+import asyncio
+import json
+import os
+import random
+import time
+
+# How the simulated projectors are laid out on the switches.
+PORTSPERSWITCH = 16
+FIRSTPORT = 10001
+
+# Power states, as reported by 'op status.check ?'.
+STANDBY = 0
+WARMING = 1
+ON = 2
+COOLING = 3
+
+# Telnet protocol bytes.
+IAC = 255
+WILL = 251
+SE = 240
+SB = 250
+ECHO = 1
+SGA = 3
+
+# Some error log entries to hand out.
+ERRORS = ["0x0101 lamp ignition failure",
+          "0x0203 fan 2 stalled",
+          "0x0310 over temperature",
+          "0x0412 lamp cover open",
+          "0x0520 ballast communication error",
+          "0x0601 power supply fault"]
+
+
+def layout(count):
+    """
+    Returns a list of (number, serialSwitch, switchPort) for the given
+    number of simulated projectors.
+    """
+    return [(n,
+             "switch{0:02d}".format(n // PORTSPERSWITCH + 1),
+             str(FIRSTPORT + n % PORTSPERSWITCH))
+            for n in range(count)]
+
+
+class SimProjector(object):
+    """
+    One simulated projector.
+    """
+    def __init__(self, number, warmup, cooldown, rng):
+        self.number = number
+        self.warmup = warmup
+        self.cooldown = cooldown
+
+        self.power = STANDBY
+        self.changed = time.time()
+
+        self.settings = {"red.offset": rng.randint(-30, 30),
+                         "green.offset": rng.randint(-30, 30),
+                         "blue.offset": rng.randint(-30, 30),
+                         "red.gain": rng.randint(80, 120),
+                         "green.gain": rng.randint(80, 120),
+                         "blue.gain": rng.randint(80, 120),
+                         "color.temp": 4,
+                         "gamma": 4,
+                         "s3d.mode": 0,
+                         "lamp.pow": 1,
+                         "demsg": 0,
+                         "brightness": 100,
+                         "contrast": 100}
+
+        self.totalHours = rng.randint(1000, 20000)
+        self.lampHours = rng.randint(0, 2000)
+        self.version = "1.{0}.{1}".format(rng.randint(0, 9), rng.randint(0, 99))
+
+        self.errors = []
+        for i in range(rng.randint(0, 6)):
+            self.addError(rng)
+
+    def addError(self, rng):
+        self.errors.append("##{0:04d} {1} {2}".format(len(self.errors) + 1,
+                                                       time.strftime("%Y/%m/%d %H:%M"),
+                                                       rng.choice(ERRORS)))
+
+    def status(self):
+        """
+        Returns the power state, moving on from warming up or cooling
+        down if it's been long enough.
+        """
+        now = time.time()
+        if (self.power == WARMING) and (now - self.changed >= self.warmup):
+            self.power = ON
+            self.changed = now
+        elif (self.power == COOLING) and (now - self.changed >= self.cooldown):
+            self.power = STANDBY
+            self.changed = now
+        return self.power
+
+    def handle(self, cmd):
+        """
+        Returns the projector's answer to a command.
+        """
+        words = cmd.split()
+        if (len(words) < 2) or (words[0] != "op"):
+            return "ERR: unknown command {0}\r\n".format(cmd)
+
+        name = words[1].lower()
+        state = self.status()
+
+        if name == "powon":
+            if state in (STANDBY, COOLING):
+                self.power = WARMING
+                self.changed = time.time()
+            return "ACK: POWON\r\n"
+
+        if name == "powoff":
+            if state in (ON, WARMING):
+                self.power = COOLING
+                self.changed = time.time()
+            return "ACK: POWOFF\r\n"
+
+        if name == "prerr":
+            if len(self.errors) == 0:
+                return "NoErr\r\n"
+            return "\r\n".join(self.errors) + "\r\n"
+
+        if (len(words) == 3) and (words[2] == "?"):
+            if name == "status.check":
+                value = state
+            elif name == "total.hours":
+                value = self.totalHours
+            elif name == "lamp.hours":
+                value = self.lampHours
+            elif name == "soft.version":
+                value = self.version
+            elif name in self.settings:
+                if state != ON:
+                    return "ERR: {0} not available in standby\r\n".format(name.upper())
+                value = self.settings[name]
+            else:
+                return "ERR: unknown variable {0}\r\n".format(name.upper())
+            return "ACK: {0} = {1}\r\n".format(name.upper(), value)
+
+        if (len(words) == 4) and (words[2] == "="):
+            if name not in self.settings:
+                return "ERR: unknown variable {0}\r\n".format(name.upper())
+            if state != ON and name != "demsg":
+                return "ERR: {0} not available in standby\r\n".format(name.upper())
+            try:
+                self.settings[name] = int(words[3])
+            except ValueError:
+                return "ERR: bad value {0}\r\n".format(words[3])
+            return "ACK: {0} = {1}\r\n".format(name.upper(), self.settings[name])
+
+        return "ERR: unknown command {0}\r\n".format(cmd)
+
+
+class Simulator(object):
+    """
+    Serves the simulated projectors, each on its own port.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        self.projectors = dict()
+        for n, serialSwitch, switchPort in layout(args.count):
+            self.projectors[n] = SimProjector(n, args.warmup, args.cooldown, self.rng)
+
+        self.stuck = set(parseNumbers(args.stuck))
+
+        # Connections, indexed by projector number, for --exclusive.
+        self.connected = dict()
+
+        self.commands = 0
+
+    async def start(self):
+        """
+        Opens all the ports, and returns the switch map.
+        """
+        switchMap = dict()
+        for n, serialSwitch, switchPort in layout(self.args.count):
+            port = self.args.base + n
+            await asyncio.start_server(self.connectionHandler(n), self.args.host, port)
+            switchMap["{0}:{1}".format(serialSwitch, switchPort)] = "{0}:{1}".format(self.args.host, port)
+        return switchMap
+
+    def connectionHandler(self, n):
+        async def handler(reader, writer):
+            await self.serve(n, reader, writer)
+        return handler
+
+    async def serve(self, n, reader, writer):
+        """
+        Talks to one telnet client, on behalf of projector n.
+        """
+        if self.args.exclusive and self.connected.get(n, 0) > 0:
+            writer.write(b"port in use\r\n")
+            writer.close()
+            return
+        self.connected[n] = self.connected.get(n, 0) + 1
+
+        # Real switches open with some telnet negotiation.
+        writer.write(bytes([IAC, WILL, ECHO, IAC, WILL, SGA]))
+
+        projector = self.projectors[n]
+        line = bytearray()
+        try:
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+
+                for b in stripTelnet(data):
+                    if b in (ord("\r"), ord("\n")):
+                        cmd = line.decode("utf-8", "replace").strip()
+                        del line[:]
+                        if cmd:
+                            await self.answer(projector, cmd, writer)
+                    else:
+                        line.append(b)
+        except ConnectionError:
+            pass
+        finally:
+            self.connected[n] -= 1
+            writer.close()
+
+    async def answer(self, projector, cmd, writer):
+        """
+        Works out the projector's answer, and sends it after the
+        delay a real projector would take.
+        """
+        self.commands += 1
+
+        if self.args.echo:
+            writer.write((cmd + "\r\n").encode("utf-8"))
+
+        if (projector.number in self.stuck) or (self.rng.random() < self.args.drop):
+            return
+
+        if self.rng.random() < self.args.errorRate:
+            projector.addError(self.rng)
+
+        reply = projector.handle(cmd)
+
+        delay = self.args.latency + self.rng.uniform(0, self.args.jitter)
+        if self.args.baud > 0:
+            # Ten bits a character, both ways.
+            delay += 10.0 * (len(cmd) + len(reply)) / self.args.baud
+        await asyncio.sleep(delay)
+
+        writer.write(reply.encode("utf-8"))
+        await writer.drain()
+
+
+def stripTelnet(data):
+    """
+    Throws away the telnet negotiation from a client.  (We don't care
+    what it wants.)
+    """
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] == IAC and i + 1 < len(data):
+            if data[i + 1] == IAC:
+                out.append(IAC)
+                i += 2
+            elif data[i + 1] == SB:
+                end = data.find(bytes([IAC, SE]), i)
+                i = len(data) if end < 0 else end + 2
+            elif data[i + 1] >= WILL:
+                i += 3
+            else:
+                i += 2
+        else:
+            out.append(data[i])
+            i += 1
+    return bytes(out)
+
+
+def parseNumbers(inputStr):
+    """
+    Reads a list like '3,6-9' into a list of numbers.
+    """
+    numbers = []
+    for token in inputStr.split(","):
+        token = token.strip()
+        if token == "":
+            continue
+        if "-" in token:
+            first, last = token.split("-", 1)
+            numbers.extend(range(int(first), int(last) + 1))
+        else:
+            numbers.append(int(token))
+    return numbers
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Simulates the serial switches and the projectors on them, for testing and benchmarking.')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=69,
+                        help='How many projectors to simulate.')
+    parser.add_argument('--host', dest='host', default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('--base', dest='base', type=int, default=17000,
+                        help='Projector n listens on port base + n.')
+    parser.add_argument('-m', '--map', dest='map', default='/tmp/pjsim-switchmap.json',
+                        help='Where to write the switch map (for PJSWITCHMAP).')
+    parser.add_argument('-l', '--latency', dest='latency', type=float, default=0.05,
+                        help='Seconds a projector takes to answer.')
+    parser.add_argument('-j', '--jitter', dest='jitter', type=float, default=0.05,
+                        help='Up to this many more seconds, at random.')
+    parser.add_argument('--baud', dest='baud', type=int, default=9600,
+                        help='Serial line speed, for the time it takes to send the characters.  0 for no limit.')
+    parser.add_argument('--warmup', dest='warmup', type=float, default=30.0,
+                        help='Seconds from powon to status 2.')
+    parser.add_argument('--cooldown', dest='cooldown', type=float, default=30.0,
+                        help='Seconds from powoff to status 0.')
+    parser.add_argument('--on', dest='on', action='store_true',
+                        help='Start with all the projectors on.')
+    parser.add_argument('--stuck', dest='stuck', default='',
+                        help='Projectors that never answer, like 6,40-42.')
+    parser.add_argument('--drop', dest='drop', type=float, default=0.0,
+                        help='The chance that any one command gets no answer.')
+    parser.add_argument('--errorRate', dest='errorRate', type=float, default=0.0,
+                        help='The chance that any one command adds an entry to the error log.')
+    parser.add_argument('--echo', dest='echo', action='store_true',
+                        help='Echo the commands back, like some switches do.')
+    parser.add_argument('--exclusive', dest='exclusive', action='store_true',
+                        help='Only one telnet session per port at a time, like some switches.')
+    parser.add_argument('--seed', dest='seed', type=int, default=None,
+                        help='Random seed, for repeatable runs.')
+    args = parser.parse_args()
+
+    simulator = Simulator(args)
+    if args.on:
+        for projector in simulator.projectors.values():
+            projector.power = ON
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    switchMap = loop.run_until_complete(simulator.start())
+    # Write it all before anybody can see it.
+    with open(args.map + ".tmp", "w") as f:
+        json.dump(switchMap, f, indent=1)
+    os.replace(args.map + ".tmp", args.map)
+
+    print("simulating {0} projectors on {1}:{2}-{3}, switch map in {4}".format(args.count,
+                                                                               args.host,
+                                                                               args.base,
+                                                                               args.base + args.count - 1,
+                                                                               args.map))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    loop.close()
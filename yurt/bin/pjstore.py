@@ -0,0 +1,655 @@
+#
+# The projector database, one record at a time.
+#
+# pjcontrol used to keep the whole fleet on a shelf as two pickled
+# dictionaries, "projs" and "projControls", opened with writeback=True.
+# Every run read all of it, and every run pickled and wrote all of it
+# back, repair histories and error records included, even for a 'pow'.
+#
+# Here the records are read when somebody asks for them, and when
+# we're done only the ones that have changed are written back.  There
+# are two places to keep them:
+#
+# ProjectorStore keeps each Projector and ProjectorControl as its own
+# entry in the same dbm file that shelve uses:
+#
+#   proj:W217WOCY00053   -- a Projector, by serial number
+#   ctl:42               -- a ProjectorControl, by projector number
+#
+# A database in the old format is never changed here, since the old
+# pjcontrol (and anything else that opens the shelf) still needs to
+# read it.  Instead, convert() copies it into a new file, and
+# PROJECTORDB is pointed at that.  From the command line:
+#
+#   PROJECTORDB=.../projector4.db pjcontrol.py --convert .../projector3.db
+#
+# Opening an old database as a ProjectorStore is an OldDatabase error.
+#
+# InventoryStore keeps them in the SQLite inventory database (see
+# projectorDbMethods.py), spread over the ProjectorStatus,
+# ProjectorSettings, ProjectorRepairs, BulbStatus and ProjectorNumbers
+# tables.  Use pjimport.py to move a shelf into one of those.
+#
+# Each store also has an 'errorLog', for checking a projector's error
+# record against what it has logged before, and for finding who logged
+# an error.  In the inventory these are lookups in the ProjectorErrors
+# table.  On a shelf there's only the text of each projector's record
+# to go through.
+#
+
+import collections.abc
+import dbm
+import pickle
+import threading
+
+# The pickle protocol shelve has always used, so the records can still
+# be read by anything that reads the shelf.
+PROTOCOL = 3
+
+# The ProjectorSettings columns, in the order of
+# Projector.colorSettings.
+SETTINGS = ["redOffset", "greenOffset", "blueOffset",
+            "redGain", "greenGain", "blueGain",
+            "colorTemp", "gamma"]
+
+
+class OldDatabase(Exception):
+    """
+    Raised when a ProjectorStore is opened on a database in the old
+    format, which has to be converted into a new file first.
+    """
+    pass
+
+
+class SerialIndex(object):
+    """
+    Finds the keys (serial numbers) with a given piece of text in them,
+    without looking at every key.  Each key is filed under each of its
+    substrings up to GRAM characters long.  A short fragment is looked
+    up directly, and a longer one in the keys filed under all of its
+    GRAM-character pieces, which are then checked.
+
+    The text is matched as it is, not as a regular expression.
+    """
+    GRAM = 3
+
+    def __init__(self, keys=()):
+        self.keys = set()
+        self.grams = dict()
+        for key in keys:
+            self.add(key)
+
+    def pieces(self, text, length):
+        return set(text[i:i + length] for i in range(len(text) - length + 1))
+
+    def add(self, key):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        for length in range(1, self.GRAM + 1):
+            for gram in self.pieces(key, length):
+                self.grams.setdefault(gram, set()).add(key)
+
+    def discard(self, key):
+        if key not in self.keys:
+            return
+        self.keys.discard(key)
+        for length in range(1, self.GRAM + 1):
+            for gram in self.pieces(key, length):
+                self.grams[gram].discard(key)
+                if len(self.grams[gram]) == 0:
+                    del self.grams[gram]
+
+    def find(self, fragment):
+        """
+        Returns a sorted list of the keys with fragment in them.
+        """
+        if len(fragment) == 0:
+            return sorted(self.keys)
+        if len(fragment) <= self.GRAM:
+            return sorted(self.grams.get(fragment, ()))
+
+        # Start with the piece filed under the fewest keys.
+        candidates = sorted([ self.grams.get(gram, set())
+                              for gram in self.pieces(fragment, self.GRAM) ],
+                            key=len)
+        found = set(candidates[0])
+        for keys in candidates[1:]:
+            if len(found) == 0:
+                break
+            found &= keys
+
+        return sorted(key for key in found if fragment in key)
+
+
+class RecordMap(collections.abc.MutableMapping):
+    """
+    Looks like a dictionary of records, but gets them from a source
+    (ShelfSource, say) as they're asked for.  We keep a pickle of each
+    record as it was read, to tell whether it has changed since.
+    """
+    def __init__(self, source, lock):
+        self.source = source
+        self.lock = lock
+        self.forget()
+
+    def forget(self):
+        """
+        Throws away everything we've read, so the next look comes from
+        the source.
+        """
+        # The records we've read, and their pickles as we read them.
+        self.loaded = dict()
+        self.pickles = dict()
+        # All the keys in the source, once we've looked, and the
+        # SerialIndex of them, once somebody has searched.
+        self.keySet = None
+        self.index = None
+        self.deleted = set()
+
+    def allKeys(self):
+        if self.keySet is None:
+            # The source doesn't have the new records until they're
+            # written.
+            self.keySet = set(self.source.keys()) | set(self.loaded)
+        return self.keySet
+
+    def __contains__(self, key):
+        with self.lock:
+            if self.keySet is None:
+                return (key in self.loaded) or self.source.contains(key)
+            return key in self.keySet
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self.loaded:
+                if (key in self.deleted) or not self.source.contains(key):
+                    raise KeyError(key)
+                value = self.source.read(key)
+                self.loaded[key] = value
+                self.pickles[key] = pickle.dumps(value, PROTOCOL)
+            return self.loaded[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if self.keySet is not None:
+                self.keySet.add(key)
+            if self.index is not None:
+                self.index.add(key)
+            self.loaded[key] = value
+            self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            if key not in self.allKeys():
+                raise KeyError(key)
+            self.keySet.discard(key)
+            if self.index is not None:
+                self.index.discard(key)
+            self.loaded.pop(key, None)
+            self.pickles.pop(key, None)
+            self.deleted.add(key)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.allKeys()))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.allKeys())
+
+    def search(self, fragment):
+        """
+        Returns a sorted list of the keys with fragment in them (see
+        SerialIndex).  The keys have to be strings.
+        """
+        with self.lock:
+            if self.index is None:
+                self.index = SerialIndex(self.allKeys())
+            return self.index.find(fragment)
+
+    def sync(self):
+        """
+        Writes the records that have changed since they were read (or
+        last written) back to the source, and returns how many there
+        were.
+        """
+        with self.lock:
+            for key in self.deleted:
+                self.source.delete(key)
+            self.deleted = set()
+
+            changed = []
+            for key, value in self.loaded.items():
+                raw = pickle.dumps(value, PROTOCOL)
+                if raw != self.pickles.get(key):
+                    if key in self.pickles:
+                        old = pickle.loads(self.pickles[key])
+                    else:
+                        old = None
+                    changed.append((key, value, old))
+                    self.pickles[key] = raw
+
+            if len(changed) > 0:
+                self.source.writeMany(changed)
+        return len(changed)
+
+
+class ShelfSource(object):
+    """
+    Reads and writes one kind of record in a dbm file, with keys like
+    prefix + key.
+    """
+    def __init__(self, store, prefix, keyType):
+        self.store = store
+        self.prefix = prefix
+        self.keyType = keyType
+
+    def dbKey(self, key):
+        return (self.prefix + str(key)).encode("utf-8")
+
+    def keys(self):
+        prefix = self.prefix.encode("utf-8")
+        return [self.keyType(k[len(prefix):].decode("utf-8"))
+                for k in self.store.db().keys() if k.startswith(prefix)]
+
+    def contains(self, key):
+        return self.dbKey(key) in self.store.db()
+
+    def read(self, key):
+        return pickle.loads(self.store.db()[self.dbKey(key)])
+
+    def write(self, key, value, old):
+        self.store.db()[self.dbKey(key)] = pickle.dumps(value, PROTOCOL)
+
+    def writeMany(self, changed):
+        for key, value, old in changed:
+            self.write(key, value, old)
+
+    def delete(self, key):
+        db = self.store.db()
+        if self.dbKey(key) in db:
+            del db[self.dbKey(key)]
+
+
+class ProjectorStore(object):
+    """
+    The projector database, in a dbm file.  'projs' holds the
+    Projector objects, indexed by serial number, and 'projControls'
+    the ProjectorControl objects, indexed by projector number.
+
+    The file is opened when a record is first needed, and closed
+    again by sync(), so a long-running program (like pjserver) doesn't
+    keep it locked between commands.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+        self.lock = threading.RLock()
+
+        self.projs = RecordMap(ShelfSource(self, "proj:", str), self.lock)
+        self.projControls = RecordMap(ShelfSource(self, "ctl:", int), self.lock)
+        self.errorLog = ShelfErrorLog(self.projs)
+
+        if isOldDatabase(self.db()):
+            self.release()
+            raise OldDatabase("{0} is in the old format.  Convert it into a new file with 'pjcontrol.py --convert {0}', and set PROJECTORDB to that.".format(self.path))
+        self.release()
+
+    def db(self):
+        if self.handle is None:
+            self.handle = dbm.open(self.path, "c")
+        return self.handle
+
+    def sync(self):
+        """
+        Writes back whatever has changed, and closes the file.
+        Returns the number of records written.
+        """
+        with self.lock:
+            written = self.projs.sync() + self.projControls.sync()
+            self.release()
+        return written
+
+    def release(self):
+        """
+        Closes the file, but remembers what we've read.
+        """
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+    def forget(self):
+        """
+        Throws away everything we've read (because somebody else has
+        changed the file, say) without writing anything.
+        """
+        with self.lock:
+            self.release()
+            self.projs.forget()
+            self.projControls.forget()
+
+    def close(self):
+        self.sync()
+
+
+def isOldDatabase(db):
+    """
+    Is this open dbm file in the old format, the two big dictionaries?
+    """
+    return (b"projs" in db) or (b"projControls" in db)
+
+
+def convert(oldPath, store):
+    """
+    Copies the records from a database in the old format into a store,
+    which ought to be empty, and writes them.  The old database is only
+    read.  The classes of the pickled objects have to be known as
+    __main__.Projector and so on, as they are in pjcontrol.  Returns
+    the number of projectors and the number of controls copied.
+    """
+    db = dbm.open(oldPath, "r")
+    try:
+        if not isOldDatabase(db):
+            raise ValueError("{0} is not in the old format".format(oldPath))
+        old = dict()
+        for name in [b"projs", b"projControls"]:
+            old[name] = pickle.loads(db[name]) if name in db else dict()
+    finally:
+        db.close()
+
+    for key, value in old[b"projs"].items():
+        store.projs[key] = value
+    for key, value in old[b"projControls"].items():
+        store.projControls[key] = value
+    store.sync()
+
+    return (len(old[b"projs"]), len(old[b"projControls"]))
+
+
+class ShelfErrorLog(object):
+    """
+    The projectors' error logs, when all we have is the text of their
+    error records.
+    """
+    def __init__(self, projs):
+        self.projs = projs
+
+    def knows(self, serialNo, record):
+        """
+        Returns True if the error record looks like it came from the
+        projector with this serial number, or if we have nothing to
+        compare it with.  This is a bit of a cheat: we look for the
+        end of the first entry in the record we have.
+        """
+        errorRecord = self.projs[serialNo].errorRecord
+        if len(errorRecord) == 0:
+            return True
+        errs = record.split("##")
+        return (len(errs) > 1) and (errs[1][-64:] in errorRecord)
+
+    def find(self, errorCode, start=None, end=None):
+        """
+        Returns (serialNo, time, entry) for each time a projector logged
+        the error code, from start up to end, as the inventory does,
+        but by reading every projector's record.
+        """
+        from projectorDbMethods import splitErrorRecord, parseErrorEntry
+
+        found = []
+        for serialNo in sorted(self.projs.keys()):
+            for entry in splitErrorRecord(self.projs[serialNo].errorRecord):
+                number, time, code = parseErrorEntry(entry)
+                if (code != errorCode.lower()) or (time is None):
+                    continue
+                if (start is None or time >= start) and (end is None or time < end):
+                    found.append((serialNo, time, entry.rstrip("\r\n")))
+
+        return sorted(found, key=lambda row: row[1])
+
+
+def fromText(value):
+    """
+    Makes a value from the inventory database a number if it looks
+    like one (it may have been written as text), and leaves anything
+    else alone.
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def makeObject(cls, attributes):
+    """
+    Makes an object of the given class with the given attributes,
+    without running its __init__ (which might have opinions).
+    """
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attributes)
+    return obj
+
+
+class InventoryProjectorSource(object):
+    """
+    Reads and writes Projector objects in the inventory database.
+    """
+    def __init__(self, manager, classes):
+        self.manager = manager
+        self.classes = classes
+
+    def keys(self):
+        return self.manager.getProjectorSerials()
+
+    def contains(self, key):
+        return self.manager.hasProjector(key)
+
+    def read(self, key):
+        record = self.manager.getProjector(key)
+        status = record["status"]
+
+        if record["settings"] is None:
+            colorSettings = [100, 100, 100, 100, 100, 100, 4, 4]
+        else:
+            colorSettings = [fromText(record["settings"][name]) for name in SETTINGS]
+
+        if record["bulb"] is None:
+            lampHours = 0
+        else:
+            lampHours = fromText(record["bulb"]["lampHours"])
+
+        records = [makeObject(self.classes["RepairRecord"],
+                              {"date": repair["repairDate"],
+                               "repair": repair["repairType"],
+                               "comment": repair["repairNote"]})
+                   for repair in record["repairs"]]
+
+        return makeObject(self.classes["Projector"],
+                          {"serialNo": key,
+                           "mfgDate": status["mfgDate"],
+                           "lens": status["lensType"],
+                           "records": records,
+                           "purpose": status["projStatus"],
+                           "colorSettings": colorSettings,
+                           "totalHours": fromText(status["totalHours"]),
+                           "lampHours": lampHours,
+                           "errorRecord": status["errorRecord"]})
+
+    def write(self, key, value, old):
+        self.writeMany([(key, value, old)])
+
+    def writeMany(self, changed):
+        """
+        Writes a list of (key, value, old) changed projectors.  The
+        readings (hours, settings and so on) are what changes most,
+        after a gather, say, so they're written all at once.
+        """
+        manager = self.manager
+        readings = []
+
+        for key, value, old in changed:
+            if (old is None) and not manager.hasProjector(key):
+                manager.addProjector(key, value.mfgDate, value.lens, value.purpose)
+
+            def differs(name):
+                return (old is None) or (getattr(old, name) != getattr(value, name))
+
+            if differs("purpose"):
+                manager.setProjectorStatus(key, value.purpose)
+            if differs("lens"):
+                manager.setProjectorLens(key, value.lens)
+
+            reading = {"projSerial": key}
+            if differs("totalHours"):
+                reading["totalHours"] = value.totalHours
+            if differs("lampHours"):
+                reading["lampHours"] = value.lampHours
+            if differs("errorRecord"):
+                reading["errorRecord"] = value.errorRecord
+            if differs("colorSettings"):
+                settings = list(value.colorSettings[:len(SETTINGS)])
+                reading["settings"] = settings + [0] * (len(SETTINGS) - len(settings))
+            readings.append(reading)
+
+            # Repair records are only ever added to the end.
+            if old is None:
+                newRecords = value.records
+            else:
+                newRecords = value.records[len(old.records):]
+            for record in newRecords:
+                manager.repairProjector(key, record.repair, "", repairNote=record.comment,
+                                        date=record.date)
+
+        manager.setSettingsBatch(readings)
+        manager.recordProjectorHoursBatch(readings)
+        manager.recordLampHoursBatch(readings)
+        manager.recordErrorRecordBatch(readings)
+
+    def delete(self, key):
+        self.manager.projStatus.delete("projectorSerial", key)
+        self.manager.projSettings.delete("projectorSerial", key)
+
+
+class InventoryControlSource(object):
+    """
+    Reads and writes ProjectorControl objects in the inventory
+    database.  The position itself goes in ProjectorNumbers, and the
+    projector installed there is the one whose projNumber says so in
+    ProjectorStatus.  A projector that isn't installed anywhere has a
+    NULL projNumber, and an empty position reads as "none".
+    """
+    def __init__(self, manager, classes):
+        self.manager = manager
+        self.classes = classes
+
+    def keys(self):
+        return [int(n) for n in self.manager.getPositionNumbers()]
+
+    def contains(self, key):
+        return self.manager.hasPosition(str(key))
+
+    def read(self, key):
+        position = self.manager.getPosition(str(key))
+        return makeObject(self.classes["ProjectorControl"],
+                          {"number": key,
+                           "projector": position["projectorSerial"],
+                           "serialSwitch": position["serialSwitch"],
+                           "switchPort": position["serialPort"],
+                           "location": position["onScreen"]})
+
+    def writeMany(self, changed):
+        for key, value, old in changed:
+            self.write(key, value, old)
+
+    def write(self, key, value, old):
+        manager = self.manager
+
+        manager.setPosition(str(key), value.location, value.serialSwitch, value.switchPort)
+
+        if (old is not None) and (old.projector == value.projector):
+            return
+
+        # Whatever was here isn't any more (unless it's been moved
+        # somewhere else already).
+        current = manager.projStatus.getSerialFromNumber(str(key))
+        if (current is not None) and (current != value.projector):
+            manager.setProjectorNumber(current, None)
+
+        if value.projector != "none":
+            manager.setProjectorNumber(value.projector, str(key))
+
+    def delete(self, key):
+        current = self.manager.projStatus.getSerialFromNumber(str(key))
+        if current is not None:
+            self.manager.setProjectorNumber(current, None)
+        self.manager.projNumbers.delete("projNumber", str(key))
+
+
+class InventoryErrorLog(object):
+    """
+    The projectors' error logs, in the inventory's ProjectorErrors
+    table.  New entries are added there when the error records are
+    written.
+    """
+    def __init__(self, manager, lock):
+        self.manager = manager
+        self.lock = lock
+
+    def knows(self, serialNo, record):
+        """
+        Returns True if the first entry of the error record is in the
+        log of the projector with this serial number, or if its log is
+        empty.
+        """
+        with self.lock:
+            return self.manager.knowsErrors(record, serialNo)
+
+    def find(self, errorCode, start=None, end=None):
+        """
+        Returns (serialNo, time, entry) for each time a projector logged
+        the error code, from start up to end, earliest first.
+        """
+        with self.lock:
+            return self.manager.findErrors(errorCode, start, end)
+
+
+class InventoryStore(object):
+    """
+    The projector database, in the SQLite inventory database.  Looks
+    just like a ProjectorStore from outside.
+
+    classes -- a dictionary of the classes to make the records out of
+      (Projector, ProjectorControl and RepairRecord), since they're
+      defined by whoever is using this.
+    """
+    def __init__(self, path, classes):
+        # Imported here so the shelf can be used without it.
+        from projectorDbMethods import InventoryDatabaseManager
+
+        self.path = path
+        self.manager = InventoryDatabaseManager(path)
+        self.lock = threading.RLock()
+
+        self.projs = RecordMap(InventoryProjectorSource(self.manager, classes), self.lock)
+        self.projControls = RecordMap(InventoryControlSource(self.manager, classes), self.lock)
+        self.errorLog = InventoryErrorLog(self.manager, self.lock)
+
+    def sync(self):
+        # The projectors go first, so they're there to be installed.
+        # It's all committed at once, at the end.
+        with self.lock, self.manager.transaction():
+            return self.projs.sync() + self.projControls.sync()
+
+    def release(self):
+        pass
+
+    def forget(self):
+        with self.lock:
+            self.projs.forget()
+            self.projControls.forget()
+
+    def close(self):
+        self.sync()
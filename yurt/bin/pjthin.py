@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+#
+# The thin client for pjserver.py.  It takes the same arguments as
+# pjcontrol, sends them to the server over its UNIX socket, and prints
+# what comes back, so it looks just like running pjcontrol, only
+# quicker.  If there's no server, or it won't take the command, this
+# runs pjcontrol.py instead.
+#
+# This is run for every command, so it imports as little as it can.
+#
+
+import json
+import os
+import socket
+import sys
+
+# Where the server's socket is, unless PJSERVER says otherwise.  (Same
+# as in pjserver.py.)
+SERVERSOCKET = "/tmp/pjcontrol.sock"
+
+
+def fallBack(argv):
+    """
+    Runs pjcontrol.py itself, in place of this process.
+    """
+    pjcontrol = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pjcontrol.py")
+    os.execv(pjcontrol, [pjcontrol] + argv)
+
+
+def run(argv):
+    """
+    Has the server run the command line, and returns the exit status.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(os.environ.get("PJSERVER", SERVERSOCKET))
+    except OSError:
+        s.close()
+        fallBack(argv)
+
+    request = {"argv": argv,
+               "db": os.environ.get("PJINVENTORY", "") or os.path.expandvars("${PROJECTORDB}")}
+    s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+
+    for line in s.makefile("r", encoding="utf-8"):
+        message = json.loads(line)
+        if "out" in message:
+            sys.stdout.write(message["out"])
+            sys.stdout.flush()
+        elif "err" in message:
+            sys.stderr.write(message["err"])
+            sys.stderr.flush()
+        elif "exit" in message:
+            return message["exit"]
+        elif "refused" in message:
+            s.close()
+            fallBack(argv)
+
+    # The server went away partway through.  We can't tell how far
+    # it got, so we don't try again.
+    s.close()
+    print("ERR: lost the connection to pjserver.", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:]))
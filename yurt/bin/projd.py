@@ -1,108 +1,625 @@
-#!/usr/bin/env python
-
-# Listens on a set of ports, forwards telnet connections to pjcontrol
-# script to send commands to a specific projector.
+#!/usr/bin/env python3
+#
+# Listens on a set of ports, forwards telnet connections to the
+# serial switches to send commands to a specific projector.
+#
+# Each projector has an IP address of its own on the projector network
+# (192.168.160.x), and whatever is sent to port 5450 there goes to that
+# projector as an 'op' command, with the reply sent back as "OP ...",
+# the way pjcontrol-raw would have printed it.
+#
+# A command is one line, ending with a newline or a carriage return.
+# A client can send as many commands as it likes without waiting for
+# the replies, which come back in the order the commands were sent, on
+# the connection that sent them.
+#
+# Everything is done in one asyncio event loop, listening on all the
+# addresses at once, so there are no threads to a projector or to a
+# connection, and a slow projector only holds up its own clients.
+#
+# Which switch port each projector is on comes from the projector
+# database (PROJECTORDB, or PJINVENTORY, as for pjcontrol), read when
+# we start, and again on a SIGHUP.  The commands go through the broker
+# (pjbroker.py) if PJBROKER says there is one, and otherwise straight
+# to the switch, with opclient.py.
+#
+# Run it like this, with the projectors to answer for as the last
+# number of the address and the projector number:
+#
+#   projd.py 100:38 101:39 102:40
+#
+# or a range of addresses, numbered from the first projector number:
+#
+#   projd.py 101-169:0
+#
+# projd also counts what it does for each projector: the commands and
+# the replies (by ACK, ERR, NoErr or timeout), how long commands wait
+# in the queue and how long the projector takes to answer, and how
+# many clients are connected and commands waiting.  These are served
+# for Prometheus, as text, at http://localhost:5451/metrics.
 #
 
+import asyncio
+import bisect
+import collections
+import functools
+import logging
+import os
+import re
+import time
 
-import socket, threading, subprocess, logging, re
+import opclient
+import pjbroker
+import pjcontrol
 
 HOST = '192.168.160.'
-#HOST = '127.0.0.1'
+#HOST = '127.0.0.'
 PORT = 5450
 
-# Object to hold the details of a socket connection.
-class sskt():
-    def __init__(self, host, port):
+# The projectors we answer for, unless the command line says otherwise:
+# (last number of the IP address, projector number).
+PROJECTORS = [(100, 38), (101, 39), (102, 40), (103, 41), (104, 42), (105, 43)]
+
+# The longest command line we'll take, in bytes, and the most commands
+# a client can have sent without having had the replies yet.  Past
+# that, we stop reading from the client until it catches up.
+MAXLINE = 1024
+MAXPENDING = 32
+
+# Where the metrics are served, as host:port.
+METRICSADDRESS = "localhost:5451"
+
+# The upper bounds of the latency histograms' buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger("projd")
+
+
+def parseProjectors(specs):
+    """
+    Turns the command line's list of "100:38" or "101-169:0" into a
+    list of (last number of the address, projector number).
+    """
+    projectors = []
+    for spec in specs:
+        hosts, projNumber = spec.split(":")
+        first, last = (hosts.split("-") + [hosts])[:2]
+        for i, host in enumerate(range(int(first), int(last) + 1)):
+            projectors.append((host, int(projNumber) + i))
+    return projectors
+
+
+def fixCommand(data):
+    """
+    Turns what a client sent into the 'op' command pjcontrol-raw would
+    have sent for it, or "" if there's nothing there.  Our clients have
+    their own names for a couple of the commands.  The words are put
+    back together with single spaces, as they were when they went
+    through pjcontrol-raw's command line.
+    """
+    if '.off ' in data:
+        data = data.replace(".off ", ".offset ")
+    if 'bright ' in data:
+        data = data.replace("bright", "brightness")
+    words = data.split()
+    if len(words) == 0:
+        return ""
+    return "op " + " ".join(words)
+
+
+def readControls():
+    """
+    Returns where each projector is, from the projector database, as a
+    dictionary of (serial number, switch, port), by projector number.
+    """
+    pjcontrol.registerClasses()
+    store = pjcontrol.openStore()
+    try:
+        return dict((number, (control.projector, control.serialSwitch, control.switchPort))
+                    for number, control in store.projControls.items())
+    finally:
+        store.close()
+
+
+class Histogram(object):
+    """
+    Counts how many times a value fell between each of the bucket
+    bounds, and their sum.  The counts are made cumulative, the way
+    Prometheus wants them, only when they're shown.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # One more than there are bounds, for the ones past the last.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def format(self, name, labels):
+        """
+        Returns the lines for the histogram in Prometheus' text format.
+        """
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound, total))
+        lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, self.sum))
+        lines.append('{0}_count{{{1}}} {2}'.format(name, labels, total))
+        return lines
+
+
+class ProjectorMetrics(object):
+    """
+    What projd has done for one projector.  Everything is kept as
+    plain numbers, so a command only costs a few additions.
+    """
+    def __init__(self):
+        self.commands = 0
+        # Commands that shared the answer to one already waiting.
+        self.shared = 0
+        # Replies, by their status: ACK, ERR, NoErr or timeout.
+        self.replies = dict()
+        self.queueWait = Histogram()
+        self.roundTrip = Histogram()
+
+    def countReply(self, status):
+        self.replies[status] = self.replies.get(status, 0) + 1
+
+
+def formatMetrics(metrics, clients, queues):
+    """
+    Returns the metrics for all the projectors, in Prometheus' text
+    format.  'metrics', 'clients' and 'queues' are the Projd's
+    dictionaries of them, by projector number.
+    """
+    lines = []
+
+    def family(name, kind, text, values):
+        lines.append("# HELP {0} {1}".format(name, text))
+        lines.append("# TYPE {0} {1}".format(name, kind))
+        for projNumber in sorted(metrics):
+            labels = 'projector="proj{0:02d}"'.format(projNumber)
+            value = values(projNumber)
+            if isinstance(value, Histogram):
+                lines.extend(value.format(name, labels))
+            elif isinstance(value, dict):
+                for key in sorted(value):
+                    lines.append('{0}{{{1},status="{2}"}} {3}'.format(name, labels, key, value[key]))
+            else:
+                lines.append('{0}{{{1}}} {2}'.format(name, labels, value))
+
+    family("projd_commands_total", "counter",
+           "Commands received from clients.",
+           lambda n: metrics[n].commands)
+    family("projd_commands_shared_total", "counter",
+           "Commands answered with the reply to the same command already waiting.",
+           lambda n: metrics[n].shared)
+    family("projd_replies_total", "counter",
+           "Replies to the commands sent, by status.",
+           lambda n: metrics[n].replies)
+    family("projd_queue_wait_seconds", "histogram",
+           "Time from a command being queued to its being sent.",
+           lambda n: metrics[n].queueWait)
+    family("projd_round_trip_seconds", "histogram",
+           "Time from a command being sent to the projector's reply.",
+           lambda n: metrics[n].roundTrip)
+    family("projd_connections", "gauge",
+           "Clients connected.",
+           lambda n: len(clients[n]))
+    family("projd_queue_depth", "gauge",
+           "Commands waiting to be sent.",
+           lambda n: len(queues[n]))
+
+    return "\n".join(lines) + "\n"
+
+
+class LineReader(object):
+    """
+    Reads what a client sends a line at a time.  A line ends with a
+    newline or a carriage return (or both, which makes an empty line
+    after it).  No more than 'limit' bytes of a line are kept.
+    """
+    def __init__(self, reader, limit=MAXLINE):
+        self.reader = reader
+        self.limit = limit
+        self.buffer = bytearray()
+        # Set while we throw away the rest of a line that was too long.
+        self.skipping = False
+
+    async def readline(self):
+        """
+        Returns the next line, without its ending, or None when the
+        client is done.  Raises ValueError for a line that's too long,
+        once, and then goes on with the line after it.
+        """
+        while True:
+            end = re.search(b"[\r\n]", self.buffer)
+            if end is not None:
+                line = bytes(self.buffer[:end.start()])
+                del self.buffer[:end.end()]
+                if self.skipping:
+                    self.skipping = False
+                    continue
+                if len(line) > self.limit:
+                    raise ValueError("line longer than {0} bytes".format(self.limit))
+                return line
+
+            if len(self.buffer) > self.limit:
+                del self.buffer[:]
+                if not self.skipping:
+                    self.skipping = True
+                    raise ValueError("line longer than {0} bytes".format(self.limit))
+
+            data = await self.reader.read(1024)
+            if not data:
+                # What's left is the last line, if there's anything.
+                line = bytes(self.buffer)
+                del self.buffer[:]
+                if (len(line) == 0) or self.skipping:
+                    return None
+                return line
+            self.buffer.extend(data)
+
+
+class CommandQueue(object):
+    """
+    The commands waiting for one projector, from all its clients, sent
+    one at a time, in the order they came in.  If somebody asks the
+    same question (a command that doesn't change anything, as
+    opclient.isWrite() sees it) as somebody else who is still waiting,
+    they share the one answer.  A question is only shared with the
+    ones after the last command waiting that does change something,
+    so nobody's question is answered from before their change went
+    in.
+
+    run -- the coroutine function that sends a command, and returns
+      the reply.
+
+    metrics -- the projector's ProjectorMetrics.
+    """
+    def __init__(self, run, metrics):
+        self.run = run
+        self.metrics = metrics
+
+        # Each waiting command, as [cmd, isWrite, futures, when queued].
+        self.waiting = collections.deque()
+        self.worker = None
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def submit(self, cmd):
+        """
+        Queues a command, and returns a future for the reply.
+        """
+        future = asyncio.Future()
+        self.metrics.commands += 1
+
+        write = opclient.isWrite(cmd)
+        if not write:
+            for item in reversed(self.waiting):
+                if item[1]:
+                    break
+                if item[0] == cmd:
+                    item[2].append(future)
+                    self.metrics.shared += 1
+                    return future
+
+        self.waiting.append([cmd, write, [future], time.monotonic()])
+        if (self.worker is None) or self.worker.done():
+            self.worker = asyncio.ensure_future(self.work())
+        return future
+
+    async def work(self):
+        while len(self.waiting) > 0:
+            cmd, write, futures, queued = self.waiting.popleft()
+            self.metrics.queueWait.observe(time.monotonic() - queued)
+            try:
+                reply = await self.run(cmd)
+            except Exception as e:
+                log.error("%s: %s", cmd, e)
+                reply = "ERR: {0}\n".format(e)
+                self.metrics.countReply("ERR")
+            for future in futures:
+                if not future.done():
+                    future.set_result(reply)
+
+
+class Projd(object):
+    """
+    Serves the clients of all the projectors.  Whatever a client sends
+    goes to the projector as a command, a line at a time, through the
+    projector's CommandQueue, and the reply goes back to that client.
+
+    controls -- where each projector is (see readControls()).
+
+    broker -- the address of the broker, or "" to talk to the switches
+      ourselves.
+
+    The ProjectorMetrics for each projector are in 'metrics', by
+    projector number, and serveMetrics() serves them over HTTP.
+    """
+    def __init__(self, controls, host=HOST, port=PORT, broker="",
+                 timeout=opclient.TIMEOUT, quiet=opclient.QUIET):
+        self.controls = controls
         self.host = host
         self.port = port
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.s.bind((self.host, self.port))
-        self.s.listen(4)
-
-        print "listening on ", self.host, ":" , self.port
-
-    def accept(self):
-        return self.s.accept()
-
-# A threading object that actually listens at a port and forwards the
-# connection to pjcontrol.  The threads here are so this can take
-# commands from multiple connections, though that is probably not
-# useful in this context, and I haven't really tested it, either.
-class projChat(threading.Thread):
-    def __init__(self, (socket,address), lock, clients, projNumber):
-        threading.Thread.__init__(self)
-        self.socket = socket
-        self.address= address
-        self.projNumber = projNumber
-        self.lock = lock
-        self.clients = clients
-
-        logging.basicConfig(filename='/tmp/projd.log',
-                            format='{0} proj{1:02d}: %(asctime)s :%(message)s'.format(self.address[0], self.projNumber),
-                            datefmt='%m/%d/%Y %I:%M:%S %p',
-                            level=logging.DEBUG)
-
-
-    def run(self):
-        self.lock.acquire()
-        self.clients.append(self)
-        self.lock.release()
-
-        print '%s:%s connected.' % self.address
+        self.broker = broker
+
+        self.client = opclient.OpClient(timeout, quiet)
+        # A broker session for each projector, so they don't wait for
+        # each other.
+        self.brokerSessions = dict()
+
+        # The clients (their StreamWriters) connected to each
+        # projector, its CommandQueue and its ProjectorMetrics, by
+        # projector number.
+        self.clients = dict()
+        self.queues = dict()
+        self.metrics = dict()
+        self.servers = []
+
+    async def listen(self, projectors):
+        """
+        Starts listening for each of a list of (last number of the
+        address, projector number).  An address we can't listen on is
+        logged and skipped.
+        """
+        for host, projNumber in projectors:
+            address = self.host + "{0:03d}".format(host)
+            self.clients[projNumber] = set()
+            self.metrics[projNumber] = ProjectorMetrics()
+            self.queues[projNumber] = CommandQueue(functools.partial(self.run, projNumber),
+                                                   self.metrics[projNumber])
+            try:
+                server = await asyncio.start_server(functools.partial(self.handleClient, projNumber),
+                                                    address, self.port, reuse_address=True)
+            except OSError as e:
+                log.error("proj%02d: cannot listen on %s:%d: %s", projNumber, address, self.port, e)
+                continue
+            self.servers.append(server)
+            print("listening on ", address, ":", self.port)
+
+    async def handleClient(self, projNumber, reader, writer):
+        """
+        Serves one client connection.  Each line is a command.  A
+        client doesn't have to wait for one reply before sending the
+        next command; they all go into the queue as they come in, and
+        the replies are sent back in the same order, as they're ready.
+        """
+        address = writer.get_extra_info("peername")
+        prefix = "{0} proj{1:02d}:".format(address[0], projNumber)
+        self.clients[projNumber].add(writer)
+        print("%s:%s connected." % address[:2])
+
+        # The futures for the replies, in the order they're owed.
+        pending = asyncio.Queue(MAXPENDING)
+        replier = asyncio.ensure_future(self.reply(prefix, writer, pending))
+
+        lines = LineReader(reader)
+        try:
+            while True:
+                try:
+                    line = await lines.readline()
+                except ValueError as e:
+                    log.warning("%s %s", prefix, e)
+                    future = asyncio.Future()
+                    future.set_result("ERR: {0}\n".format(e))
+                    await pending.put(future)
+                    continue
+
+                if line is None:
+                    break
+
+                cmd = fixCommand(line.decode("utf-8", "replace"))
+                if cmd == "":
+                    continue
+                log.info("%s %s>", prefix, cmd)
+
+                await pending.put(self.queues[projNumber].submit(cmd))
+        except OSError as e:
+            log.warning("%s %s", prefix, e)
+        finally:
+            # Send whatever replies are still owed before hanging up.
+            await pending.put(None)
+            await replier
+            self.clients[projNumber].discard(writer)
+            writer.close()
+            print("%s:%s disconnected." % address[:2])
+
+    async def reply(self, prefix, writer, pending):
+        """
+        Sends a client the replies to its commands, in order, until it
+        gets a None.  If the client has gone away, the replies are
+        thrown away.
+        """
         while True:
-            data = self.socket.recv(1024)
-            if not data:
-                break
-            for c in self.clients:
-
-                # fix string
-                if '.off ' in data:
-                    data = data.replace(".off ", ".offset ")
-                if 'bright ' in data:
-                    data = data.replace("bright", "brightness")
-
-                logging.info(data.rstrip('\n\r') + '>')
-
-                out = subprocess.check_output(["/gpfs/runtime/opt/cave-utils/yurt/bin/pjcontrol-raw", 
-                                               "{0:02d}".format(self.projNumber),
-                                               "raw {0}".format(data)])
-
-                logging.info("OP " + out.rstrip('\n\r') + '<')
-                #logging.info("OP " + out + '<')
-
-                c.socket.send("OP " + out)
-        self.socket.close()
-        print '%s:%s disconnected.' % self.address
-        self.lock.acquire()
-        self.clients.remove(self)
-        self.lock.release()
-
-# This makes a thread dedicated a specific projector and IP.  The
-# 'host' in this case is just the last number in the IP address.
-class projChats(threading.Thread):
-    def __init__(self, host, proj):
-        threading.Thread.__init__(self)
-
-        self.clients = [] #list of clients connected
-        self.lock = threading.Lock()
-        self.host = HOST + "{0:03d}".format(host)
-        self.proj = proj
-
-        self.skt = sskt(self.host, PORT)
-
-    def run(self):
-        while True: # wait for socket to connect
-            # send socket to chatserver and start monitoring
-            projChat(self.skt.accept(), self.lock, self.clients, self.proj).start()
-
-#for i in range(0,68):
-#         projChats(101 + i, i).start()
-
-projChats(100,38).start()
-projChats(101,39).start()
-projChats(102,40).start()
-projChats(103,41).start()
-projChats(104,42).start()
-projChats(105,43).start()
+            future = await pending.get()
+            if future is None:
+                return
+
+            out = await future
+            log.info("%s OP %s<", prefix, out.rstrip('\n\r'))
+
+            if writer is None:
+                continue
+            try:
+                writer.write(("OP " + out).encode("utf-8"))
+                await writer.drain()
+            except OSError as e:
+                log.warning("%s %s", prefix, e)
+                writer = None
+
+    async def run(self, projNumber, cmd):
+        """
+        Sends a command to a projector, and returns the reply, as
+        pjcontrol-raw would have printed it.
+        """
+        metrics = self.metrics[projNumber]
+        if projNumber not in self.controls:
+            metrics.countReply("ERR")
+            return "ERR: So sorry. I never heard of projector {0}.\n".format(projNumber)
+
+        serialNo, serialSwitch, switchPort = self.controls[projNumber]
+        if serialNo == "none":
+            metrics.countReply("ERR")
+            return "ERR: I regret that there is no projector installed at {0} at the present.\n".format(projNumber)
+
+        proj = "proj{0:02d}".format(projNumber)
+        start = time.monotonic()
+        reply = await self.send(proj, serialSwitch, switchPort, cmd)
+        metrics.roundTrip.observe(time.monotonic() - start)
+        metrics.countReply(reply.status)
+        return reply.formatRaw(proj, cmd)
+
+    async def send(self, proj, serialSwitch, switchPort, cmd):
+        """
+        Sends a command through the broker, if there is one, or else
+        straight to the switch, and returns the OpReply.
+        """
+        if self.broker != "":
+            if proj not in self.brokerSessions:
+                self.brokerSessions[proj] = pjbroker.BrokerSession(self.broker)
+            try:
+                replies = await self.brokerSessions[proj].sendMany(proj, serialSwitch, switchPort, [cmd])
+                return replies[0]
+            except OSError as e:
+                log.warning("%s: no broker at %s: %s", proj, self.broker, e)
+
+        try:
+            return await self.client.send(serialSwitch, switchPort, cmd)
+        except opclient.SwitchUnreachable as e:
+            return opclient.OpReply("ERR", "{0}\n".format(e))
+
+    async def serveMetrics(self, address):
+        """
+        Starts serving the metrics over HTTP at the given host:port,
+        for Prometheus to collect.
+        """
+        host, port = pjbroker.parseAddress(address)
+        server = await asyncio.start_server(self.handleMetrics, host, port,
+                                            reuse_address=True)
+        self.servers.append(server)
+        print("metrics on ", address)
+
+    async def handleMetrics(self, reader, writer):
+        """
+        Answers one HTTP request: GET /metrics gets the metrics, and
+        anything else gets a 404.
+        """
+        try:
+            request = await asyncio.wait_for(reader.readline(), 10.0)
+            # Skip the headers; we don't need any of them.
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 10.0)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            words = request.decode("latin-1").split()
+            if (len(words) >= 2) and (words[0] in ("GET", "HEAD")) and (words[1].split("?")[0] == "/metrics"):
+                status = "200 OK"
+                body = formatMetrics(self.metrics, self.clients, self.queues)
+            else:
+                status = "404 Not Found"
+                body = "Try /metrics.\n"
+            body = body.encode("utf-8")
+
+            writer.write("HTTP/1.0 {0}\r\n"
+                         "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         "Content-Length: {1}\r\n"
+                         "Connection: close\r\n\r\n".format(status, len(body)).encode("latin-1"))
+            if words[:1] != ["HEAD"]:
+                writer.write(body)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            log.warning("metrics: %s", e)
+        finally:
+            writer.close()
+
+    async def closeIdleSessions(self, idle):
+        """
+        Every so often, close the switch sessions that haven't been
+        used in a while, so we don't hog switch ports.
+        """
+        while True:
+            await asyncio.sleep(idle / 4.0)
+            self.client.closeIdle(idle)
+
+    def reload(self):
+        """
+        Reads where the projectors are from the database again.
+        """
+        try:
+            self.controls = readControls()
+            log.info("read %d projector positions", len(self.controls))
+        except Exception as e:
+            log.error("cannot read the projector database: %s", e)
+
+    def close(self):
+        for server in self.servers:
+            server.close()
+        for session in self.brokerSessions.values():
+            session.close()
+        self.client.close()
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import signal
+
+    parser = argparse.ArgumentParser(description='Listens on each projector address, and forwards what comes in to the projector as an op command.')
+    parser.add_argument('projectors', nargs='*',
+                        help='The projectors to answer for, as the last number of the address and the projector number (100:38), or a range of addresses and the first projector number (101-169:0).  Defaults to {0}.'.format(" ".join("{0}:{1}".format(*p) for p in PROJECTORS)))
+    parser.add_argument('-H', '--host', dest='host', default=HOST,
+                        help='The addresses, without the last number. (Default {0})'.format(HOST))
+    parser.add_argument('-p', '--port', dest='port', type=int, default=PORT,
+                        help='The port to listen on at each address. (Default {0})'.format(PORT))
+    parser.add_argument('-b', '--broker', dest='broker',
+                        default=os.environ.get("PJBROKER", ""),
+                        help='The broker to send the commands through, as host:port.  Defaults to $PJBROKER.  Without one, we talk to the switches ourselves.')
+    parser.add_argument('-t', '--timeout', dest='timeout', type=float, default=opclient.TIMEOUT,
+                        help='Seconds to wait for a projector to answer. (Same as pjexpect.)')
+    parser.add_argument('-q', '--quiet', dest='quiet', type=float, default=opclient.QUIET,
+                        help='Seconds of silence after which a reply without an ACK (like an error dump) is considered complete.')
+    parser.add_argument('-i', '--idle', dest='idle', type=float, default=300.0,
+                        help='Seconds after which an unused switch session is closed.')
+    parser.add_argument('-m', '--metrics', dest='metrics', default=METRICSADDRESS,
+                        help='Where to serve the metrics for Prometheus, as host:port, or "" for nowhere. (Default {0})'.format(METRICSADDRESS))
+    parser.add_argument('--log', dest='log', default='/tmp/projd.log',
+                        help='Log file.')
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log,
+                        format='%(asctime)s :%(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.DEBUG)
+
+    projectors = PROJECTORS
+    if args.projectors:
+        projectors = parseProjectors(args.projectors)
+
+    projd = Projd(readControls(), args.host, args.port, args.broker,
+                  args.timeout, args.quiet)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(projd.listen(projectors))
+    if args.metrics != "":
+        try:
+            loop.run_until_complete(projd.serveMetrics(args.metrics))
+        except (OSError, ValueError) as e:
+            log.error("cannot serve metrics on %s: %s", args.metrics, e)
+    loop.add_signal_handler(signal.SIGHUP, projd.reload)
+    asyncio.ensure_future(projd.closeIdleSessions(args.idle))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+    projd.close()
+    loop.close()
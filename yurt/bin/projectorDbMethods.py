@@ -1,5 +1,135 @@
+import contextlib
+import csv
+import hashlib
+import json
+import re
 import sqlite3
+import struct
+import sys
 import datetime
+import threading
+import zlib
+
+# The schema, one version at a time.  Each version lists the tables it
+# added or changed, with their columns as of that version.  The first
+# column of each of the main tables is its key.  The history tables
+# have the columns of the main table, plus the date and a note.
+#
+# The version a database is at is kept in its user_version.  Databases
+# made before there was a version (0) have only TEXT columns, and no
+# keys or indexes, and are brought up to date when opened, one version
+# at a time.  See InventoryDatabase.upgradeSchema().
+VERSIONS = [
+    # 1: Numbers are INTEGER instead of TEXT, the main tables have
+    # keys, and a projector that isn't installed has a NULL projNumber,
+    # instead of "none".
+    [
+        ("ProjectorSettings",
+         "projectorSerial TEXT PRIMARY KEY, redOffset INTEGER, greenOffset INTEGER, blueOffset INTEGER, redGain INTEGER, greenGain INTEGER, blueGain INTEGER, colorTemp INTEGER, gamma INTEGER"),
+        ("ProjectorSettingsHistory",
+         "projectorSerial TEXT, redOffset INTEGER, greenOffset INTEGER, blueOffset INTEGER, redGain INTEGER, greenGain INTEGER, blueGain INTEGER, colorTemp INTEGER, gamma INTEGER, dateRecorded TEXT, note TEXT"),
+        ("ProjectorStatus",
+         "projectorSerial TEXT PRIMARY KEY, mfgDate TEXT, projNumber INTEGER, totalHours INTEGER, projStatus TEXT, onSite TEXT, lensType TEXT, repairID INTEGER, errorRecord TEXT"),
+        ("ProjectorStatusHistory",
+         "projectorSerial TEXT, mfgDate TEXT, projNumber INTEGER, totalHours INTEGER, projStatus TEXT, onSite TEXT, lensType TEXT, repairID INTEGER, errorRecord TEXT, dateRecorded TEXT, note TEXT"),
+        ("ProjectorNumbers",
+         "projNumber INTEGER PRIMARY KEY, onScreen TEXT, serialSwitch TEXT, serialPort TEXT, projServer TEXT, projDisplay TEXT"),
+        ("ProjectorRepairs",
+         "repairID INTEGER PRIMARY KEY AUTOINCREMENT, projectorSerial TEXT, repairType TEXT, repairedBy TEXT, repairDate TEXT, repairNote TEXT"),
+        ("BulbStatus",
+         "bulbID INTEGER PRIMARY KEY AUTOINCREMENT, bulbSerial TEXT, bulbLife INTEGER, bulbStatus TEXT, projectorSerial TEXT, lampHours INTEGER, dateIn TEXT, dateOut TEXT, repairID INTEGER"),
+        ("BulbStatusHistory",
+         "bulbID INTEGER, bulbSerial TEXT, bulbLife INTEGER, bulbStatus TEXT, projectorSerial TEXT, lampHours INTEGER, dateIn TEXT, dateOut TEXT, repairID INTEGER, dateRecorded TEXT, note TEXT"),
+    ],
+    # 2: Error records are stored once each, by content, in
+    # ErrorEntries and ErrorRecords (see ErrorRecords below), and
+    # ProjectorStatus and its history only have their IDs.  The text
+    # is stored as the tables are copied (see copyTable()).
+    [
+        ("ErrorEntries",
+         "entryID INTEGER PRIMARY KEY AUTOINCREMENT, digest TEXT UNIQUE, entry BLOB"),
+        ("ErrorRecords",
+         "recordID INTEGER PRIMARY KEY AUTOINCREMENT, digest TEXT UNIQUE, parentID INTEGER, depth INTEGER, entryIDs BLOB"),
+        ("ProjectorStatus",
+         "projectorSerial TEXT PRIMARY KEY, mfgDate TEXT, projNumber INTEGER, totalHours INTEGER, projStatus TEXT, onSite TEXT, lensType TEXT, repairID INTEGER, errorRecordID INTEGER"),
+        ("ProjectorStatusHistory",
+         "projectorSerial TEXT, mfgDate TEXT, projNumber INTEGER, totalHours INTEGER, projStatus TEXT, onSite TEXT, lensType TEXT, repairID INTEGER, errorRecordID INTEGER, dateRecorded TEXT, note TEXT"),
+    ],
+    # 3: Each projector's error log, entry by entry, is in
+    # ProjectorErrors, which starts out with the entries of each
+    # projector's current error record.
+    [
+        ("ProjectorErrors",
+         "projectorSerial TEXT, sequence INTEGER, entryID INTEGER, errorNumber INTEGER, errorTime TEXT, errorCode TEXT, dateRecorded TEXT, PRIMARY KEY (projectorSerial, sequence)"),
+    ],
+]
+
+SCHEMAVERSION = len(VERSIONS)
+
+
+def tablesAt(version):
+    """
+    Returns the tables as they were in the given version of the
+    schema, as a list of (name, columns), in the order they're made.
+    """
+    tables = []
+    for changes in VERSIONS[:version]:
+        for table, columns in changes:
+            names = [name for name, old in tables]
+            if table in names:
+                tables[names.index(table)] = (table, columns)
+            else:
+                tables.append((table, columns))
+    return tables
+
+# The tables as they are now.
+TABLES = tablesAt(SCHEMAVERSION)
+
+# The tables whose keys SQLite makes up for us.
+AUTOKEYS = ["ErrorEntries", "ErrorRecords", "ProjectorRepairs", "BulbStatus"]
+
+# The most records an error record can be built on (see ErrorRecords)
+# before it's stored whole again, so reading one back never has to
+# follow a long chain.
+CHAINLIMIT = 32
+
+# The most keys we look up in one SELECT ... IN (...).  SQLite won't
+# take more than 999 parameters in a statement.
+MAXKEYS = 500
+
+# How many compiled statements each connection keeps around (the
+# sqlite3 module's cached_statements).  The Statements objects below
+# make the SQL for each kind of operation the same every time, so
+# this only needs to be big enough to hold them all.
+STATEMENTCACHE = 256
+
+# How many rows the reports read from the database at a time.
+REPORTCHUNK = 500
+
+# The ways a report can be printed (see DatabaseTable.prettyTable()).
+REPORTFORMS = ["text", "csv", "jsonl"]
+
+# The indexes, for the lookups other than by key.
+INDEXES = [
+    ("ProjectorSettingsHistoryBySerial", "ProjectorSettingsHistory(projectorSerial, dateRecorded)"),
+    ("ProjectorStatusByNumber", "ProjectorStatus(projNumber)"),
+    ("ProjectorStatusHistoryBySerial", "ProjectorStatusHistory(projectorSerial, dateRecorded)"),
+    ("ProjectorRepairsBySerial", "ProjectorRepairs(projectorSerial)"),
+    ("BulbStatusByBulb", "BulbStatus(bulbSerial, bulbLife)"),
+    ("BulbStatusBySerial", "BulbStatus(projectorSerial)"),
+    ("BulbStatusHistoryByBulb", "BulbStatusHistory(bulbID, dateRecorded)"),
+    ("ProjectorErrorsByEntry", "ProjectorErrors(entryID, projectorSerial)"),
+    ("ProjectorErrorsByCode", "ProjectorErrors(errorCode, errorTime)"),
+    ]
+
+# What an error record entry looks like:
+#
+#   ##0003 2016/05/04 12:30 0x0101 lamp ignition failure
+#
+# that is, its number in the projector's log, when it happened, and the
+# error code, then the message.  Any of them might be missing.
+ERRORENTRY = re.compile(r"##\s*(\d+\b)?\s*(\d{4}[/-]\d\d[/-]\d\d(?:[ T]\d\d:\d\d(?::\d\d)?)?)?\s*(0x[0-9A-Fa-f]+)?")
+
 
 class InventoryDatabase:
     """
@@ -14,19 +144,39 @@ class InventoryDatabase:
         """
         # Should do some name checking and parsing here.
         self._name = pathname
-        self._conn = sqlite3.connect(pathname)
+        # pjcontrol talks to several projectors at once, from different
+        # threads, and they all record what they hear here.
+        self._conn = sqlite3.connect(pathname, check_same_thread=False,
+                                     cached_statements=STATEMENTCACHE)
         self._c = self._conn.cursor()
 
-        # The methods inside here only function if the table they refer to
-        # does not exist.  That is, for an existing table, this is a nop.
-        self.createProjectorSettingsTable()
-        self.createProjectorSettingsHistoryTable()
-        self.createProjectorStatusTable()
-        self.createProjectorStatusHistoryTable()
-        self.createProjectorNumbersTable()
-        self.createProjectorRepairsTable()
-        self.createBulbStatusTable()
-        self.createBulbStatusHistoryTable()
+        # See getColumns() and statements().
+        self._columns = dict()
+        self._statements = dict()
+
+        # See transaction().
+        self._lock = threading.RLock()
+        self._depth = 0
+
+        # With a write-ahead log, somebody reading (a report, say)
+        # doesn't hold up somebody writing, or the other way round.
+        # Each commit only has to reach the log, and it's still safe
+        # against a crash, if not quite against a power failure.
+        self._c.execute("PRAGMA journal_mode = WAL")
+        self._c.execute("PRAGMA synchronous = NORMAL")
+
+        version = self.getSchemaVersion()
+        if version < SCHEMAVERSION and self.hasTable("ProjectorStatus"):
+            self.upgradeSchema(version)
+
+        # The tables are only made if they're not there already.  That
+        # is, for an existing table, this is a nop.
+        for table, columns in TABLES:
+            self.createTable(table, columns)
+        for index, columns in INDEXES:
+            self._c.execute("CREATE INDEX IF NOT EXISTS {} ON {}".format(index, columns))
+        self._c.execute("PRAGMA user_version = {}".format(SCHEMAVERSION))
+        self._conn.commit()
 
 
     def getName(self):
@@ -37,29 +187,334 @@ class InventoryDatabase:
         """
         return self._name
 
-    def createProjectorNumbersTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorNumbers(projNumber TEXT, onScreen TEXT, serialSwitch TEXT, serialPort TEXT, projServer TEXT, projDisplay TEXT)')
-        
-    def createProjectorSettingsTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorSettings(projectorSerial TEXT, redOffset TEXT, greenOffset TEXT, blueOffset TEXT, redGain TEXT, greenGain TEXT, blueGain TEXT, colorTemp TEXT, gamma TEXT)')
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Makes everything done inside a 'with' block one transaction:
+
+          with db.transaction():
+              ...
+
+        It's all committed at the end, or, if there's an exception,
+        none of it is.  The commit() calls in between don't do anything,
+        and transactions inside transactions are part of the outer one.
+        Other threads wait until it's done.
+        """
+        with self._lock:
+            self._depth += 1
+            try:
+                yield
+            except:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.rollback()
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.commit()
+
+    def commit(self):
+        """
+        Commits what's been done, unless we're inside a transaction(),
+        which will do it at the end.
+        """
+        if self._depth == 0:
+            self._conn.commit()
+
+    def today(self):
+        """
+        Returns a properly formatted date for today.
+        """
+        return(datetime.date.today().isoformat())
 
-    def createProjectorSettingsHistoryTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorSettingsHistory(projectorSerial TEXT, redOffset TEXT, greenOffset TEXT, blueOffset TEXT, redGain TEXT, greenGain TEXT, blueGain TEXT, colorTemp TEXT, gamma TEXT, dateRecorded TEXT, note TEXT)')
+    def getColumns(self, table):
+        """
+        Returns the column names of a table.  They're only looked up
+        the first time.
+        """
+        if table not in self._columns:
+            self._c.execute("PRAGMA table_info(" + table + ")")
+            self._columns[table] = [ col[1] for col in self._c.fetchall() ]
+        return self._columns[table]
+
+    def statements(self, table):
+        """
+        Returns the Statements object for a table.
+        """
+        if table not in self._statements:
+            self._statements[table] = Statements(table, self.getColumns(table))
+        return self._statements[table]
 
-    def createProjectorStatusTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorStatus(projectorSerial TEXT, mfgDate TEXT, projNumber TEXT, totalHours TEXT, projStatus TEXT, onSite TEXT, lensType TEXT, repairID TEXT, errorRecord TEXT)')
+    def getSchemaVersion(self):
+        self._c.execute("PRAGMA user_version")
+        return self._c.fetchone()[0]
 
-    def createProjectorStatusHistoryTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorStatusHistory(projectorSerial TEXT, mfgDate TEXT, projNumber TEXT, totalHours TEXT, projStatus TEXT, onSite TEXT, lensType TEXT, repairID TEXT, errorRecord TEXT, dateRecorded TEXT, note TEXT)')
+    def hasTable(self, table):
+        self._c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,))
+        return self._c.fetchone() != None
 
-    def createProjectorRepairsTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS ProjectorRepairs(repairID TEXT, projectorSerial TEXT, repairType TEXT, repairedBy TEXT, repairDate TEXT, repairNote TEXT)')
+    def createTable(self, table, columns):
+        self._c.execute("CREATE TABLE IF NOT EXISTS {}({})".format(table, columns))
 
-    def createBulbStatusTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS BulbStatus(bulbID TEXT, bulbSerial TEXT, bulbLife TEXT, bulbStatus TEXT, projectorSerial TEXT, lampHours TEXT, dateIn TEXT, dateOut TEXT, repairID TEXT)')
+    def upgradeSchema(self, version):
+        """
+        Brings a database at an older version of the schema up to the
+        current one, in place, one version at a time (see
+        upgradeVersion()).  It all happens in one transaction, so if
+        something goes wrong, the database is left as it was.  The
+        indexes, and any tables no version has touched, are made
+        afterwards, the same as for a new database.
+        """
+        # Do our own transactions here, since the sqlite3 module would
+        # commit before each CREATE and ALTER otherwise.  The commit()
+        # calls of the tables the error records go into have to wait,
+        # too.
+        self._conn.commit()
+        self._conn.isolation_level = None
+        self._depth += 1
+        try:
+            self._c.execute("BEGIN")
+            for step in range(version + 1, SCHEMAVERSION + 1):
+                self.upgradeVersion(step)
+            self._c.execute("PRAGMA user_version = {}".format(SCHEMAVERSION))
+            self._c.execute("COMMIT")
+        except:
+            self._c.execute("ROLLBACK")
+            raise
+        finally:
+            self._depth -= 1
+            self._conn.isolation_level = ""
+
+    def upgradeVersion(self, version):
+        """
+        Brings the database from the version before up to the given
+        one.  Each table that version changed is renamed out of the
+        way, made again, and its records copied over.  A table that
+        isn't there yet is just made.  Anything else the version needs
+        is done after that.
+
+        If there's more than one record with the same key, the last one
+        wins, except for repair and bulb IDs, where the extras get new
+        IDs instead.
+        """
+        for table, columns in VERSIONS[version - 1]:
+            if not self.hasTable(table):
+                self.createTable(table, columns)
+                continue
+            old = table + "Old"
+            self._c.execute("ALTER TABLE {} RENAME TO {}".format(table, old))
+            self.createTable(table, columns)
+            self.copyTable(old, table)
+            self._c.execute("DROP TABLE {}".format(old))
+
+        if version == 1:
+            for table in ["ProjectorStatus", "ProjectorStatusHistory"]:
+                self._c.execute("UPDATE {} SET projNumber = NULL WHERE projNumber = 'none'".format(table))
+
+        if version == 3:
+            errorRecords = ErrorRecords(self)
+            projErrors = ProjectorErrors(self)
+            self._c.execute("SELECT projectorSerial, errorRecordID FROM ProjectorStatus")
+            for projSerial, recordID in self._c.fetchall():
+                projErrors.ingest(projSerial, errorRecords.load(recordID))
+
+    def copyTable(self, old, table):
+        """
+        Copies the records of an old table into the new one.  SQLite
+        turns the text into numbers for the INTEGER columns.  Columns
+        the new table doesn't have are left behind, except for the
+        errorRecord text, which is stored in ErrorRecords, and replaced
+        with its errorRecordID.
+        """
+        self._c.execute("PRAGMA table_info({})".format(table))
+        newNames = [ col[1] for col in self._c.fetchall() ]
+        self._c.execute("PRAGMA table_info({})".format(old))
+        oldNames = [ col[1] for col in self._c.fetchall() ]
+
+        names = []
+        for name in oldNames:
+            if name == "errorRecord" and "errorRecordID" in newNames:
+                name = "errorRecordID"
+            names.append(name if name in newNames else None)
+
+        insertString = "INSERT OR REPLACE INTO {}({}) VALUES ({})".format(table,
+                                                                        ",".join([ name for name in names if name != None ]),
+                                                                        ",".join(["?"] * (len(names) - names.count(None))))
+        self._c.execute("SELECT * FROM {} ORDER BY rowid".format(old))
+        rows = self._c.fetchall()
+
+        if "errorRecord" in oldNames and "errorRecordID" in newNames:
+            # Most of the history records have the same error record as
+            # the one before, so each one is only stored once.
+            errorRecords = ErrorRecords(self)
+            recordIDs = dict()
+            i = oldNames.index("errorRecord")
+            for n, row in enumerate(rows):
+                if row[i] not in recordIDs:
+                    recordIDs[row[i]] = errorRecords.store(row[i])
+                rows[n] = row[:i] + (recordIDs[row[i]],) + row[i + 1:]
+
+        if None in names:
+            rows = [ tuple([ value for name, value in zip(names, row) if name != None ])
+                     for row in rows ]
+
+        if table not in AUTOKEYS:
+            self._c.executemany(insertString, rows)
+            return
 
-    def createBulbStatusHistoryTable(self):
-        self._c.execute('CREATE TABLE IF NOT EXISTS BulbStatusHistory(bulbID TEXT, bulbSerial TEXT, bulbLife TEXT, bulbStatus TEXT, projectorSerial TEXT, lampHours TEXT, dateIn TEXT, dateOut TEXT, repairID TEXT, dateRecorded TEXT, note TEXT)')
+        # Records with a good ID keep it.  The rest are added after, so
+        # their new IDs don't get in the way.
+        used = set()
+        renumber = []
+        for row in rows:
+            try:
+                ID = int(row[0])
+            except (TypeError, ValueError):
+                ID = 0
+            if ID > 0 and ID not in used:
+                used.add(ID)
+                self._c.execute(insertString, (ID,) + tuple(row[1:]))
+            else:
+                renumber.append((None,) + tuple(row[1:]))
+        self._c.executemany(insertString, renumber)
+
+
+class Statements:
+    """
+    Makes the SQL for the operations on one table.  The values are
+    always parameters, so the statement for an operation is the same
+    every time, whatever the values are, and SQLite only has to compile
+    it once.  Each statement is kept once it's made.
+
+    Table and column names can't be parameters, so the column names
+    are checked against the table's, and anything else is an error.
+    """
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self._cache = dict()
+
+    def names(self, names):
+        """
+        Checks a list of column names (or a string of them, separated
+        by commas) and returns them as a tuple.
+        """
+        if isinstance(names, str):
+            names = [ name.strip() for name in names.split(",") ]
+        for name in names:
+            if name != "*" and name not in self.columns:
+                raise ValueError("{} has no column {}".format(self.table, name))
+        return tuple(names)
+
+    def cached(self, key, make):
+        if key not in self._cache:
+            self._cache[key] = make()
+        return self._cache[key]
+
+    def where(self, keyNames):
+        if len(keyNames) == 0:
+            return ""
+        return " WHERE " + " AND ".join([ name + " = ?" for name in keyNames ])
+
+    def select(self, valueNames="*", keyNames=(), orderBy=None):
+        """
+        SELECT valueNames FROM table WHERE each of keyNames = ?,
+        ORDER BY orderBy.
+        """
+        valueNames = self.names(valueNames)
+        keyNames = self.names(keyNames)
+        if orderBy != None:
+            orderBy = self.names(orderBy)
+        return self.cached(("select", valueNames, keyNames, orderBy),
+                           lambda: "SELECT " + ",".join(valueNames) + " FROM " + self.table +
+                           self.where(keyNames) +
+                           ("" if orderBy == None else " ORDER BY " + ",".join(orderBy)))
+
+    def selectIn(self, valueNames, keyName, count, keyNames=()):
+        """
+        SELECT valueNames FROM table WHERE each of keyNames = ? AND
+        keyName IN (count ?s).  The parameters are the keys, then the
+        values to look for.
+        """
+        valueNames = self.names(valueNames)
+        keyName, = self.names([keyName])
+        keyNames = self.names(keyNames)
+        return self.cached(("selectIn", valueNames, keyName, count, keyNames),
+                           lambda: "SELECT " + ",".join(valueNames) + " FROM " + self.table +
+                           (self.where(keyNames) + " AND " if keyNames else " WHERE ") +
+                           keyName + " IN (" + ",".join(["?"] * count) + ")")
+
+    def selectRange(self, valueNames, keyNames, rangeName, orderBy=None):
+        """
+        SELECT valueNames FROM table WHERE each of keyNames = ? AND
+        rangeName >= ? AND rangeName < ?, ORDER BY orderBy.
+        """
+        valueNames = self.names(valueNames)
+        keyNames = self.names(keyNames)
+        rangeName, = self.names([rangeName])
+        if orderBy != None:
+            orderBy = self.names(orderBy)
+        return self.cached(("selectRange", valueNames, keyNames, rangeName, orderBy),
+                           lambda: "SELECT " + ",".join(valueNames) + " FROM " + self.table +
+                           (self.where(keyNames) + " AND " if keyNames else " WHERE ") +
+                           rangeName + " >= ? AND " + rangeName + " < ?" +
+                           ("" if orderBy == None else " ORDER BY " + ",".join(orderBy)))
+
+    def widths(self, valueNames, keyNames=()):
+        """
+        SELECT the longest length of each of valueNames, WHERE each of
+        keyNames = ?.
+        """
+        valueNames = self.names(valueNames)
+        keyNames = self.names(keyNames)
+        return self.cached(("widths", valueNames, keyNames),
+                           lambda: "SELECT " + ",".join([ "MAX(LENGTH(" + name + "))" for name in valueNames ]) +
+                           " FROM " + self.table + self.where(keyNames))
+
+    def largest(self, valueName, keyNames=()):
+        valueName, = self.names([valueName])
+        keyNames = self.names(keyNames)
+        return self.cached(("largest", valueName, keyNames),
+                           lambda: "SELECT MAX(" + valueName + ") FROM " + self.table +
+                           self.where(keyNames))
+
+    def insert(self, valueNames):
+        valueNames = self.names(valueNames)
+        return self.cached(("insert", valueNames),
+                           lambda: "INSERT INTO " + self.table + "(" + ",".join(valueNames) + ")" +
+                           " VALUES (" + ",".join(["?"] * len(valueNames)) + ")")
+
+    def update(self, valueNames, keyNames):
+        """
+        UPDATE table SET each of valueNames = ? WHERE each of
+        keyNames = ?.  The parameters are the new values followed by
+        the keys.
+        """
+        valueNames = self.names(valueNames)
+        keyNames = self.names(keyNames)
+        return self.cached(("update", valueNames, keyNames),
+                           lambda: "UPDATE " + self.table + " SET " +
+                           ",".join([ name + " = ?" for name in valueNames ]) +
+                           self.where(keyNames))
+
+    def delete(self, keyNames):
+        keyNames = self.names(keyNames)
+        return self.cached(("delete", keyNames),
+                           lambda: "DELETE FROM " + self.table + self.where(keyNames))
+
+    def copyTo(self, history, keyName):
+        """
+        Copies the records where keyName = ? to the history table
+        (another Statements), with the date and note as the first two
+        parameters.
+        """
+        keyName, = self.names([keyName])
+        return self.cached(("copyTo", history.table, keyName),
+                           lambda: "INSERT INTO " + history.table +
+                           "(" + ",".join(self.columns) + ", dateRecorded, note)" +
+                           " SELECT " + ",".join(self.columns) + ", ?, ? FROM " + self.table +
+                           " WHERE " + keyName + " = ?")
 
 
 class DatabaseTable:
@@ -75,12 +530,14 @@ class DatabaseTable:
         self.tableName = tableName
         self.historyTableName = historyTableName
 
+        # The SQL for this table (and its history table).
+        self.sql = database.statements(tableName)
+        if self.historyTableName:
+            self.historySql = database.statements(historyTableName)
+
         # The first column in each of the tables is the primary key
         # for that table. 
-        self.fieldNames = self.getColumnHeads()
-
-        if self.historyTableName:
-            self.historyTableFieldString = "(" + ",".join(self.getColumnHeads(self.historyTableName)) + ")"
+        self.fieldNames = self.sql.columns
 
         self.primaryKey = self.fieldNames[0]
         
@@ -90,84 +547,145 @@ class DatabaseTable:
         """
         if table == None:
             table = self.tableName
-        self._db._c.execute("PRAGMA table_info(" + table + ")")
-        return [ col[1] for col in self._db._c.fetchall() ]
+        return self._db.getColumns(table)
 
     def getNextIndex(self, indexName):
         """
-        For an integer index, like a repair ID, this runs through the table
-        and comes up with the next index to use.
+        For an integer index, like a repair ID, this comes up with the
+        next index to use, one more than the largest one so far.
         """
-        self._db._c.execute("SELECT {} FROM {}".format(indexName,
-                                                       self.tableName))
-        IDs = self._db._c.fetchall()
+        self._db._c.execute(self.sql.largest(indexName))
+        largest = self._db._c.fetchone()[0]
 
-        if len(IDs) == 0:
-            return '1'
+        if largest == None:
+            return 1
 
-        # Generate a number one larger than the largest current ID.
-        newID = 0
-        for ID in IDs:
-            newID = max(newID, int(ID[0]))
-        newID += 1
-
-        # Return that.
-        return str(newID)
+        return int(largest) + 1
             
-    def prettyTable(self, heads, rows):
+    def prettyTable(self, heads, rows, widths=None, form="text", out=None):
         """
-        Calculates column widths for printing a database table.
-        """        
-        # First calculate the maximum lengths for each column.
-        lengths = map(len, heads)
-        for row in rows:
-            lengths = map(max, lengths, map(len, row))
+        Prints a database table.  The rows can be any iterable of them,
+        and they're printed as they come, so a table can be printed
+        straight from a cursor (see fetchRows()) without reading it all
+        first.
+
+        form -- "text" for columns, "csv", or "jsonl" for a JSON object
+           per row.
 
-        # Create a format string for the maximum lengths.
-        formatString = ("|{{:^{}}}" * len(heads) + "|").format(*lengths)
+        widths -- for text, how wide each column has to be (as from
+           Statements.widths()).  If not given, it's worked out from
+           the rows, which does mean reading them all first.
+        """
+        if out == None:
+            out = sys.stdout
+
+        if form == "csv":
+            writer = csv.writer(out)
+            writer.writerow(heads)
+            for row in rows:
+                writer.writerow([ "" if value == None else value for value in row ])
+            return
+
+        if form == "jsonl":
+            for row in rows:
+                out.write(json.dumps(dict(zip(heads, row))) + "\n")
+            return
+
+        if form != "text":
+            raise ValueError("reports can be {}, not {}".format(", ".join(REPORTFORMS), form))
+
+        def text(value):
+            return "" if value == None else str(value)
+
+        if widths == None:
+            rows = [ [ text(value) for value in row ] for row in rows ]
+            widths = [ max([0] + [ len(row[i]) for row in rows ]) for i in range(len(heads)) ]
+
+        # A column has to be at least as wide as its head.  (An empty
+        # table has no widths at all.)
+        widths = [ max(width or 0, len(head)) for width, head in zip(widths, heads) ]
+
+        # Create a format string for the widths.
+        formatString = ("|{{:^{}}}" * len(heads) + "|").format(*widths)
 
         # Print the heads, then the contents.
         headLine = formatString.format(*heads)
         border = "-" * len(headLine)
-        print(border)
-        print(headLine)
-        print(border)
+        out.write(border + "\n" + headLine + "\n" + border + "\n")
 
         # Remake the format string right-justified.
-        formatString = ("|{{:>{}}}" * len(heads) + "|").format(*lengths)
+        formatString = ("|{{:>{}}}" * len(heads) + "|").format(*widths)
         for row in rows:
-            print(formatString.format(*row))
-            print(border)
-        
-    def tablePrint(self, tableName, field, val):
+            out.write(formatString.format(*[ text(value) for value in row ]) + "\n")
+        out.write(border + "\n")
+
+    def fetchRows(self, cursor):
         """
-        Generic table printer.
+        Goes through the rows a cursor has selected, reading REPORTCHUNK
+        of them at a time.
         """
+        while True:
+            rows = cursor.fetchmany(REPORTCHUNK)
+            if not rows:
+                return
+            for row in rows:
+                yield row
 
-        # Go get the column names here not later, so not to mess up
-        # the database cursor after the SELECT.
-        colNames = self.getColumnHeads(tableName)
+    def tablePrint(self, tableName, field, val, form="text", out=None, hide=()):
+        """
+        Generic table printer.  Prints the records of a table where
+        field = val (or all of them if val is "*"), in the given form
+        (see prettyTable()).  The columns in hide are printed as "*",
+        in text.  Returns the last record printed, or None.
+        """
+        if out == None:
+            out = sys.stdout
 
-        # Note that apparently table and field names cannot be parameterized
-        # in SQLite execute() statements.
+        sql = self._db.statements(tableName)
         if val == "*":
-
-            selectString = "SELECT * FROM {}".format(tableName)
-            self._db._c.execute(selectString)
+            keys, params = (), ()
         else:
-
-            selectString = "SELECT * FROM {} WHERE {} = ?".format(tableName, field)
-            self._db._c.execute(selectString, (val,))
-
-        print(tableName)
-        self.prettyTable(colNames, self._db._c.fetchall())
-
-    def show(self, ID="*"):
-        self.tablePrint(self.tableName, self.primaryKey, ID)
-
-    def showHistory(self, ID="*"):
-        if self.historyTableName != "none":
-            self.tablePrint(self.historyTableName, self.primaryKey, ID)
+            keys, params = (field,), (val,)
+
+        # Our own cursor, so the rows don't get mixed up with anything
+        # else going on while they're printed.
+        cursor = self._db._conn.cursor()
+        try:
+            widths = None
+            if form == "text":
+                cursor.execute(sql.widths(sql.columns, keys), params)
+                widths = list(cursor.fetchone())
+                for name in hide:
+                    widths[sql.columns.index(name)] = 1
+
+            cursor.execute(sql.select("*", keys), params)
+
+            last = [None]
+            def remember(rows):
+                for row in rows:
+                    last[0] = row
+                    yield row
+
+            rows = remember(self.fetchRows(cursor))
+            if form == "text":
+                out.write(tableName + "\n")
+                if hide:
+                    hidden = [ sql.columns.index(name) for name in hide ]
+                    rows = ( [ "*" if i in hidden else value for i, value in enumerate(row) ]
+                             for row in rows )
+
+            self.prettyTable(sql.columns, rows, widths, form, out)
+        finally:
+            cursor.close()
+
+        return last[0]
+
+    def show(self, ID="*", form="text", out=None):
+        self.tablePrint(self.tableName, self.primaryKey, ID, form, out)
+
+    def showHistory(self, ID="*", form="text", out=None):
+        if self.historyTableName != None:
+            self.tablePrint(self.historyTableName, self.primaryKey, ID, form, out)
 
     def insert(self, fieldValues, tableName=None):
         """
@@ -176,41 +694,44 @@ class DatabaseTable:
 
         If the primary key is included in the input fieldValues, then
         we check to make sure it is not repeated in the table and
-        throw an error if it is.  If it is not included, we try to
-        generate a new key value and add the other data to the table.
+        throw an error if it is.  If it is not included, SQLite makes
+        up a new one (see AUTOKEYS) as it adds the other data to the
+        table.
 
         Returns the value of the primary key inserted, so you can
-        retrieve this record with that key.
+        retrieve this record with that key, or None if the key was
+        already there.
         """
         if tableName == None:
             tableName = self.tableName
+        sql = self._db.statements(tableName)
         
-        fieldString = "(" + ",".join(self.fieldNames) + ")"
-        questionMarks = "(" + ",".join(["?"] * len(self.fieldNames)) + ")"
-
         if len(fieldValues) == len(self.fieldNames) - 1:
 
-            # the primary key is not specified -- generate a new one.
-            vals = (self.getNextIndex(self.fieldNames[0]),) + fieldValues
+            # the primary key is not specified -- let SQLite pick the
+            # next one.
+            self._db._c.execute(sql.insert(self.fieldNames[1:]), tuple(fieldValues))
+            self._db.commit()
+
+            return self._db._c.lastrowid
 
         else:
 
             # The primary key is specified -- check to make sure it's
             # not already in the table. (If it is, use update instead.)
-            self._db._c.execute("SELECT " + self.fieldNames[0] + " FROM " +
-                                tableName + " WHERE " + self.fieldNames[0] +
-                                " = ?", (fieldValues[0],))
+            self._db._c.execute(sql.select([self.primaryKey], [self.primaryKey]),
+                                (fieldValues[0],))
             rows = self._db._c.fetchall()
             if rows:
                 # Key already exists, don't overwrite
                 return None
             
-            vals = fieldValues
+            vals = tuple(fieldValues)
 
-            
-        self._db._c.execute("INSERT INTO " + tableName + fieldString +
-                            " VALUES " + questionMarks, vals)
-        self._db._conn.commit()
+        self._db._c.execute(sql.insert(self.fieldNames), vals)
+        self._db.commit()
+
+        return vals[0]
 
     def insertByHand(self):
         """
@@ -247,13 +768,10 @@ class DatabaseTable:
         else:
             
             fieldValues = list(record) + [date, note]
-            fieldString = "(" + ",".join(self.getColumnHeads(self.historyTableName)) + ")"
-            questionMarks = "(" + ",".join(["?"] * len(fieldValues)) + ")"
 
-            self._db._c.execute("INSERT INTO " + self.historyTableName +
-                                fieldString + " VALUES " + questionMarks,
+            self._db._c.execute(self.historySql.insert(self.historySql.columns),
                                 fieldValues)
-            self._db._conn.commit()
+            self._db.commit()
 
             return fieldValues[0]
 
@@ -271,16 +789,10 @@ class DatabaseTable:
         if keyIndex == None:
             keyIndex = 0
 
-        conditions = ",".join([a + "='" + b + "'" for a,b in
-                               zip(self.fieldNames,inRecord)]) 
-
-        # Now figure out what changed, and change it in the table.
-        self._db._c.execute("UPDATE " + self.tableName + " SET " +
-                            conditions +
-                            " WHERE " + self.fieldNames[keyIndex] + " = ?",
-                            (inRecord[keyIndex],))
+        self._db._c.execute(self.sql.update(self.fieldNames, [self.fieldNames[keyIndex]]),
+                            tuple(inRecord) + (inRecord[keyIndex],))
                 
-        self._db._conn.commit()
+        self._db.commit()
 
     def setValue(self, keyName, keyValue, valueName, valueValue):
         """
@@ -288,11 +800,10 @@ class DatabaseTable:
         valueName to be valueValue.
 
         """
-        self._db._c.execute("UPDATE " + self.tableName + " SET " +
-                            valueName + "=" + valueValue +
-                            " WHERE " + keyName + "= ?", (keyValue,))
+        self._db._c.execute(self.sql.update([valueName], [keyName]),
+                            (valueValue, keyValue))
         
-        self._db._conn.commit()
+        self._db.commit()
 
     def setValueDouble(self, firstKeyName, firstKeyValue,
                        secondKeyName, secondKeyValue,
@@ -303,47 +814,100 @@ class DatabaseTable:
         to identify them. 
         """
         
-        self._db._c.execute("UPDATE " + self.tableName + " SET " +
-                            valueName + "=" + valueValue +
-                            " WHERE " + firstKeyName + "= ? AND " +
-                            secondKeyName + "= ?",
-                            (firstKeyValue, secondKeyValue))
+        self._db._c.execute(self.sql.update([valueName], [firstKeyName, secondKeyName]),
+                            (valueValue, firstKeyValue, secondKeyValue))
         
-        self._db._conn.commit()
+        self._db.commit()
         
     def getValue(self, keyName, keyValue, valueName):
         """
         Recovers the value of the valueName where the given key has
         the given value.
         """
-        self._db._c.execute("SELECT " + valueName + " FROM " +
-                            self.tableName + " WHERE " + keyName +
-                            " = ?", (keyValue,))
+        self._db._c.execute(self.sql.select(valueName, [keyName]), (keyValue,))
 
         return self._db._c.fetchone()
 
+    def getValuesIn(self, keyName, keyValues, valueNames):
+        """
+        Same as getValue(), but for a whole list of key values at once.
+        Returns a list of the rows found, in no particular order.
+        """
+        keyValues = list(keyValues)
+        rows = []
+        for i in range(0, len(keyValues), MAXKEYS):
+            chunk = keyValues[i:i + MAXKEYS]
+            self._db._c.execute(self.sql.selectIn(valueNames, keyName, len(chunk)),
+                                chunk)
+            rows += self._db._c.fetchall()
+
+        return rows
+
+    def setValues(self, keyName, valueNames, records):
+        """
+        Same as setValue(), but for many records at once, with one
+        executemany().  Each of the records is a tuple of the new
+        values, in the order of valueNames, followed by the key value.
+        """
+        self._db._c.executemany(self.sql.update(valueNames, [keyName]), records)
+        self._db.commit()
+
     def getAllValues(self, keyName):
         """
         Gets all the values of a given key in the table.
         """
-        self._db._c.execute("SELECT " + keyName + " FROM " + self.tableName)
+        self._db._c.execute(self.sql.select([keyName]))
 
         return [ col[0] for col in self._db._c.fetchall() ]
 
         
     def getRecord(self, primaryKey):
 
-        self._db._c.execute("SELECT * FROM " + self.tableName +
-                            " WHERE " + self.fieldNames[0] +
-                            " = ?", (primaryKey,))
+        self._db._c.execute(self.sql.select("*", [self.primaryKey]), (primaryKey,))
 
         return self._db._c.fetchone()
+
+    def getRecordsWhere(self, keyName, keyValue, orderBy=None):
+        """
+        Returns all the records where keyName = keyValue, as
+        dictionaries indexed by field name.
+        """
+        self._db._c.execute(self.sql.select("*", [keyName], orderBy), (keyValue,))
+
+        return [ dict(zip(self.fieldNames, row)) for row in self._db._c.fetchall() ]
+
+    def getRecordDict(self, primaryKey):
+        """
+        Same as getRecord(), but the record comes back as a dictionary
+        indexed by field name, or None if there's no such record.
+        """
+        record = self.getRecord(primaryKey)
+        if record == None:
+            return None
+        return dict(zip(self.fieldNames, record))
+
+    def delete(self, keyName, keyValue):
+        """
+        Removes the records where keyName = keyValue.
+        """
+        self._db._c.execute(self.sql.delete([keyName]), (keyValue,))
+        self._db.commit()
         
     def recordHistory(self, primaryKey, date, note):
 
         record = self.getRecord(primaryKey)
 
         self.insertHistoryRecord(record, date, note)
+
+    def recordHistoryBatch(self, primaryKeys, date, note):
+        """
+        Same as recordHistory(), but for a list of records, copied
+        straight from the table to the history table with one
+        executemany().
+        """
+        self._db._c.executemany(self.sql.copyTo(self.historySql, self.primaryKey),
+                                [ (date, note, key) for key in primaryKeys ])
+        self._db.commit()
         
         
 class ProjectorSettingsTable(DatabaseTable):
@@ -353,16 +917,298 @@ class ProjectorSettingsTable(DatabaseTable):
                                "ProjectorSettings",
                                "ProjectorSettingsHistory")
 
-    def addProjector(self, projSerial):
+    def addProjector(self, projSerial, settings=None):
+
+        if settings == None:
+            settings = ("0",) * (len(self.fieldNames) - 1)
 
-        self.insert((projSerial,) + ("0",) * (len(self.fieldValues) - 1))
+        self.insert((projSerial,) + tuple(settings))
         
 
     def setSettings(self, projSerial, settings):
 
-        self.update((projSerial,) + settings, 0)
+        self.update((projSerial,) + tuple(settings), 0)
 
         
+def splitErrorRecord(text):
+    """
+    Splits an error record (what 'op prerr' says) into its entries,
+    each a line, or the part of a line from one "##" to the next.
+    Joined together again, they're the same as the record.
+    """
+    entries = []
+    for line in text.splitlines(True):
+        pieces = line.split("##")
+        if pieces[0]:
+            entries.append(pieces[0])
+        entries += [ "##" + piece for piece in pieces[1:] ]
+    return entries
+
+def digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def packIDs(IDs):
+    return zlib.compress(struct.pack("<{}q".format(len(IDs)), *IDs))
+
+def unpackIDs(data):
+    data = zlib.decompress(data)
+    return list(struct.unpack("<{}q".format(len(data) // 8), data))
+
+
+class ErrorEntries(DatabaseTable):
+    """
+    Each different error record entry, compressed, stored once,
+    whichever projectors and records it's in.  They're found by the
+    SHA-1 digest of their text.
+    """
+    def __init__(self, db):
+        DatabaseTable.__init__(self, db,
+                               "ErrorEntries",
+                               None)
+
+    def store(self, entries):
+        """
+        Returns the entry IDs of a list of entries, adding the ones we
+        haven't seen before.
+        """
+        digests = [ digest(entry) for entry in entries ]
+
+        IDs = dict(self.getValuesIn("digest", set(digests), "digest, entryID"))
+        for entry, entryDigest in zip(entries, digests):
+            if entryDigest not in IDs:
+                IDs[entryDigest] = self.insert((entryDigest,
+                                                sqlite3.Binary(zlib.compress(entry.encode("utf-8")))))
+
+        return [ IDs[entryDigest] for entryDigest in digests ]
+
+    def load(self, entryIDs):
+        """
+        Returns the text of each of a list of entry IDs.
+        """
+        entries = dict()
+        for entryID, entry in self.getValuesIn("entryID", set(entryIDs), "entryID, entry"):
+            entries[entryID] = zlib.decompress(entry).decode("utf-8")
+
+        return [ entries[entryID] for entryID in entryIDs ]
+
+
+class ErrorRecords(DatabaseTable):
+    """
+    Error records, stored by their content.  A record is a list of
+    entries (see splitErrorRecord() and ErrorEntries), and is kept as
+    the packed list of their IDs, so a record the same as one we've
+    seen before, from this projector or any other, costs nothing more,
+    and its recordID is the same.
+
+    A projector's record mostly grows by a few new entries at the end
+    between one reading and the next, so a new record is stored as the
+    earlier record it starts with (its parentID) and the IDs of the
+    entries added after that.  A record is known by a digest of its
+    entries that's built up an entry at a time, so the earlier ones
+    can be found from the digests of the first so many of the new
+    one's entries.  After CHAINLIMIT of these, it's stored whole again.
+
+    An empty record isn't stored at all, and its ID is None.
+    """
+    def __init__(self, db):
+        DatabaseTable.__init__(self, db,
+                               "ErrorRecords",
+                               None)
+
+        self.entries = ErrorEntries(db)
+
+    def store(self, text):
+        """
+        Stores an error record, if it isn't stored already, and returns
+        its recordID.
+        """
+        if not text:
+            return None
+
+        entries = splitErrorRecord(text)
+
+        # The digest of the first so many entries, for each so many.
+        digests = []
+        recordDigest = ""
+        for entry in entries:
+            recordDigest = digest(recordDigest + digest(entry))
+            digests.append(recordDigest)
+
+        found = dict()
+        for recordDigest, recordID, depth in self.getValuesIn("digest", digests,
+                                                              "digest, recordID, depth"):
+            found[recordDigest] = (recordID, depth)
+
+        if digests[-1] in found:
+            return found[digests[-1]][0]
+
+        entryIDs = self.entries.store(entries)
+
+        parentID, depth, start = None, 0, 0
+        for n in range(len(digests) - 2, -1, -1):
+            if digests[n] in found:
+                if found[digests[n]][1] < CHAINLIMIT:
+                    parentID, depth = found[digests[n]]
+                    depth, start = depth + 1, n + 1
+                break
+
+        return self.insert((digests[-1], parentID, depth,
+                            sqlite3.Binary(packIDs(entryIDs[start:]))))
+
+    def load(self, recordID):
+        """
+        Returns the text of an error record, or "" for None.
+        """
+        if recordID == None:
+            return ""
+
+        # Back through the records this one is built on, to one that's
+        # stored whole.
+        parts = []
+        while recordID != None:
+            recordID, entryIDs = self.getValue("recordID", recordID, "parentID, entryIDs")
+            parts.insert(0, unpackIDs(entryIDs))
+
+        return "".join(self.entries.load(sum(parts, [])))
+
+
+def parseErrorEntry(entry):
+    """
+    Picks the error number, time and code out of an error record entry
+    (see ERRORENTRY).  The time is made "2016-05-04 12:30", so times
+    sort.  Returns None for each one that isn't there.
+    """
+    match = ERRORENTRY.match(entry)
+    if match == None:
+        return (None, None, None)
+
+    number, time, code = match.groups()
+    if number != None:
+        number = int(number)
+    if time != None:
+        time = time.replace("/", "-").replace("T", " ")
+    if code != None:
+        code = code.lower()
+    return (number, time, code)
+
+
+class ProjectorErrors(DatabaseTable):
+    """
+    Each projector's error log, an entry to a row, in the order we
+    first saw them, with the error number, time and code picked out
+    (see parseErrorEntry()) so they can be looked up.  The text of the
+    entries is in ErrorEntries.
+
+    A projector's log only grows, so only the entries we haven't seen
+    before are added.  Entries without a time of their own are given
+    the date they were added.
+    """
+    def __init__(self, db):
+        DatabaseTable.__init__(self, db,
+                               "ProjectorErrors",
+                               None)
+
+        self.entries = ErrorEntries(db)
+
+    def knownEntryIDs(self, projSerial, entryIDs):
+        """
+        Returns the ones of a list of entry IDs that are in a
+        projector's log.
+        """
+        entryIDs = list(set(entryIDs))
+        known = set()
+        for i in range(0, len(entryIDs), MAXKEYS):
+            chunk = entryIDs[i:i + MAXKEYS]
+            self._db._c.execute(self.sql.selectIn("entryID", "entryID", len(chunk),
+                                                  ["projectorSerial"]),
+                                [projSerial] + chunk)
+            known.update([ row[0] for row in self._db._c.fetchall() ])
+        return known
+
+    def ingest(self, projSerial, text, date=None):
+        """
+        Adds the entries of an error record to a projector's log, if
+        they're not there already, and returns how many were added.
+        """
+        if date == None:
+            date = self.today()
+
+        entries = [ entry for entry in splitErrorRecord(text or "")
+                    if entry.startswith("##") ]
+        if len(entries) == 0:
+            return 0
+
+        entryIDs = self.entries.store(entries)
+        known = self.knownEntryIDs(projSerial, entryIDs)
+
+        self._db._c.execute(self.sql.largest("sequence", ["projectorSerial"]), (projSerial,))
+        sequence = self._db._c.fetchone()[0] or 0
+
+        rows = []
+        for entry, entryID in zip(entries, entryIDs):
+            if entryID in known:
+                continue
+            known.add(entryID)
+            sequence += 1
+            number, time, code = parseErrorEntry(entry)
+            rows.append((projSerial, sequence, entryID, number,
+                         date if time == None else time, code, date))
+
+        self._db._c.executemany(self.sql.insert(self.fieldNames), rows)
+        self._db.commit()
+
+        return len(rows)
+
+    def hasEntries(self, projSerial):
+        self._db._c.execute(self.sql.largest("sequence", ["projectorSerial"]), (projSerial,))
+        return self._db._c.fetchone()[0] != None
+
+    def knows(self, projSerial, text):
+        """
+        Returns True if the first entry of an error record is in a
+        projector's log.  A projector's log only grows at the end, so
+        its first entry stays the same from one reading to the next.
+        That's two lookups by index, however long the record is.  An
+        entry we've never seen anywhere isn't added to ErrorEntries to
+        find out.
+        """
+        entries = [ entry for entry in splitErrorRecord(text or "")
+                    if entry.startswith("##") ]
+        if len(entries) == 0:
+            return False
+
+        self._db._c.execute(self.entries.sql.select("entryID", ["digest"]),
+                            (digest(entries[0]),))
+        entryID = self._db._c.fetchone()
+        if entryID == None:
+            return False
+
+        self._db._c.execute(self.sql.select("sequence", ["entryID", "projectorSerial"]),
+                            (entryID[0], projSerial))
+        return self._db._c.fetchone() != None
+
+    def find(self, errorCode, start=None, end=None):
+        """
+        Returns (projectorSerial, errorTime, entry) for each time an
+        error code was logged, from start up to (not including) end,
+        earliest first.  The times are like "2016-05-04 12:30", and
+        start and end can be dates or times like that.
+        """
+        if start == None:
+            start = ""
+        if end == None:
+            end = "9999"
+
+        self._db._c.execute(self.sql.selectRange("projectorSerial, errorTime, entryID",
+                                                 ["errorCode"], "errorTime", "errorTime"),
+                            (errorCode.lower(), start, end))
+        rows = self._db._c.fetchall()
+
+        entries = self.entries.load([ row[2] for row in rows ])
+        return [ (projSerial, errorTime, entry.rstrip("\r\n"))
+                 for (projSerial, errorTime, entryID), entry in zip(rows, entries) ]
+
+
 class ProjectorStatus(DatabaseTable):
         
     def __init__(self, db):
@@ -370,94 +1216,85 @@ class ProjectorStatus(DatabaseTable):
                                "ProjectorStatus",
                                "ProjectorStatusHistory")
 
-    def addProjector(self, projSerial, mfgDate, lensType):
+        self.errorRecords = ErrorRecords(db)
+
+    def addProjector(self, projSerial, mfgDate, lensType, status="spare"):
 
-        self.insert((projSerial, mfgDate) + ("0",) * 4 +
-                    (lensType,) + ("0",) * 3)
+        # projNumber (NULL until it's installed), totalHours, projStatus,
+        # onSite, lensType, repairID, errorRecordID
+        self.insert((projSerial, mfgDate) +
+                    (None, "0", status, "on site", lensType, "0", None))
         
     def setErrorRecord(self, projSerial, errors):
 
-        self.setValue("projSerial", projSerial, "errorRecord", errors)
+        self.setValue("projectorSerial", projSerial, "errorRecordID",
+                      self.errorRecords.store(errors))
 
-    def setNumber(self, projSerial, projNumber):
+    def getErrorRecord(self, projSerial):
+        """
+        Returns a projector's error record, as text.
+        """
+        recordID = self.getValue("projectorSerial", projSerial, "errorRecordID")
+        if recordID == None:
+            return ""
+        return self.errorRecords.load(recordID[0])
 
-        self.setValue("projSerial", projSerial, "projNumber", projNumber)
+    def setNumber(self, projSerial, projNumber):
+        """
+        Records which position a projector is in, or None (or "none")
+        if it isn't installed.
+        """
+        if projNumber == "none":
+            projNumber = None
+        self.setValue("projectorSerial", projSerial, "projNumber", projNumber)
 
     def getSerialFromNumber(self, projNumber):
 
-        return self.getValue("projNumber", projNumber, "projSerial")
+        serial = self.getValue("projNumber", projNumber, "projectorSerial")
+        if serial == None:
+            return None
+        return serial[0]
         
     def setHours(self, projSerial, hours):
 
-        self.setValue("projSerial", projSerial, "totalHours", hours)
+        self.setValue("projectorSerial", projSerial, "totalHours", hours)
         
     def setLens(self, projSerial, newLens):
 
-        self.setValue("projSerial", projSerial, "lensType", newLens)
+        self.setValue("projectorSerial", projSerial, "lensType", newLens)
 
     def setLocation(self, projSerial, newLocation):
 
-        self.setValue("projSerial", projSerial, "onSite", newLocation)
+        self.setValue("projectorSerial", projSerial, "onSite", newLocation)
         
     def setRepair(self, projSerial, repairID):
 
-        self.setValue("projSerial", projSerial, "repairID", repairID)
+        self.setValue("projectorSerial", projSerial, "repairID", repairID)
         
     def setStatus(self, projSerial, newStatus):
         
-        self.setValue("projSerial", projSerial, "projStatus", newStatus)
+        self.setValue("projectorSerial", projSerial, "projStatus", newStatus)
         
-    def show(self, projectorSerial="*"):
+    def show(self, projectorSerial="*", form="text", out=None):
         """
         From the generic table printer, modified because the error record is 
-        usually long and complicated, messy.  For a collection of
-        projectors we do not print it out, but for a single projector,
-        we print it out after the table.
+        usually long and complicated, messy.  In text, we do not print
+        it in the table, but we print the last one out after the
+        table, which is the one you want when it's for a single
+        projector.
         """
-        heads = self.fieldNames
+        if out == None:
+            out = sys.stdout
 
-        # Note that apparently table and field names cannot be parameterized
-        # in SQLite execute() statements.
-        if projectorSerial == "*":
-
-            self._db._c.execute("SELECT * FROM ProjectorStatus")
-        else:
-
-            self._db._c.execute("SELECT * FROM ProjectorStatus WHERE projectorSerial = ?", (projectorSerial,))
-
-        rows = self._db._c.fetchall()
-
-        # Set up a container in which to hold the last error record.
-        errorRecord = ""
-        
-        # First calculate the maximum lengths for each column.
-        lengths = map(len, heads)
-        for row in rows:
-            errorRecord = row[-1]
-            lengths = map(max, lengths, map(len, row))
-            lengths[-1] = len(heads[-1])
-            
-        # Create a format string for the maximum lengths.
-        formatString = ("|{{:^{}}}" * len(heads) + "|").format(*lengths)
-
-        # Print the heads, then the contents.
-        headLine = formatString.format(*heads)
-        border = "-" * len(headLine)
-        print("ProjectorStatus")
-        print(border)
-        print(headLine)
-        print(border)
+        if form != "text":
+            self.tablePrint(self.tableName, "projectorSerial", projectorSerial, form, out)
+            return
 
-        # Remake the format string right-justified.
-        formatString = ("|{{:>{}}}" * len(heads) + "|").format(*lengths)
-        for row in rows:
-            listRow = list(row)
-            listRow[-1] = "*"
-            print(formatString.format(*listRow))
-            print(border)
+        last = self.tablePrint(self.tableName, "projectorSerial", projectorSerial, form, out,
+                               hide=("errorRecordID",))
 
-        print("* The error record for the last projector in the table above is this:")
-        print(errorRecord)
+        out.write("* The error record for the last projector in the table above is this:\n")
+        out.write("{}\n".format("" if last == None else self.errorRecords.load(last[-1])))
 
 
 class ProjectorNumbers(DatabaseTable):
@@ -472,7 +1309,19 @@ class ProjectorNumbers(DatabaseTable):
         Returns a tuple of projector number, switch name, and serial port 
         number.
         """
-        
+        return self.getValue("projNumber", projNumber,
+                             "projNumber, serialSwitch, serialPort")
+
+    def setPosition(self, projNumber, onScreen, serialSwitch, serialPort):
+        """
+        Records where a projector position is, and how to reach it,
+        adding the position if it isn't there already.
+        """
+        record = (projNumber, onScreen, serialSwitch, serialPort, "", "")
+        if self.insert(record) == None:
+            # Keep whatever server and display were recorded.
+            old = self.getRecord(projNumber)
+            self.update(record[:4] + tuple(old[4:]))
 
 
 class ProjectorRepairs(DatabaseTable):
@@ -484,17 +1333,16 @@ class ProjectorRepairs(DatabaseTable):
 
     def newRecord(self, projSerial, repairType, repairedBy, date, repairNote):
         """
-        Generate a new unique repairID and then use that to add a new
-        repair record.
+        Add a new repair record, and return the repairID it was
+        given.
         """
-        # Generate new ID.
-        newRepairID = self.getNextIndex("repairID")
-        
-        # Insert new record.
-        self.insert((newRepairID,) +
-                    (projSerial, repairType, repairedBy, date, repairNote))
+        return self.insert((projSerial, repairType, repairedBy, date, repairNote))
 
-        return newRepairID        
+    def getRepairs(self, projSerial):
+        """
+        Returns the repair records for a projector, oldest first.
+        """
+        return self.getRecordsWhere("projectorSerial", projSerial, "repairID")
         
 
 class BulbStatus(DatabaseTable):
@@ -507,11 +1355,29 @@ class BulbStatus(DatabaseTable):
 
     def addBulb(self, bulbSerial, bulbLife):
 
-        # Generate new bulb ID
-        newRepairID = self.getNextIndex("bulbID")
+        # Add the data to the table, which gives it a new bulb ID.
+        return self.insert((bulbSerial, bulbLife) + ("0",) * 6)
+
+    def getBulbID(self, bulbSerial, bulbLife):
+        """
+        Returns the bulb ID of a bulb, or None if we don't know of it.
+        """
+        self._db._c.execute(self.sql.select("bulbID", ["bulbSerial", "bulbLife"]),
+                            (bulbSerial, bulbLife))
+        bulbID = self._db._c.fetchone()
+        if bulbID == None:
+            return None
+        return bulbID[0]
 
-        # Add the data to the table.
-        self.insert((bulbID, bulbSerial, bulbLife) + ("0",) * 6)
+    def getInstalledBulb(self, projSerial):
+        """
+        Returns the record of the bulb in use in a projector, as a
+        dictionary, or None if we don't know of one.
+        """
+        for bulb in self.getRecordsWhere("projectorSerial", projSerial):
+            if bulb["bulbStatus"] == "in use":
+                return bulb
+        return None
 
     def setLampHours(self, bulbID, hours):
 
@@ -520,7 +1386,7 @@ class BulbStatus(DatabaseTable):
     def setProjSerial(self, inBulb, inLife, projSerial):
 
         self.setValueDouble("bulbSerial", inBulb, "bulbLife", inLife,
-                            "projSerial", projSerial)
+                            "projectorSerial", projSerial)
 
     def setRepair(self, inBulb, inLife, rID):
 
@@ -569,131 +1435,154 @@ class InventoryDatabaseManager:
         self.projNumbers = ProjectorNumbers(self._db)
         self.projRepairs = ProjectorRepairs(self._db)
         self.bulbStatus = BulbStatus(self._db)
+        self.projErrors = ProjectorErrors(self._db)
+
+    def transaction(self):
+        """
+        Groups several changes into one transaction, committed once at
+        the end, or not at all if something goes wrong:
+
+          with dbm.transaction():
+              dbm.recordLampHours(...)
+              dbm.recordProjectorHours(...)
+
+        The operations below (swapProjectors(), changeBulb() and so on)
+        are each done this way already.
+        """
+        return self._db.transaction()
 
         
     def swapProjectors(self, projNumber, outSerial, inSerial, tech,
                        repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
 
-        self.projStatus.recordHistory(inSerial, date, repairNote)
-        self.projStatus.recordHistory(outSerial, date, repairNote)
+            self.projStatus.recordHistory(inSerial, date, repairNote)
+            self.projStatus.recordHistory(outSerial, date, repairNote)
 
-        # Change projector serial in position table.
-        self.projStatus.setNumber(inSerial, projNumber)
+            # Change projector serial in position table.
+            self.projStatus.setNumber(inSerial, projNumber)
         
-        # Change status of inSerial.
-        self.projStatus.setStatus(inSerial, "broken")
+            # Change status of inSerial.
+            self.projStatus.setStatus(inSerial, "broken")
         
-        # Change status of outSerial.
-        self.projStatus.setStatus(outSerial, "in use")
-
-        # Record repair -- uninstall and install
-        r = self.projRepairs.newRecord(outSerial, "uninstall from " +
-                                       str(projNumber), tech,
-                                       date, repairNote)
-        projStatus.setRepair(outSerial, r)
-
-        r = self.projRepairs.newRecord(inSerial, "install at " +
-                                       str(projNumber),  
-                                       tech, date, repairNote)
-        projStatus.setRepair(inSerial, r)
+            # Change status of outSerial.
+            self.projStatus.setStatus(outSerial, "in use")
+
+            # Record repair -- uninstall and install
+            r = self.projRepairs.newRecord(outSerial, "uninstall from " +
+                                           str(projNumber), tech,
+                                           date, repairNote)
+            self.projStatus.setRepair(outSerial, r)
+
+            r = self.projRepairs.newRecord(inSerial, "install at " +
+                                           str(projNumber),  
+                                           tech, date, repairNote)
+            self.projStatus.setRepair(inSerial, r)
             
 
     def repairProjector(self, projSerial, repairType, tech, newStatus=None, 
                         repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
-
-        # Record repair
-        r = self.projRepairs.newRecord(projSerial, repairType, tech,
-                                       date, repairNote)
-
-        # Change projector status
-        self.projStatus.setRepair(projSerial, r)
-        if newStatus != None:
-            self.projStatus.setStatus(projSerial, newStatus)
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
+
+            # Record repair
+            r = self.projRepairs.newRecord(projSerial, repairType, tech,
+                                           date, repairNote)
+
+            # Change projector status
+            self.projStatus.setRepair(projSerial, r)
+            if newStatus != None:
+                self.projStatus.setStatus(projSerial, newStatus)
             
 
     def shipAwayProjector(self, projSerial, tech, repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
 
-        self.projStatus.recordHistory(projSerial, date, repairNote)
+            self.projStatus.recordHistory(projSerial, date, repairNote)
             
-        # Record ship in repair table
-        r = self.projRepairs.newRecord(projSerial, "ship", tech,
-                                       date, repairNote) 
+            # Record ship in repair table
+            r = self.projRepairs.newRecord(projSerial, "ship", tech,
+                                           date, repairNote) 
         
-        # Change projector status
-        self.projStatus.setLocation(projSerial, "off site")
-        self.projStatus.setStatus(projSerial, "broken")
-        self.projStatus.setRepair(projSerial, r)
-
-    def receiveRepairedProjector(self, projSerial, repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
-
-        self.projStatus.recordHistory(projSerial, date, repairNote)
-
-        # Record receipt in repair table
-        r = self.projRepairs.newRecord(projSerial, "received", tech,
-                                       date, repairNote)
-        self.projStatus.setRepair(projSerial, r)
+            # Change projector status
+            self.projStatus.setLocation(projSerial, "off site")
+            self.projStatus.setStatus(projSerial, "broken")
+            self.projStatus.setRepair(projSerial, r)
+
+    def receiveRepairedProjector(self, projSerial, tech, repairNote=" ", date=None):
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
+
+            self.projStatus.recordHistory(projSerial, date, repairNote)
+
+            # Record receipt in repair table
+            r = self.projRepairs.newRecord(projSerial, "received", tech,
+                                           date, repairNote)
+            self.projStatus.setRepair(projSerial, r)
         
-        # Change projector status
-        self.projStatus.setLocation(projSerial, "on site")
-        self.projStatus.setStatus(projSerial, "spare")
+            # Change projector status
+            self.projStatus.setLocation(projSerial, "on site")
+            self.projStatus.setStatus(projSerial, "spare")
 
 
     def changeBulb(self, projSerial, outBulb, outLife, inBulb, inLife,
                    tech, repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
 
-        self.projStatus.recordHistory(projSerial, date, repairNote)            
+            self.projStatus.recordHistory(projSerial, date, repairNote)            
             
-        # Record repair in repair table
-        r = self.projRepairs.newRecord(projSerial, "bulb", tech,
-                                       date, repairNote)
+            # Record repair in repair table
+            r = self.projRepairs.newRecord(projSerial, "bulb", tech,
+                                           date, repairNote)
         
-        # Record repair in projector status table.
-        self.projStatus.setRepair(projSerial, r, date, note)
-
-        # Record outgoing bulb status in bulb table -- was the number
-        # recorded properly?
-        self.bulbStatus.setRepair(outBulb, outLife, r)
-        self.bulbStatus.setStatus(outBulb, "broken")
-        self.bulbStatus.setProjSerial(outBulb, outLife, "na")
-
-        # Is new bulb in bulb table? Add it if not.
-        self.bulbStatus.addBulb(inBulb, inLife, "spare")
+            # Record repair in projector status table.
+            self.projStatus.setRepair(projSerial, r)
+
+            # Record outgoing bulb status in bulb table -- was the number
+            # recorded properly?
+            self.bulbStatus.setRepair(outBulb, outLife, r)
+            self.bulbStatus.setStatus(outBulb, outLife, "broken")
+            self.bulbStatus.setProjSerial(outBulb, outLife, "na")
+
+            # Is new bulb in bulb table? Add it if not.
+            if self.bulbStatus.getBulbID(inBulb, inLife) == None:
+                self.bulbStatus.addBulb(inBulb, inLife)
         
-        # Record ingoing bulb status in bulb table.
-        self.bulbStatus.setRepair(inBulb, inLife, r)
-        self.bulbStatus.setStatus(inBulb, inLife, "in use")
-        self.bulbStatus.setProjSerial(inBulb, inLife, projSerial)
+            # Record ingoing bulb status in bulb table.
+            self.bulbStatus.setRepair(inBulb, inLife, r)
+            self.bulbStatus.setStatus(inBulb, inLife, "in use")
+            self.bulbStatus.setProjSerial(inBulb, inLife, projSerial)
 
 
-    def swapLens(self, projSerial, newLens, repairNote=" ", date=None):
-        if date == None:
-            date = self._db.today()
+    def swapLens(self, projSerial, newLens, tech, repairNote=" ", date=None):
+        with self.transaction():
+            if date == None:
+                date = self._db.today()
 
-        self.projStatus.recordHistory(projSerial, date, repairNote)
+            self.projStatus.recordHistory(projSerial, date, repairNote)
             
-        # Record repair in repair table.
-        r = self.projRepairs.newRecord(projSerial, "lens", tech,
-                                       date, repairNote + " install " + newLens)
+            # Record repair in repair table.
+            r = self.projRepairs.newRecord(projSerial, "lens", tech,
+                                           date, repairNote + " install " + newLens)
 
-        # Record repair in projector status table.
-        self.projStatus.setRepair(projSerial, r, date, repairNote)
-        self.projStatus.setLens(projSerial, newLens)
+            # Record repair in projector status table.
+            self.projStatus.setRepair(projSerial, r)
+            self.projStatus.setLens(projSerial, newLens)
 
-    def addProjector(self, projSerial, mfgDate, lens):
+    def addProjector(self, projSerial, mfgDate, lens, status="spare"):
 
-        # Add projector to projector status table.
-        self.projSettings.addProjector(projSerial, mfgDate)
-        self.projStatus.addProjector(projSerial, lensType)
+        with self.transaction():
+            # Add projector to projector status table.
+            self.projSettings.addProjector(projSerial)
+            self.projStatus.addProjector(projSerial, mfgDate, lens, status)
         
 
     def addBulb(self, bulbSerial, bulbLife, date=None):
@@ -704,9 +1593,7 @@ class InventoryDatabaseManager:
         self.bulbStatus.addBulb(bulbSerial, bulbLife)
             
 
-    def setSettings(self, projSerial, settings):
-        if date == None:
-            date = self._db.today()
+    def setSettings(self, settings, projNumber=None, projSerial=None):
 
         if projNumber == None and projSerial == None:
             print("No can do.  I need at least a position or a serial number.")
@@ -735,21 +1622,28 @@ class InventoryDatabaseManager:
     def recordLampHours(self, hours, bulbID=None,
                         projNumber=None, projSerial=None):
 
-        if bulbID == None:
+        with self.transaction():
+            if bulbID == None:
         
-            if projNumber == None and projSerial == None:
-                print("No can do. Need at least a position or a serial number.")
-                return
+                if projNumber == None and projSerial == None:
+                    print("No can do. Need at least a position or a serial number.")
+                    return
                 
-            if projSerial == None:
-                projSerial = self.projStatus.getSerialFromNumber(projNumber)
+                if projSerial == None:
+                    projSerial = self.projStatus.getSerialFromNumber(projNumber)
         
-            # Record in bulb status table.
-            self.bulbStatus.setLampHours(hours, projSerial=projSerial)
-
-        else:
+                # Find the bulb, or make up a record for it if we don't
+                # know which one it is.
+                bulb = self.bulbStatus.getInstalledBulb(projSerial)
+                if bulb == None:
+                    bulbID = self.bulbStatus.addBulb("unknown", "0")
+                    self.bulbStatus.setValue("bulbID", bulbID, "bulbStatus", "in use")
+                    self.bulbStatus.setValue("bulbID", bulbID, "projectorSerial", projSerial)
+                else:
+                    bulbID = bulb["bulbID"]
 
-            self.bulbStatus.setLampHours(hours, bulbID=bulbID)
+            # Record in bulb status table.
+            self.bulbStatus.setLampHours(bulbID, hours)
             
     def recordProjectorHours(self, hours, projNumber=None, projSerial=None):
 
@@ -765,17 +1659,239 @@ class InventoryDatabaseManager:
 
     def recordErrorRecord(self, record, projNumber=None, projSerial=None):
 
-        # Record in projector status table.
-        self.projStatus.setErrorRecord(projSerial, errors)
+        if projSerial == None:
+            projSerial = self.projStatus.getSerialFromNumber(projNumber)
+
+        with self.transaction():
+            # Record in projector status table, and add the new entries
+            # to the projector's log.
+            self.projStatus.setErrorRecord(projSerial, record)
+            self.projErrors.ingest(projSerial, record)
+
+    def knowsErrors(self, record, projSerial):
+        """
+        Returns True if the first entry of an error record is in the
+        projector's log, or if there's nothing in its log yet.
+        This is how we tell it's the projector we think it is, since
+        it can't tell us its serial number.
+        """
+        if not self.projErrors.hasEntries(projSerial):
+            return True
+        return self.projErrors.knows(projSerial, record)
+
+    def findErrors(self, errorCode, start=None, end=None):
+        """
+        Returns (projectorSerial, errorTime, entry) for each time a
+        projector logged the error code, from start up to end (dates,
+        or times like "2016-05-04 12:30"), earliest first.
+        """
+        return self.projErrors.find(errorCode, start, end)
+
+    def resolveReadings(self, readings):
+        """
+        The ...Batch() methods below take a list of readings, one for
+        each projector, each a dictionary with a "projSerial" or a
+        "projNumber" to say which projector it is, and the values to
+        record:
+
+          {"projNumber": 42, "totalHours": 5120, "lampHours": 1020,
+           "settings": [100, 100, 100, 100, 100, 100, 4, 4],
+           "errorRecord": "..."}
+
+        This returns a copy of them with the "projSerial" filled in,
+        looking up all the projector numbers at once.  Readings from
+        positions with no projector in them are left out.
+        """
+        readings = [ dict(reading) for reading in readings ]
+
+        numbers = [ reading["projNumber"] for reading in readings
+                    if reading.get("projSerial") == None ]
+        serials = dict()
+        for projNumber, projSerial in self.projStatus.getValuesIn("projNumber", numbers,
+                                                                  "projNumber, projectorSerial"):
+            serials[str(projNumber)] = projSerial
+
+        resolved = []
+        for reading in readings:
+            if reading.get("projSerial") == None:
+                reading["projSerial"] = serials.get(str(reading["projNumber"]))
+                if reading["projSerial"] == None:
+                    continue
+            resolved.append(reading)
+        return resolved
+
+    def setSettingsBatch(self, readings):
+
+        with self.transaction():
+            readings = self.resolveReadings(readings)
+            self.projSettings.setValues("projectorSerial", self.projSettings.fieldNames[1:],
+                                        [ tuple(reading["settings"]) + (reading["projSerial"],)
+                                          for reading in readings if "settings" in reading ])
+
+    def recordSettingsHistoryBatch(self, readings, date=None, note=" "):
+        if date == None:
+            date = self._db.today()
+
+        with self.transaction():
+            readings = self.resolveReadings(readings)
+            self.projSettings.recordHistoryBatch([ reading["projSerial"] for reading in readings ],
+                                                 date, note)
+
+    def recordProjectorHoursBatch(self, readings):
+
+        with self.transaction():
+            readings = self.resolveReadings(readings)
+            self.projStatus.setValues("projectorSerial", ["totalHours"],
+                                      [ (reading["totalHours"], reading["projSerial"])
+                                        for reading in readings if "totalHours" in reading ])
+
+    def recordErrorRecordBatch(self, readings):
+
+        with self.transaction():
+            readings = self.resolveReadings(readings)
+            # The same record is often read from several projectors
+            # (when there are no errors, say), so only store it once.
+            recordIDs = dict()
+            records = []
+            for reading in readings:
+                if "errorRecord" not in reading:
+                    continue
+                if reading["errorRecord"] not in recordIDs:
+                    recordIDs[reading["errorRecord"]] = self.projStatus.errorRecords.store(reading["errorRecord"])
+                records.append((recordIDs[reading["errorRecord"]], reading["projSerial"]))
+                self.projErrors.ingest(reading["projSerial"], reading["errorRecord"])
+
+            self.projStatus.setValues("projectorSerial", ["errorRecordID"], records)
+
+    def recordLampHoursBatch(self, readings):
+
+        with self.transaction():
+            readings = [ reading for reading in self.resolveReadings(readings)
+                         if "lampHours" in reading ]
+
+            # Find all the bulbs in use at once.
+            bulbIDs = dict()
+            for projSerial, bulbID, bulbStatus in self.bulbStatus.getValuesIn("projectorSerial",
+                                                                              [ reading["projSerial"] for reading in readings ],
+                                                                              "projectorSerial, bulbID, bulbStatus"):
+                if bulbStatus == "in use":
+                    bulbIDs[projSerial] = bulbID
+
+            # Make up records for the ones we don't know about, as
+            # recordLampHours() does.
+            for reading in readings:
+                if reading["projSerial"] not in bulbIDs:
+                    bulbID = self.bulbStatus.addBulb("unknown", "0")
+                    self.bulbStatus.setValue("bulbID", bulbID, "bulbStatus", "in use")
+                    self.bulbStatus.setValue("bulbID", bulbID, "projectorSerial", reading["projSerial"])
+                    bulbIDs[reading["projSerial"]] = bulbID
+
+            self.bulbStatus.setValues("bulbID", ["lampHours"],
+                                      [ (reading["lampHours"], bulbIDs[reading["projSerial"]])
+                                        for reading in readings ])
+
+    def recordSnapshot(self, readings, date=None, note=" "):
+        """
+        Records a reading of the whole fleet (after a pjcontrol -G,
+        say) in one transaction: the settings, hours and error records
+        in each reading, and then the settings and status of each
+        projector in the history tables.
+        """
+        if date == None:
+            date = self._db.today()
+
+        with self.transaction():
+            readings = self.resolveReadings(readings)
+            self.setSettingsBatch(readings)
+            self.recordProjectorHoursBatch(readings)
+            self.recordLampHoursBatch(readings)
+            self.recordErrorRecordBatch(readings)
+
+            serials = [ reading["projSerial"] for reading in readings ]
+            self.projSettings.recordHistoryBatch(serials, date, note)
+            self.projStatus.recordHistoryBatch(serials, date, note)
+
+    def setProjectorStatus(self, projSerial, newStatus):
+
+        self.projStatus.setStatus(projSerial, newStatus)
+
+    def setProjectorLens(self, projSerial, newLens):
+
+        self.projStatus.setLens(projSerial, newLens)
+
+    def setProjectorNumber(self, projSerial, projNumber):
+        """
+        Records which position a projector is installed in (None, or
+        "none", if it isn't).
+        """
+        self.projStatus.setNumber(projSerial, projNumber)
+
+    def setPosition(self, projNumber, onScreen, serialSwitch, serialPort):
+
+        self.projNumbers.setPosition(projNumber, onScreen, serialSwitch, serialPort)
 
-    def projectorReport(self, projNumber=None, projSerial=None):
+    def getProjectorSerials(self):
+
+        return self.projStatus.getAllValues("projectorSerial")
+
+    def getPositionNumbers(self):
+
+        return self.projNumbers.getAllValues("projNumber")
+
+    def hasProjector(self, projSerial):
+
+        return self.projStatus.getValue("projectorSerial", projSerial, "projectorSerial") != None
+
+    def hasPosition(self, projNumber):
+
+        return self.projNumbers.getValue("projNumber", projNumber, "projNumber") != None
+
+    def getProjector(self, projSerial):
+        """
+        Returns everything we know about one projector, as a dictionary
+        with the "status" and "settings" records, the list of
+        "repairs", and the "bulb" in use, or None if there's no such
+        projector.  The status has the text of the "errorRecord" as
+        well as its ID.
+        """
+        status = self.projStatus.getRecordDict(projSerial)
+        if status == None:
+            return None
+        status["errorRecord"] = self.projStatus.errorRecords.load(status["errorRecordID"])
+
+        return {"status": status,
+                "settings": self.projSettings.getRecordDict(projSerial),
+                "repairs": self.projRepairs.getRepairs(projSerial),
+                "bulb": self.bulbStatus.getInstalledBulb(projSerial)}
+
+    def getPosition(self, projNumber):
+        """
+        Returns a projector position's record from the ProjectorNumbers
+        table as a dictionary, with the serial number of the projector
+        installed there added as "projectorSerial" ("none" if there
+        isn't one), or None if there's no such position.
+        """
+        position = self.projNumbers.getRecordDict(projNumber)
+        if position == None:
+            return None
+
+        serial = self.projStatus.getSerialFromNumber(projNumber)
+        position["projectorSerial"] = serial if serial != None else "none"
+        return position
+
+    def projectorReport(self, projNumber=None, projSerial=None, form="text", out=None):
+
+        if projSerial == None and projNumber != None:
+            projSerial = self.projStatus.getSerialFromNumber(projNumber)
+        if projSerial == None:
+            projSerial = "*"
 
-        self.projStatus.show(projSerial)
+        self.projStatus.show(projSerial, form, out)
 
 
-    def bulbReport(self, bulbID="*"):
+    def bulbReport(self, bulbID="*", form="text", out=None):
 
-        self.bulbStatus.show(bulbID)
+        self.bulbStatus.show(bulbID, form, out)
 
 ######################
         
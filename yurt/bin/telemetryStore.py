@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+#
+# A place to keep the numbers the projectors tell us over time: total
+# hours, lamp hours, and the eight color settings.  The history tables
+# in the inventory database copy the whole record, error log and all,
+# every time something changes, which is fine for repairs but not for
+# sampling the whole fleet every night for years.
+#
+# Each projector and metric makes a series of (time, value) samples,
+# with the time in seconds since 1970.  The Series table gives each
+# one a number.  New samples go in the Recent table, a row each.  When
+# a series has CHUNKSIZE of them, they're packed into a row of the
+# Chunks table: the times and the values are each stored as the
+# differences from one to the next (which are small and mostly the
+# same), packed as 64-bit integers and compressed with zlib.  A year of
+# nightly samples of one series comes to a few hundred bytes.
+#
+# The Rollups table keeps the count, minimum, maximum, total and last
+# value of each series for each week and month (see ROLLUPS), updated
+# as the samples come in, for looking at long stretches of time
+# quickly.
+#
+# pjcontrol records a sample of everything it gathers (-G) here if
+# PJTELEMETRY names a file.  To look at what's there:
+#
+#   telemetryStore.py telemetry.db W217WOCY00053 lampHours
+#   telemetryStore.py telemetry.db W217WOCY00053 lampHours --rollup week
+#
+# The range queries (series() and rollup()) need NumPy.  Recording
+# doesn't, so pjcontrol doesn't either.
+#
+
+import sqlite3
+import struct
+import time
+import zlib
+
+# The metrics we keep.  The colors are in the order of
+# Projector.colorSettings, with the names of the inventory database's
+# ProjectorSettings columns.
+METRICS = ["totalHours", "lampHours",
+           "redOffset", "greenOffset", "blueOffset",
+           "redGain", "greenGain", "blueGain",
+           "colorTemp", "gamma"]
+
+# How many samples of a series go in one chunk.
+CHUNKSIZE = 64
+
+# The rollup periods, in seconds.  (Weeks start on Thursday, because
+# 1 January 1970 was one, and a "month" is 30 days.)
+ROLLUPS = {"week": 7 * 86400, "month": 30 * 86400}
+
+# Earlier and later than any time we'll see.
+FOREVER = 2 ** 62
+
+
+def encode(numbers):
+    """
+    Packs a list of integers as the first one followed by the
+    differences between each one and the next, compressed.
+    """
+    deltas = [numbers[0]] + [b - a for a, b in zip(numbers, numbers[1:])]
+    return zlib.compress(struct.pack("<{0}q".format(len(deltas)), *deltas))
+
+
+def decode(data):
+    """
+    Unpacks a list of integers packed by encode().
+    """
+    raw = zlib.decompress(data)
+    numbers = []
+    total = 0
+    for delta in struct.unpack("<{0}q".format(len(raw) // 8), raw):
+        total += delta
+        numbers.append(total)
+    return numbers
+
+
+def decodeArray(data):
+    """
+    Same as decode(), but returns a NumPy array.
+    """
+    import numpy
+    return numpy.frombuffer(zlib.decompress(data), dtype="<i8").cumsum()
+
+
+class TelemetryStore(object):
+    """
+    The time series for the projectors, kept in an SQLite database.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.c = self.conn.cursor()
+
+        self.c.execute("PRAGMA journal_mode = WAL")
+        self.c.execute("PRAGMA synchronous = NORMAL")
+
+        self.c.execute("CREATE TABLE IF NOT EXISTS Series(seriesID INTEGER PRIMARY KEY, projectorSerial TEXT, metric TEXT, UNIQUE(projectorSerial, metric))")
+        self.c.execute("CREATE TABLE IF NOT EXISTS Recent(seriesID INTEGER, time INTEGER, value INTEGER)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS RecentBySeries ON Recent(seriesID, time)")
+        self.c.execute("CREATE TABLE IF NOT EXISTS Chunks(chunkID INTEGER PRIMARY KEY, seriesID INTEGER, first INTEGER, last INTEGER, count INTEGER, timeData BLOB, valueData BLOB)")
+        self.c.execute("CREATE INDEX IF NOT EXISTS ChunksBySeries ON Chunks(seriesID, last)")
+        self.c.execute("CREATE TABLE IF NOT EXISTS Rollups(seriesID INTEGER, period INTEGER, bucket INTEGER, count INTEGER, minimum INTEGER, maximum INTEGER, total INTEGER, last INTEGER, lastTime INTEGER, PRIMARY KEY(seriesID, period, bucket))")
+        self.conn.commit()
+
+        # The series numbers we've looked up, by (projectorSerial, metric).
+        self.seriesIDs = dict()
+
+    def close(self):
+        self.conn.close()
+
+    def seriesID(self, projectorSerial, metric, create=False):
+        """
+        Returns the number of a series, making a new one if create is
+        True, or None if there's no such series.
+        """
+        series = (projectorSerial, metric)
+        if series not in self.seriesIDs:
+            self.c.execute("SELECT seriesID FROM Series WHERE projectorSerial = ? AND metric = ?", series)
+            row = self.c.fetchone()
+            if row is not None:
+                self.seriesIDs[series] = row[0]
+            elif create:
+                self.c.execute("INSERT INTO Series(projectorSerial, metric) VALUES (?, ?)", series)
+                self.seriesIDs[series] = self.c.lastrowid
+            else:
+                return None
+        return self.seriesIDs[series]
+
+    def record(self, samples, when=None):
+        """
+        Records a list of (projectorSerial, metric, value) samples, all
+        taken at the time 'when' (now, if not given), in one
+        transaction.  Values that aren't integers (like the "none" we
+        get from a projector that gave an ERR) are skipped.  Returns the
+        number recorded.
+        """
+        if when is None:
+            when = time.time()
+        when = int(when)
+
+        try:
+            rows = []
+            for projectorSerial, metric, value in samples:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    continue
+                rows.append((self.seriesID(projectorSerial, metric, create=True), when, value))
+
+            self.c.executemany("INSERT INTO Recent VALUES (?, ?, ?)", rows)
+            for seriesID, when, value in rows:
+                self.rollUp(seriesID, when, value)
+            for seriesID in set(row[0] for row in rows):
+                self.pack(seriesID)
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            # The new series numbers may have gone with it.
+            self.seriesIDs = dict()
+            raise
+
+        return len(rows)
+
+    def rollUp(self, seriesID, when, value):
+        """
+        Adds a sample to the rollups it belongs in.
+        """
+        for period in ROLLUPS.values():
+            key = (seriesID, period, when // period)
+            self.c.execute("INSERT OR IGNORE INTO Rollups VALUES (?, ?, ?, 0, ?, ?, 0, ?, ?)",
+                           key + (value, value, value, when))
+            self.c.execute("UPDATE Rollups SET count = count + 1, minimum = MIN(minimum, ?), maximum = MAX(maximum, ?), total = total + ?,"
+                           " last = CASE WHEN ? >= lastTime THEN ? ELSE last END, lastTime = MAX(lastTime, ?)"
+                           " WHERE seriesID = ? AND period = ? AND bucket = ?",
+                           (value, value, value, when, value, when) + key)
+
+    def pack(self, seriesID, force=False):
+        """
+        Packs a series' recent samples into a chunk, if there are
+        enough of them (or any at all, with force).
+        """
+        self.c.execute("SELECT COUNT(*) FROM Recent WHERE seriesID = ?", (seriesID,))
+        count = self.c.fetchone()[0]
+        if (count == 0) or ((count < CHUNKSIZE) and not force):
+            return
+
+        self.c.execute("SELECT rowid, time, value FROM Recent WHERE seriesID = ? ORDER BY time, rowid", (seriesID,))
+        rows = self.c.fetchall()
+        times = [row[1] for row in rows]
+        values = [row[2] for row in rows]
+
+        self.c.execute("INSERT INTO Chunks(seriesID, first, last, count, timeData, valueData) VALUES (?, ?, ?, ?, ?, ?)",
+                       (seriesID, times[0], times[-1], len(rows), encode(times), encode(values)))
+        self.c.executemany("DELETE FROM Recent WHERE rowid = ?", [(row[0],) for row in rows])
+
+    def compact(self):
+        """
+        Packs every series' recent samples into chunks, however many
+        there are.
+        """
+        self.c.execute("SELECT DISTINCT seriesID FROM Recent")
+        for row in self.c.fetchall():
+            self.pack(row[0], force=True)
+        self.conn.commit()
+
+    def projectors(self):
+        """
+        Returns the serial numbers of the projectors we have samples of.
+        """
+        self.c.execute("SELECT DISTINCT projectorSerial FROM Series")
+        return sorted(row[0] for row in self.c.fetchall())
+
+    def series(self, projectorSerial, metric, start=None, end=None):
+        """
+        Returns the samples of one projector's metric between start and
+        end (times in seconds, both included, and everything if they're
+        not given), as two NumPy arrays: the times and the values.
+        """
+        import numpy
+
+        if start is None:
+            start = -FOREVER
+        if end is None:
+            end = FOREVER
+
+        seriesID = self.seriesID(projectorSerial, metric)
+        times = []
+        values = []
+        self.c.execute("SELECT timeData, valueData FROM Chunks WHERE seriesID = ? AND last >= ? AND first <= ? ORDER BY first",
+                       (seriesID, start, end))
+        for timeData, valueData in self.c.fetchall():
+            times.append(decodeArray(timeData))
+            values.append(decodeArray(valueData))
+
+        self.c.execute("SELECT time, value FROM Recent WHERE seriesID = ? AND time >= ? AND time <= ? ORDER BY time",
+                       (seriesID, start, end))
+        recent = numpy.array(self.c.fetchall(), dtype="<i8").reshape(-1, 2)
+        times.append(recent[:, 0])
+        values.append(recent[:, 1])
+
+        times = numpy.concatenate(times)
+        values = numpy.concatenate(values)
+
+        # Samples recorded late can leave the chunks overlapping.
+        if numpy.any(numpy.diff(times) < 0):
+            order = numpy.argsort(times, kind="mergesort")
+            times = times[order]
+            values = values[order]
+
+        inside = (times >= start) & (times <= end)
+        return times[inside], values[inside]
+
+    def rollup(self, projectorSerial, metric, period="week", start=None, end=None):
+        """
+        Returns the rollups of one projector's metric for the given
+        period (see ROLLUPS) between start and end, as a dictionary of
+        NumPy arrays: "time" (the start of each period), "count",
+        "minimum", "maximum", "mean" and "last".  Periods with no
+        samples are left out.
+        """
+        import numpy
+
+        if start is None:
+            start = -FOREVER
+        if end is None:
+            end = FOREVER
+        seconds = ROLLUPS[period]
+
+        self.c.execute("SELECT bucket, count, minimum, maximum, total, last FROM Rollups"
+                       " WHERE seriesID = ? AND period = ? AND bucket >= ? AND bucket <= ? ORDER BY bucket",
+                       (self.seriesID(projectorSerial, metric), seconds, start // seconds, end // seconds))
+        rows = numpy.array(self.c.fetchall(), dtype="<i8").reshape(-1, 6)
+
+        return {"time": rows[:, 0] * seconds,
+                "count": rows[:, 1],
+                "minimum": rows[:, 2],
+                "maximum": rows[:, 3],
+                "mean": rows[:, 4] / numpy.maximum(rows[:, 1], 1),
+                "last": rows[:, 5]}
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Prints the recorded samples of a projector metric.')
+    parser.add_argument('database', help='The telemetry database.')
+    parser.add_argument('serialNo', help='The projector serial number.')
+    parser.add_argument('metric', choices=METRICS, help='What to print.')
+    parser.add_argument('-r', '--rollup', dest='rollup', choices=sorted(ROLLUPS.keys()),
+                        help='Print the rollups for this period, instead of the samples.')
+    parser.add_argument('--start', dest='start', default=None,
+                        help='The first date to print (like 2016-01-05).')
+    parser.add_argument('--end', dest='end', default=None,
+                        help='The last date to print.')
+    args = parser.parse_args()
+
+    def seconds(date, extra):
+        if date is None:
+            return None
+        return int(time.mktime(time.strptime(date, "%Y-%m-%d"))) + extra
+
+    store = TelemetryStore(args.database)
+    start = seconds(args.start, 0)
+    end = seconds(args.end, 86399)
+
+    if args.rollup is None:
+        times, values = store.series(args.serialNo, args.metric, start, end)
+        for when, value in zip(times, values):
+            print("{0} {1}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)), value))
+    else:
+        rollups = store.rollup(args.serialNo, args.metric, args.rollup, start, end)
+        print("{0:<10} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}".format("from", "count", "min", "max", "mean", "last"))
+        for i in range(len(rollups["time"])):
+            print("{0:<10} {1:>6} {2:>10} {3:>10} {4:>10.1f} {5:>10}".format(time.strftime("%Y-%m-%d", time.gmtime(rollups["time"][i])),
+                                                                             rollups["count"][i],
+                                                                             rollups["minimum"][i],
+                                                                             rollups["maximum"][i],
+                                                                             rollups["mean"][i],
+                                                                             rollups["last"][i]))
+
+    store.close()
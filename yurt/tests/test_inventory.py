@@ -0,0 +1,524 @@
+#
+# Tests for projectorDbMethods.py, the SQLite inventory database, and
+# bringing older databases up to the current schema.
+#
+
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import projectorDbMethods
+from projectorDbMethods import InventoryDatabase, InventoryDatabaseManager
+
+
+# The tables as they were before there was a schema version: all TEXT,
+# with no keys.
+VERSION0 = [
+    ("ProjectorSettings", "projectorSerial, redOffset, greenOffset, blueOffset, redGain, greenGain, blueGain, colorTemp, gamma"),
+    ("ProjectorSettingsHistory", "projectorSerial, redOffset, greenOffset, blueOffset, redGain, greenGain, blueGain, colorTemp, gamma, dateRecorded, note"),
+    ("ProjectorStatus", "projectorSerial, mfgDate, projNumber, totalHours, projStatus, onSite, lensType, repairID, errorRecord"),
+    ("ProjectorStatusHistory", "projectorSerial, mfgDate, projNumber, totalHours, projStatus, onSite, lensType, repairID, errorRecord, dateRecorded, note"),
+    ("ProjectorNumbers", "projNumber, onScreen, serialSwitch, serialPort, projServer, projDisplay"),
+    ("ProjectorRepairs", "repairID, projectorSerial, repairType, repairedBy, repairDate, repairNote"),
+    ("BulbStatus", "bulbID, bulbSerial, bulbLife, bulbStatus, projectorSerial, lampHours, dateIn, dateOut, repairID"),
+    ("BulbStatusHistory", "bulbID, bulbSerial, bulbLife, bulbStatus, projectorSerial, lampHours, dateIn, dateOut, repairID, dateRecorded, note"),
+    ]
+
+
+# An error record, as 'op prerr' gives it.
+ERRORS = "Error log\n##1 Lamp failed 2011-01-01##2 Fan stopped 2011-02-01\n##3 Lamp failed 2011-03-01\n"
+
+
+# An error record with times and error codes in it.
+LOG = ("##0001 2016/05/04 12:30 0x0101 lamp ignition failure\n"
+       "##0002 2016/05/20 09:15 0x0203 fan stopped\n"
+       "##0003 2016/06/01 08:00 0x0101 lamp ignition failure\n")
+
+
+def makeVersion0(path):
+    """
+    Makes a database the way it was before there was a schema version,
+    with a few of the things older databases have in them.
+    """
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    for table, columns in VERSION0:
+        c.execute("CREATE TABLE {}({})".format(table, ", ".join(name + " TEXT" for name in columns.split(", "))))
+    c.executemany("INSERT INTO ProjectorStatus VALUES (?,?,?,?,?,?,?,?,?)",
+                  [("SN1", "2010-01-01", "3", "1200", "installed", "on site", "standard", "2", "##old"),
+                   ("SN2", "2010-01-01", "none", "0", "spare", "on site", "standard", "0", ""),
+                   # The same projector twice; the last one wins.
+                   ("SN1", "2010-01-01", "3", "1250", "installed", "on site", "standard", "2", ERRORS)])
+    c.execute("INSERT INTO ProjectorStatusHistory VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+              ("SN2", "2010-01-01", "none", "0", "spare", "on site", "standard", "0", "", "2011-01-01", "added"))
+    c.execute("INSERT INTO ProjectorNumbers VALUES (?,?,?,?,?,?)",
+              ("3", "yes", "switch01", "3", "server", ":0.0"))
+    c.executemany("INSERT INTO ProjectorRepairs VALUES (?,?,?,?,?,?)",
+                  [("1", "SN1", "bulb change", "tech", "2011-01-01", "first"),
+                   ("2", "SN1", "swap", "tech", "2011-02-01", "second"),
+                   ("2", "SN2", "swap", "tech", "2011-02-01", "same ID"),
+                   ("0", "SN2", "repair", "tech", "2011-03-01", "bad ID")])
+    c.execute("INSERT INTO BulbStatus VALUES (?,?,?,?,?,?,?,?,?)",
+              ("1", "B1", "1", "installed", "SN1", "900", "2011-01-01", "", "1"))
+    conn.commit()
+    conn.close()
+
+
+def makeVersion(path, version):
+    """
+    Makes an empty database with the tables of an earlier version of
+    the schema.
+    """
+    conn = sqlite3.connect(path)
+    for table, columns in projectorDbMethods.tablesAt(version):
+        conn.execute("CREATE TABLE {}({})".format(table, columns))
+    conn.execute("PRAGMA user_version = {}".format(version))
+    conn.commit()
+    return conn
+
+
+class InventoryDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inventory.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def columnTypes(self, conn, table):
+        return dict((col[1], col[2]) for col in conn.execute("PRAGMA table_info({})".format(table)))
+
+    def testNewDatabase(self):
+        InventoryDatabase(self.path)
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                         projectorDbMethods.SCHEMAVERSION)
+        for table, columns in projectorDbMethods.TABLES:
+            self.assertTrue(self.columnTypes(conn, table), table)
+        conn.close()
+
+    def testTablesAt(self):
+        self.assertEqual(projectorDbMethods.tablesAt(0), [])
+        self.assertEqual([table for table, columns in projectorDbMethods.tablesAt(1)],
+                         [table for table, columns in VERSION0])
+
+    def testUpgradeFromVersion0(self):
+        makeVersion0(self.path)
+        InventoryDatabase(self.path)
+
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                         projectorDbMethods.SCHEMAVERSION)
+        self.assertEqual(self.columnTypes(conn, "ProjectorStatus")["totalHours"], "INTEGER")
+        self.assertEqual(self.columnTypes(conn, "ProjectorNumbers")["projNumber"], "INTEGER")
+
+        rows = conn.execute("SELECT projectorSerial, projNumber, totalHours FROM ProjectorStatus ORDER BY projectorSerial").fetchall()
+        self.assertEqual(rows, [("SN1", 3, 1250), ("SN2", None, 0)])
+        self.assertEqual(conn.execute("SELECT projNumber FROM ProjectorStatusHistory").fetchall(),
+                         [(None,)])
+
+        # The repair IDs that were good are kept, and the others get new ones.
+        rows = conn.execute("SELECT repairID, repairNote FROM ProjectorRepairs ORDER BY repairID").fetchall()
+        self.assertEqual(rows, [(1, "first"), (2, "second"), (3, "same ID"), (4, "bad ID")])
+
+        indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for index, columns in projectorDbMethods.INDEXES:
+            self.assertIn(index, indexes)
+        self.assertFalse(conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%Old'").fetchall())
+        conn.close()
+
+        manager = InventoryDatabaseManager(self.path)
+        self.assertEqual(manager.projStatus.getErrorRecord("SN1"), ERRORS)
+        self.assertEqual(manager.projStatus.getErrorRecord("SN2"), "")
+        self.assertTrue(manager.knowsErrors(ERRORS, "SN1"))
+        self.assertEqual([row[0] for row in manager.findErrors("0x0101")], [])
+        self.assertEqual(len(manager.projErrors.getRecordsWhere("projectorSerial", "SN1")), 3)
+
+    def testUpgradeFromVersion1(self):
+        conn = makeVersion(self.path, 1)
+        rows = [("SN1", "2010-01-01", 3, 1200, "installed", "on site", "standard", 2, ERRORS, "2011-01-01", "one"),
+                ("SN1", "2010-01-01", 3, 1300, "installed", "on site", "standard", 2, ERRORS, "2011-02-01", "two"),
+                ("SN1", "2010-01-01", 3, 1400, "installed", "on site", "standard", 2, ERRORS + "##4 More\n", "2011-03-01", "three")]
+        conn.executemany("INSERT INTO ProjectorStatusHistory VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+        conn.execute("INSERT INTO ProjectorStatus VALUES (?,?,?,?,?,?,?,?,?)", rows[-1][:9])
+        conn.execute("INSERT INTO ProjectorNumbers VALUES (3, 'yes', 'switch01', '3', 'server', ':0.0')")
+        conn.commit()
+        conn.close()
+
+        manager = InventoryDatabaseManager(self.path)
+        self.assertEqual(manager.projStatus.getErrorRecord("SN1"), ERRORS + "##4 More\n")
+        self.assertEqual(len(manager.projErrors.getRecordsWhere("projectorSerial", "SN1")), 4)
+        self.assertEqual(manager.projStatus.getSerialFromNumber(3), "SN1")
+
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0],
+                         projectorDbMethods.SCHEMAVERSION)
+        self.assertNotIn("errorRecord", self.columnTypes(conn, "ProjectorStatusHistory"))
+        recordIDs = [row[0] for row in conn.execute("SELECT errorRecordID FROM ProjectorStatusHistory ORDER BY dateRecorded")]
+        # Each record is stored once, wherever it's used.
+        self.assertEqual(recordIDs[0], recordIDs[1])
+        self.assertEqual(conn.execute("SELECT errorRecordID FROM ProjectorStatus").fetchone()[0], recordIDs[2])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM ErrorRecords").fetchone()[0], 2)
+        conn.close()
+
+    def testUpgradeFromVersion2(self):
+        manager = InventoryDatabaseManager(self.path)
+        manager.addProjector("SN1", "2010-01-01", "standard")
+        manager.projStatus.setErrorRecord("SN1", LOG)
+        manager._db._conn.close()
+
+        # Take it back to how it was at version 2.
+        conn = sqlite3.connect(self.path)
+        conn.execute("DROP TABLE ProjectorErrors")
+        conn.execute("PRAGMA user_version = 2")
+        conn.commit()
+        conn.close()
+
+        manager = InventoryDatabaseManager(self.path)
+        self.assertEqual(manager.projStatus.getErrorRecord("SN1"), LOG)
+        self.assertEqual([(serial, errorTime) for serial, errorTime, entry in manager.findErrors("0x0101")],
+                         [("SN1", "2016-05-04 12:30"), ("SN1", "2016-06-01 08:00")])
+
+    def testUpgradedDatabaseWorks(self):
+        makeVersion0(self.path)
+        manager = InventoryDatabaseManager(self.path)
+        self.assertEqual(manager.projStatus.getSerialFromNumber(3), "SN1")
+        manager.setProjectorNumber("SN1", "none")
+        manager.setProjectorNumber("SN2", 3)
+        self.assertEqual(manager.projStatus.getSerialFromNumber(3), "SN2")
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT projNumber FROM ProjectorStatus WHERE projectorSerial = 'SN1'").fetchone(),
+                         (None,))
+        conn.close()
+
+    def testUpgradeIsRepeatable(self):
+        makeVersion0(self.path)
+        InventoryDatabase(self.path)
+        InventoryDatabase(self.path)
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM ProjectorRepairs").fetchone()[0], 4)
+        conn.close()
+
+
+class InventoryOperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inventory.sqlite")
+        self.manager = InventoryDatabaseManager(self.path)
+        self.manager.addProjector("SN1", "2010-01-01", "standard", "in use")
+        self.manager.addProjector("SN2", "2010-01-01", "standard")
+        self.manager.setProjectorNumber("SN1", 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def status(self, projSerial):
+        return self.manager.projStatus.getRecordDict(projSerial)
+
+    def testSwapProjectors(self):
+        self.manager.swapProjectors(3, "SN2", "SN1", "tech", date="2012-01-01")
+        self.assertEqual(self.status("SN1")["projStatus"], "broken")
+        self.assertEqual(self.status("SN2")["projStatus"], "in use")
+        self.assertEqual(len(self.manager.projRepairs.getRepairs("SN1")), 1)
+        self.assertEqual(len(self.manager.projRepairs.getRepairs("SN2")), 1)
+
+    def testShipAndReceive(self):
+        self.manager.shipAwayProjector("SN2", "tech", date="2012-01-01")
+        self.assertEqual(self.status("SN2")["onSite"], "off site")
+        self.manager.receiveRepairedProjector("SN2", "tech", date="2012-02-01")
+        status = self.status("SN2")
+        self.assertEqual((status["onSite"], status["projStatus"]), ("on site", "spare"))
+        repairs = self.manager.projRepairs.getRepairs("SN2")
+        self.assertEqual([repair["repairType"] for repair in repairs], ["ship", "received"])
+        self.assertEqual(status["repairID"], repairs[-1]["repairID"])
+
+    def testChangeBulb(self):
+        self.manager.addBulb("B1", 1)
+        self.manager.bulbStatus.setProjSerial("B1", 1, "SN1")
+        self.manager.bulbStatus.setStatus("B1", 1, "in use")
+        self.manager.addBulb("B2", 1)
+
+        self.manager.changeBulb("SN1", "B1", 1, "B2", 1, "tech", date="2012-01-01")
+        self.assertEqual(self.manager.bulbStatus.getInstalledBulb("SN1")["bulbSerial"], "B2")
+        old = self.manager.bulbStatus.getRecordDict(self.manager.bulbStatus.getBulbID("B1", 1))
+        self.assertEqual((old["bulbStatus"], old["projectorSerial"]), ("broken", "na"))
+        # B2 was known already, so it isn't added again.
+        self.assertEqual(len(self.manager.bulbStatus.getRecordsWhere("bulbSerial", "B2")), 1)
+
+        # A bulb we haven't seen before is added.
+        self.manager.changeBulb("SN1", "B2", 1, "B3", 1, "tech", date="2012-02-01")
+        self.assertNotEqual(self.manager.bulbStatus.getBulbID("B3", 1), None)
+        self.assertEqual(self.manager.bulbStatus.getInstalledBulb("SN1")["bulbSerial"], "B3")
+
+    def testSwapLens(self):
+        self.manager.swapLens("SN1", "wide", "tech", date="2012-01-01")
+        self.assertEqual(self.status("SN1")["lensType"], "wide")
+        self.assertEqual(self.manager.projRepairs.getRepairs("SN1")[0]["repairType"], "lens")
+
+    def testFailedOperationLeavesNoTrace(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.manager.transaction():
+                self.manager.projStatus.setStatus("SN2", "broken")
+                1 / 0
+        self.assertEqual(self.status("SN2")["projStatus"], "spare")
+
+
+class TelemetryBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inventory.sqlite")
+        self.manager = InventoryDatabaseManager(self.path)
+        for n in range(1, 4):
+            self.manager.addProjector("SN{}".format(n), "2010-01-01", "standard", "in use")
+            self.manager.setProjectorNumber("SN{}".format(n), n)
+        self.manager.addBulb("B1", 1)
+        self.manager.bulbStatus.setProjSerial("B1", 1, "SN1")
+        self.manager.bulbStatus.setStatus("B1", 1, "in use")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testResolveReadings(self):
+        readings = [{"projNumber": 2}, {"projSerial": "SN3"}, {"projNumber": 9}]
+        resolved = self.manager.resolveReadings(readings)
+        self.assertEqual([reading["projSerial"] for reading in resolved], ["SN2", "SN3"])
+        # The readings passed in are left alone.
+        self.assertNotIn("projSerial", readings[0])
+
+    def testSnapshot(self):
+        readings = [{"projNumber": n, "totalHours": 1000 + n, "lampHours": 100 + n,
+                     "settings": [n] * 8, "errorRecord": "error {}".format(n)}
+                    for n in range(1, 4)]
+        self.manager.recordSnapshot(readings, date="2012-01-01", note="gather")
+
+        for n in range(1, 4):
+            status = self.manager.projStatus.getRecordDict("SN{}".format(n))
+            self.assertEqual(status["totalHours"], 1000 + n)
+            self.assertEqual(self.manager.projStatus.getErrorRecord("SN{}".format(n)), "error {}".format(n))
+            settings = self.manager.projSettings.getRecord("SN{}".format(n))
+            self.assertEqual(list(settings[1:]), [n] * 8)
+            self.assertEqual(self.manager.bulbStatus.getInstalledBulb("SN{}".format(n))["lampHours"], 100 + n)
+
+        # SN1 kept its bulb, and the others got made-up ones.
+        self.assertEqual(self.manager.bulbStatus.getInstalledBulb("SN1")["bulbSerial"], "B1")
+        self.assertEqual(self.manager.bulbStatus.getInstalledBulb("SN2")["bulbSerial"], "unknown")
+
+        conn = sqlite3.connect(self.path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM ProjectorStatusHistory WHERE note = 'gather'").fetchone()[0], 3)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM ProjectorSettingsHistory WHERE dateRecorded = '2012-01-01'").fetchone()[0], 3)
+        conn.close()
+
+    def testBatchLeavesOutMissingValues(self):
+        self.manager.recordProjectorHoursBatch([{"projNumber": 1, "totalHours": 50},
+                                                {"projNumber": 2}])
+        self.assertEqual(self.manager.projStatus.getRecordDict("SN1")["totalHours"], 50)
+        self.assertEqual(self.manager.projStatus.getRecordDict("SN2")["totalHours"], 0)
+
+
+class StatementsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sql = projectorDbMethods.Statements("BulbStatus", ["bulbID", "bulbSerial", "bulbLife"])
+
+    def testSelect(self):
+        self.assertEqual(self.sql.select("bulbID", ["bulbSerial", "bulbLife"]),
+                         "SELECT bulbID FROM BulbStatus WHERE bulbSerial = ? AND bulbLife = ?")
+        self.assertEqual(self.sql.select(orderBy="bulbID"),
+                         "SELECT * FROM BulbStatus ORDER BY bulbID")
+        self.assertEqual(self.sql.selectIn("bulbID, bulbLife", "bulbSerial", 3),
+                         "SELECT bulbID,bulbLife FROM BulbStatus WHERE bulbSerial IN (?,?,?)")
+
+    def testStatementsAreKept(self):
+        first = self.sql.update(["bulbLife"], ["bulbID"])
+        self.assertIs(self.sql.update(["bulbLife"], ["bulbID"]), first)
+
+    def testUnknownColumns(self):
+        with self.assertRaises(ValueError):
+            self.sql.select("bulbID; DROP TABLE BulbStatus")
+        with self.assertRaises(ValueError):
+            self.sql.update(["bulbLife"], ["nosuch"])
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "inventory.sqlite")
+        self.manager = InventoryDatabaseManager(self.path)
+        self.manager.addProjector("SN1", "2010-01-01", "standard", "in use")
+        self.manager.addProjector("SN22", "2010-01-01", "wide")
+        self.manager.recordErrorRecord("a long error log", projSerial="SN22")
+        self.table = self.manager.projStatus
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def report(self, *args, **kwargs):
+        out = io.StringIO()
+        self.table.prettyTable(*args, out=out, **kwargs)
+        return out.getvalue()
+
+    def testText(self):
+        text = self.report(["name", "n"], iter([("a", 1), ("bbb", None)]))
+        self.assertEqual(text.splitlines(),
+                         ["--------",
+                          "|name|n|",
+                          "--------",
+                          "|   a|1|",
+                          "| bbb| |",
+                          "--------"])
+        # Given the widths, it doesn't need to read the rows first.
+        self.assertEqual(self.report(["name", "n"], iter([("a", 1), ("bbb", None)]), widths=[3, 1]), text)
+
+    def testCSVAndJSONLines(self):
+        rows = [("a", 1), ("b,c", None)]
+        self.assertEqual(self.report(["name", "n"], rows, form="csv").splitlines(),
+                         ["name,n", "a,1", '"b,c",'])
+        lines = self.report(["name", "n"], rows, form="jsonl").splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{"name": "a", "n": 1}, {"name": "b,c", "n": None}])
+        with self.assertRaises(ValueError):
+            self.report(["name"], rows, form="xml")
+
+    def testShowHidesTheErrorRecord(self):
+        out = io.StringIO()
+        self.table.show(out=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "ProjectorStatus")
+        self.assertFalse([line for line in lines[1:-2] if "error log" in line])
+        self.assertEqual(lines[-1], "a long error log")
+
+        out = io.StringIO()
+        self.table.show("SN1", form="jsonl", out=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record["projectorSerial"] for record in records], ["SN1"])
+
+    def testFetchRows(self):
+        for n in range(projectorDbMethods.REPORTCHUNK + 10):
+            self.manager.addBulb("B{}".format(n), 1)
+        cursor = self.manager._db._conn.cursor()
+        cursor.execute("SELECT bulbID FROM BulbStatus")
+        self.assertEqual(len(list(self.table.fetchRows(cursor))), projectorDbMethods.REPORTCHUNK + 10)
+
+
+class ErrorRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = InventoryDatabase(os.path.join(self.directory, "inventory.sqlite"))
+        self.records = projectorDbMethods.ErrorRecords(self.db)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def depth(self, recordID):
+        return self.records.getValue("recordID", recordID, "depth")[0]
+
+    def testSplit(self):
+        entries = projectorDbMethods.splitErrorRecord(ERRORS)
+        self.assertEqual(entries, ["Error log\n", "##1 Lamp failed 2011-01-01", "##2 Fan stopped 2011-02-01\n",
+                                   "##3 Lamp failed 2011-03-01\n"])
+        self.assertEqual("".join(entries), ERRORS)
+
+    def testRoundTrip(self):
+        for text in [ERRORS, "no entries at all", "##1\n##1\n##1\n", "unfinished##"]:
+            self.assertEqual(self.records.load(self.records.store(text)), text)
+        self.assertEqual(self.records.store(""), None)
+        self.assertEqual(self.records.load(None), "")
+
+    def testStoredOnce(self):
+        first = self.records.store(ERRORS)
+        self.assertEqual(self.records.store(ERRORS), first)
+        # Each entry is stored once, even when it's in a record twice.
+        self.records.store(ERRORS + "##1 Lamp failed 2011-01-01")
+        self.db._c.execute("SELECT COUNT(*) FROM ErrorEntries")
+        self.assertEqual(self.db._c.fetchone()[0], 4)
+
+    def testChains(self):
+        text = ERRORS
+        recordIDs = [self.records.store(text)]
+        for n in range(projectorDbMethods.CHAINLIMIT + 3):
+            text += "##{} Lamp failed\n".format(n + 10)
+            recordIDs.append(self.records.store(text))
+            self.assertEqual(self.records.load(recordIDs[-1]), text)
+
+        depths = [self.depth(recordID) for recordID in recordIDs]
+        self.assertEqual(depths[:projectorDbMethods.CHAINLIMIT + 1], list(range(projectorDbMethods.CHAINLIMIT + 1)))
+        # After CHAINLIMIT, the record is stored whole again, and the
+        # next ones build on it.
+        self.assertEqual(depths[projectorDbMethods.CHAINLIMIT + 1:], [0, 1, 2])
+
+        # Every record along the way still reads back.
+        self.assertEqual(self.records.load(recordIDs[5]), ERRORS + "".join("##{} Lamp failed\n".format(n + 10) for n in range(5)))
+
+    def testDifferentStartsArentChained(self):
+        self.records.store(ERRORS)
+        recordID = self.records.store("Other log\n" + ERRORS)
+        self.assertEqual(self.depth(recordID), 0)
+
+
+class ProjectorErrorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manager = InventoryDatabaseManager(os.path.join(self.directory, "inventory.sqlite"))
+        self.errors = self.manager.projErrors
+        for serial in ["SN1", "SN2"]:
+            self.manager.addProjector(serial, "2010-01-01", "standard")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testParseErrorEntry(self):
+        parse = projectorDbMethods.parseErrorEntry
+        self.assertEqual(parse("##0003 2016/05/04 12:30 0x0A01 lamp"), (3, "2016-05-04 12:30", "0x0a01"))
+        self.assertEqual(parse("## 12 2016-05-04T12:30:15 oops"), (12, "2016-05-04 12:30:15", None))
+        self.assertEqual(parse("##0x0101 no number"), (None, None, "0x0101"))
+        self.assertEqual(parse("Error log"), (None, None, None))
+
+    def testIngestAddsOnlyNewEntries(self):
+        self.assertEqual(self.errors.ingest("SN1", LOG, "2016-06-02"), 3)
+        self.assertEqual(self.errors.ingest("SN1", LOG, "2016-06-03"), 0)
+        self.assertEqual(self.errors.ingest("SN1", LOG + "##0004 fan\n", "2016-06-04"), 1)
+        rows = self.errors.getRecordsWhere("projectorSerial", "SN1", "sequence")
+        self.assertEqual([row["errorNumber"] for row in rows], [1, 2, 3, 4])
+        # An entry without a time of its own gets the date it was added.
+        self.assertEqual(rows[-1]["errorTime"], "2016-06-04")
+        self.assertEqual(self.errors.ingest("SN2", "no entries", "2016-06-04"), 0)
+
+    def testKnows(self):
+        self.manager.recordErrorRecord(LOG, projSerial="SN1")
+        self.assertTrue(self.manager.knowsErrors(LOG + "##0004 new\n", "SN1"))
+        # Nothing logged yet for SN2, so anything goes.
+        self.assertTrue(self.manager.knowsErrors(LOG, "SN2"))
+
+        self.manager.recordErrorRecord("##0001 2016/01/01 00:00 0x0001 other\n", projSerial="SN2")
+        self.assertFalse(self.manager.knowsErrors(LOG, "SN2"))
+        self.assertFalse(self.errors.knows("SN1", "##0001 never seen\n"))
+        self.assertFalse(self.errors.knows("SN1", ""))
+
+    def testFind(self):
+        self.manager.recordErrorRecord(LOG, projSerial="SN1")
+        self.manager.recordErrorRecord("##0001 2016/05/10 10:00 0x0101 lamp\n", projSerial="SN2")
+
+        found = self.manager.findErrors("0x0101")
+        self.assertEqual([(serial, errorTime) for serial, errorTime, entry in found],
+                         [("SN1", "2016-05-04 12:30"), ("SN2", "2016-05-10 10:00"), ("SN1", "2016-06-01 08:00")])
+        self.assertEqual(found[0][2], "##0001 2016/05/04 12:30 0x0101 lamp ignition failure")
+
+        found = self.manager.findErrors("0X0101", "2016-05-05", "2016-06-01")
+        self.assertEqual([serial for serial, errorTime, entry in found], ["SN2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#
+# Tests for opclient.py: reading the projectors' replies, and what
+# happens when a switch session goes away partway through a command.
+#
+# Run them from the yurt directory with:
+#
+#   python3 -m pytest tests
+#
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import opclient
+from opclient import OpReply
+
+
+class ParseReplyTest(unittest.TestCase):
+
+    def testAck(self):
+        reply = opclient.parseReply("op lamp.hours ?\r\nACK: LAMP.HOURS = 1234\r\n")
+        self.assertEqual(reply.status, "ACK")
+        self.assertEqual(reply.text, " LAMP.HOURS = 1234\r\n")
+
+    def testErrBeforeAck(self):
+        reply = opclient.parseReply("ERR: bad command\nACK: ignored\n")
+        self.assertEqual(reply.status, "ERR")
+        self.assertEqual(reply.text, " bad command\n")
+
+    def testNoErr(self):
+        reply = opclient.parseReply("op prerr\r\nNoErr\r\n")
+        self.assertEqual(reply.status, "NoErr")
+        self.assertEqual(reply.text, "")
+
+    def testIncomplete(self):
+        self.assertIsNone(opclient.parseReply("op lamp.hours ?\r\nACK: LAMP.HO"))
+        self.assertIsNone(opclient.parseReply("op prerr\r\n"))
+
+
+class OpReplyParseTest(unittest.TestCase):
+
+    def testError(self):
+        reply = OpReply.parse("Error attempting command op powon on proj03: no power\n", "proj03")
+        self.assertEqual(reply.status, "ERR")
+        self.assertEqual(reply.text, "no power\n")
+
+    def testNoErr(self):
+        reply = OpReply.parse("proj03: NoErr\n", "proj03")
+        self.assertEqual(reply.status, "NoErr")
+
+    def testAck(self):
+        reply = OpReply.parse("proj03:  LAMP.HOURS = 1234\n", "proj03")
+        self.assertEqual(reply.status, "ACK")
+        self.assertEqual(reply.text, " LAMP.HOURS = 1234\n")
+
+    def testDump(self):
+        reply = OpReply.parse("proj03: line one\nline two\n", "proj03")
+        self.assertEqual(reply.status, "timeout")
+        self.assertEqual(reply.text, "line one\nline two\n")
+
+    def testRoundTrip(self):
+        for reply in [OpReply("ERR", "no power\n"),
+                      OpReply("NoErr", ""),
+                      OpReply("ACK", " LAMP.HOURS = 1234\n")]:
+            again = OpReply.parse(reply.format("proj07", "op lamp.hours ?"), "proj07")
+            self.assertEqual(again.toDict(), reply.toDict())
+
+
+class IsWriteTest(unittest.TestCase):
+
+    def testQueryName(self):
+        self.assertEqual(opclient.queryName("op Status.Check ?"), "status.check")
+        self.assertEqual(opclient.queryName("op  lamp.hours  ?"), "lamp.hours")
+        self.assertIsNone(opclient.queryName("op powon"))
+        self.assertIsNone(opclient.queryName("op red.offset = 3"))
+
+    def testIsWrite(self):
+        self.assertTrue(opclient.isWrite("op powon"))
+        self.assertTrue(opclient.isWrite("op red.offset = 3"))
+        self.assertFalse(opclient.isWrite("op status.check ?"))
+        self.assertFalse(opclient.isWrite("op prerr"))
+        self.assertFalse(opclient.isWrite(" op  prerr "))
+
+
+class LostSessionTest(unittest.TestCase):
+    """
+    A switch that reads one command and hangs up without answering.
+    """
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.received = []
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.hangUp, "127.0.0.1", 0))
+        self.port = str(self.server.sockets[0].getsockname()[1])
+        self.client = opclient.OpClient(timeout=2.0, quiet=0.2)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def hangUp(self, reader, writer):
+        data = await reader.read(1024)
+        if data:
+            self.received.append(data)
+        writer.close()
+
+    def send(self, cmds):
+        return self.loop.run_until_complete(
+            self.client.transact("127.0.0.1", self.port, cmds))
+
+    def testWriteIsNotSentTwice(self):
+        replies = self.send(["op powon"])
+        self.assertEqual(len(self.received), 1)
+        self.assertEqual(replies[0].status, "ERR")
+        self.assertIn("not sent again", replies[0].text)
+
+    def testQueryIsRetried(self):
+        with self.assertRaises(opclient.SwitchUnreachable):
+            self.send(["op status.check ?"])
+        self.assertEqual(len(self.received), 2)
+
+    def testRestOfListIsNotResent(self):
+        replies = self.send(["op powon", "op status.check ?", "op lamp.hours ?"])
+        self.assertEqual([reply.status for reply in replies], ["ERR", "ERR", "ERR"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#
+# Tests for pjbroker.py's clients: what happens when the broker goes
+# away with a request.
+#
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pjbroker
+from test_projd import FakeBroker
+
+
+class LostRepliesTest(unittest.TestCase):
+
+    def testQueriesCanGoAgain(self):
+        with self.assertRaises(ConnectionError):
+            pjbroker.lostReplies(pjbroker.RequestLost("gone"), ["op power ?", "op prerr"])
+
+    def testWritesAreNotSentAgain(self):
+        replies = pjbroker.lostReplies(pjbroker.RequestLost("gone"), ["op power ?", "op power = 1"])
+        self.assertEqual([reply.status for reply in replies], ["ERR", "ERR"])
+        self.assertIn("Not sent again", replies[0].text)
+
+
+class BrokerSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.loop.close()
+
+    def sendMany(self, broker, cmds):
+        session = pjbroker.BrokerSession(broker.address)
+        try:
+            return self.loop.run_until_complete(session.sendMany("proj01", "switch01", 1, cmds))
+        finally:
+            session.close()
+            broker.close()
+
+    def testSendMany(self):
+        replies = self.sendMany(FakeBroker(self.loop), ["op power ?", "op power = 1"])
+        self.assertEqual([(reply.status, reply.text) for reply in replies],
+                         [("ACK", "(op power ?)\r\n"), ("ACK", "(op power = 1)\r\n")])
+
+    def testLostWriteIsSentOnce(self):
+        broker = FakeBroker(self.loop, hangUp=True)
+        replies = self.sendMany(broker, ["op power = 1"])
+        self.assertEqual(replies[0].status, "ERR")
+        self.assertEqual(len(broker.requests), 1)
+
+    def testLostQueryIsSentAgain(self):
+        broker = FakeBroker(self.loop, hangUp=True)
+        with self.assertRaises(ConnectionError):
+            self.sendMany(broker, ["op power ?"])
+        self.assertEqual(len(broker.requests), 2)
+
+    def testReconnects(self):
+        broker = FakeBroker(self.loop)
+        session = pjbroker.BrokerSession(broker.address)
+        try:
+            self.loop.run_until_complete(session.sendMany("proj01", "switch01", 1, ["op power ?"]))
+            # The broker hangs up between requests.
+            broker.disconnect()
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            replies = self.loop.run_until_complete(session.sendMany("proj01", "switch01", 1, ["op power = 1"]))
+            self.assertEqual(replies[0].status, "ACK")
+        finally:
+            session.close()
+            broker.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#
+# Tests for pjcache.py, the cache of answers to status queries.
+#
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pjcache
+from opclient import OpReply
+
+
+class ParseTTLsTest(unittest.TestCase):
+
+    def testParse(self):
+        self.assertEqual(pjcache.parseTTLs("status.check=2, Lamp.Hours=300"),
+                         {"status.check": 2.0, "lamp.hours": 300.0})
+
+    def testEmpty(self):
+        self.assertEqual(pjcache.parseTTLs(""), {})
+        self.assertEqual(pjcache.parseTTLs("junk,,"), {})
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.directory = os.path.join(self.top, "pjcache")
+        self.cache = pjcache.QueryCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.top)
+
+    def testPermissions(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode), 0o700)
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"))
+        path = self.cache.entryPath(3, "lamp.hours")
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+    def testStoreAndLookup(self):
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"))
+        reply = self.cache.lookup(3, "op  Lamp.Hours  ?")
+        self.assertEqual(reply.toDict(), {"status": "ACK", "text": " 1234\n"})
+        self.assertIsNone(self.cache.lookup(4, "op lamp.hours ?"))
+
+    def testOnlyAcksAndQueries(self):
+        self.cache.store(3, "op lamp.hours ?", OpReply("ERR", "busy\n"))
+        self.cache.store(3, "op red.offset ?", OpReply("ACK", " 3\n"))
+        self.assertIsNone(self.cache.lookup(3, "op lamp.hours ?"))
+        self.assertIsNone(self.cache.lookup(3, "op red.offset ?"))
+
+    def testExpiry(self):
+        self.cache.ttls["status.check"] = 0.05
+        self.cache.store(3, "op status.check ?", OpReply("ACK", " 2\n"))
+        self.assertIsNotNone(self.cache.lookup(3, "op status.check ?"))
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.lookup(3, "op status.check ?"))
+
+    def testFresh(self):
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"))
+        self.cache.fresh = True
+        self.assertIsNone(self.cache.lookup(3, "op lamp.hours ?"))
+
+    def testInvalidate(self):
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"))
+        self.cache.store(4, "op lamp.hours ?", OpReply("ACK", " 99\n"))
+        self.cache.invalidate(3)
+        self.assertIsNone(self.cache.lookup(3, "op lamp.hours ?"))
+        self.assertIsNotNone(self.cache.lookup(4, "op lamp.hours ?"))
+
+    def testStaleGeneration(self):
+        generation = self.cache.generation(3)
+        self.cache.invalidate(3)
+        self.assertNotEqual(self.cache.generation(3), generation)
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"), generation)
+        self.assertIsNone(self.cache.lookup(3, "op lamp.hours ?"))
+
+        self.cache.store(3, "op lamp.hours ?", OpReply("ACK", " 1234\n"), self.cache.generation(3))
+        self.assertIsNotNone(self.cache.lookup(3, "op lamp.hours ?"))
+
+    def testRefusesOpenDirectory(self):
+        os.chmod(self.directory, 0o777)
+        with self.assertRaises(PermissionError):
+            pjcache.QueryCache(self.directory)
+
+    def testRefusesSymlink(self):
+        link = os.path.join(self.top, "link")
+        os.symlink(self.directory, link)
+        with self.assertRaises(OSError):
+            pjcache.QueryCache(link)
+
+
+if __name__ == "__main__":
+    unittest.main()
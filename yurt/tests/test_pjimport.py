@@ -0,0 +1,121 @@
+#
+# Tests for pjimport.py and the InventoryStore in pjstore.py: moving
+# the projectors from the shelf into the SQLite inventory and reading
+# them back.
+#
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BINDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+sys.path.insert(0, BINDIR)
+
+import pjcontrol
+import pjstore
+
+CLASSES = {"Projector": pjcontrol.Projector,
+           "ProjectorControl": pjcontrol.ProjectorControl,
+           "RepairRecord": pjcontrol.RepairRecord}
+
+
+def makeProjectors():
+    """
+    Returns a couple of projectors, one of them installed as number 7
+    with some history, and the control for number 7.
+    """
+    first = pjcontrol.Projector("SN00001", "2012-01-01", "standard")
+    first.setTotalHours(12000)
+    first.setLampHours(345)
+    first.setColorSettings([10, 20, 30, 110, 120, 130, 3, 2])
+    first.addRecord("repair", "new ballast")
+    first.addRecord("lamp", "")
+
+    second = pjcontrol.Projector("SN00002", "2013-02-02", "wide")
+    second.setPurpose("broken")
+
+    pjcontrol.projs = {"SN00001": first, "SN00002": second}
+    control = pjcontrol.ProjectorControl(7, "SN00001", "switch01", "10007", "wall")
+    return first, second, control
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        pjcontrol.registerClasses()
+        self.directory = tempfile.mkdtemp()
+        self.shelf = os.path.join(self.directory, "projector4.db")
+        self.inventory = os.path.join(self.directory, "inventory.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def checkProjectors(self, store):
+        first, second, control = makeProjectors()
+        self.assertEqual(sorted(store.projs.keys()), ["SN00001", "SN00002"])
+        self.assertEqual(sorted(store.projControls.keys()), [7])
+
+        again = store.projs["SN00001"]
+        self.assertEqual(again.mfgDate, first.mfgDate)
+        self.assertEqual(again.purpose, "installed")
+        self.assertEqual(int(again.totalHours), 12000)
+        self.assertEqual(int(again.lampHours), 345)
+        self.assertEqual([int(x) for x in again.colorSettings[:8]], first.colorSettings[:8])
+        self.assertEqual([(r.repair, r.comment) for r in again.records],
+                         [("repair", "new ballast"), ("lamp", "")])
+        self.assertEqual(store.projs["SN00002"].purpose, "broken")
+
+        position = store.projControls[7]
+        self.assertEqual(position.projector, "SN00001")
+        self.assertEqual((position.serialSwitch, str(position.switchPort), position.location),
+                         ("switch01", "10007", "wall"))
+
+    def testInventoryRoundTrip(self):
+        first, second, control = makeProjectors()
+        store = pjstore.InventoryStore(self.inventory, CLASSES)
+        store.projs["SN00001"] = first
+        store.projs["SN00002"] = second
+        store.projControls[7] = control
+        store.close()
+
+        self.checkProjectors(pjstore.InventoryStore(self.inventory, CLASSES))
+
+    def testOnlyNewRepairsAreAdded(self):
+        first, second, control = makeProjectors()
+        store = pjstore.InventoryStore(self.inventory, CLASSES)
+        store.projs["SN00001"] = first
+        store.close()
+
+        store = pjstore.InventoryStore(self.inventory, CLASSES)
+        store.projs["SN00001"].addRecord("lens", "swapped")
+        store.close()
+
+        again = pjstore.InventoryStore(self.inventory, CLASSES).projs["SN00001"]
+        self.assertEqual([r.repair for r in again.records], ["repair", "lamp", "lens"])
+
+    def testImport(self):
+        first, second, control = makeProjectors()
+        shelf = pjstore.ProjectorStore(self.shelf)
+        shelf.projs["SN00001"] = first
+        shelf.projs["SN00002"] = second
+        shelf.projControls[7] = control
+        shelf.close()
+
+        result = subprocess.run([sys.executable, os.path.join(BINDIR, "pjimport.py"),
+                                 "-s", self.shelf, self.inventory],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.checkProjectors(pjstore.InventoryStore(self.inventory, CLASSES))
+
+        # Not twice.
+        result = subprocess.run([sys.executable, os.path.join(BINDIR, "pjimport.py"),
+                                 "-s", self.shelf, self.inventory],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertNotEqual(result.returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#
+# Tests for the pieces of pjserver.py that don't need a projector.
+#
+
+import dbm
+import io
+import json
+import os
+import pwd
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pjserver
+
+
+class StreamWriterTest(unittest.TestCase):
+
+    def messages(self, wfile):
+        return [json.loads(line) for line in wfile.getvalue().decode("utf-8").splitlines()]
+
+    def testWholeLines(self):
+        wfile = io.BytesIO()
+        out = pjserver.StreamWriter(wfile, "out")
+        out.write("proj01: ")
+        self.assertEqual(self.messages(wfile), [])
+        out.write("OK\n")
+        out.write("partial")
+        out.flush()
+        self.assertEqual(self.messages(wfile), [{"out": "proj01: OK\n"}, {"out": "partial"}])
+
+    def testClientGone(self):
+        class Gone(object):
+            def write(self, data):
+                raise BrokenPipeError()
+
+        out = pjserver.StreamWriter(Gone(), "out")
+        out.write("nobody is listening\n")
+        self.assertIsNone(out.wfile)
+        out.write("still fine\n")
+
+
+class PeerUserTest(unittest.TestCase):
+
+    def testPeerUser(self):
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.assertEqual(pjserver.peerUser(a), pwd.getpwuid(os.getuid()).pw_name)
+        finally:
+            a.close()
+            b.close()
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, "projectors")
+        self.environ = os.environ.get("PROJECTORDB")
+        os.environ["PROJECTORDB"] = self.database
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ["PROJECTORDB"]
+        else:
+            os.environ["PROJECTORDB"] = self.environ
+        shutil.rmtree(self.directory)
+
+    def testFileStamp(self):
+        self.assertEqual(pjserver.fileStamp(self.database), [])
+        db = dbm.open(self.database, "c")
+        db[b"ctl:1"] = b"x"
+        db.close()
+        stamp = pjserver.fileStamp(self.database)
+        self.assertNotEqual(stamp, [])
+        self.assertEqual(pjserver.fileStamp(self.database), stamp)
+
+    def testPrivateSocket(self):
+        path = os.path.join(self.directory, "pjcontrol.sock")
+        server = pjserver.CommandServer(path, self.database)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
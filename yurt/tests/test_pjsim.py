@@ -0,0 +1,88 @@
+#
+# Tests for the simulated projectors in pjsim.py, and the statistics
+# in pjbench.py.
+#
+
+import io
+import os
+import random
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pjbench
+import pjsim
+
+
+class LayoutTest(unittest.TestCase):
+
+    def testLayout(self):
+        places = pjsim.layout(18)
+        self.assertEqual(places[0], (0, "switch01", "10001"))
+        self.assertEqual(places[15], (15, "switch01", "10016"))
+        self.assertEqual(places[16], (16, "switch02", "10001"))
+
+    def testParseNumbers(self):
+        self.assertEqual(pjsim.parseNumbers("3, 6-9,,12"), [3, 6, 7, 8, 9, 12])
+        self.assertEqual(pjsim.parseNumbers(""), [])
+
+    def testStripTelnet(self):
+        data = bytes([pjsim.IAC, 253, 1]) + b"op" + bytes([pjsim.IAC, pjsim.IAC]) + b"x"
+        self.assertEqual(pjsim.stripTelnet(data), b"op\xffx")
+
+
+class SimProjectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.projector = pjsim.SimProjector(1, 0.0, 0.0, random.Random(1))
+
+    def testPower(self):
+        self.assertEqual(self.projector.handle("op status.check ?"), "ACK: STATUS.CHECK = 0\r\n")
+        self.assertEqual(self.projector.handle("op powon"), "ACK: POWON\r\n")
+        # No warm-up time, so it's on as soon as anybody asks.
+        self.assertEqual(self.projector.handle("op status.check ?"), "ACK: STATUS.CHECK = 2\r\n")
+
+    def testSettingsOnlyWhenOn(self):
+        self.assertTrue(self.projector.handle("op red.offset ?").startswith("ERR:"))
+        self.projector.handle("op powon")
+        self.assertEqual(self.projector.handle("op red.offset = 7"), "ACK: RED.OFFSET = 7\r\n")
+        self.assertEqual(self.projector.handle("op red.offset ?"), "ACK: RED.OFFSET = 7\r\n")
+
+    def testErrors(self):
+        self.projector.errors = []
+        self.assertEqual(self.projector.handle("op prerr"), "NoErr\r\n")
+        self.projector.addError(random.Random(2))
+        self.assertTrue(self.projector.handle("op prerr").startswith("##0001 "))
+        self.assertTrue(self.projector.handle("op nonsense ?").startswith("ERR:"))
+        self.assertTrue(self.projector.handle("hello").startswith("ERR:"))
+
+
+class BenchStatisticsTest(unittest.TestCase):
+
+    def testPercentile(self):
+        times = [float(t) for t in range(1, 101)]
+        self.assertEqual(pjbench.percentile(times, 0.5), 51.0)
+        self.assertEqual(pjbench.percentile(times, 0.95), 96.0)
+        self.assertEqual(pjbench.percentile([3.0], 0.95), 3.0)
+
+    def testFailedRunsAreNotTimed(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            pjbench.summarize("pow", [1.0, None, 3.0])
+        fields = out.getvalue().split()
+        self.assertEqual(fields[1], "2")
+        self.assertEqual(float(fields[2]), 2.0)
+        self.assertEqual(fields[-1], "1")
+
+    def testAllFailed(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            pjbench.summarize("pow", [None, None])
+        self.assertIn("no runs", out.getvalue())
+        self.assertEqual(out.getvalue().split()[-1], "2")
+
+
+if __name__ == "__main__":
+    unittest.main()
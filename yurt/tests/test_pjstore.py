@@ -0,0 +1,189 @@
+#
+# Tests for pjstore.py, the projector database one record at a time.
+#
+
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import pjstore
+
+
+def fileContents(directory):
+    contents = dict()
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "rb") as f:
+            contents[name] = f.read()
+    return contents
+
+
+class ProjectorStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "projectors")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testRoundTrip(self):
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"] = {"purpose": "installed", "records": []}
+        store.projControls[7] = {"switch": "switch01"}
+        self.assertEqual(store.sync(), 2)
+
+        store = pjstore.ProjectorStore(self.path)
+        self.assertEqual(sorted(store.projs), ["SN1"])
+        self.assertEqual(sorted(store.projControls), [7])
+        self.assertEqual(store.projControls[7], {"switch": "switch01"})
+        self.assertNotIn(8, store.projControls)
+
+    def testOnlyChangesAreWritten(self):
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"] = {"records": []}
+        store.projs["SN2"] = {"records": []}
+        store.sync()
+
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"]
+        store.projs["SN2"]
+        self.assertEqual(store.sync(), 0)
+
+        # Changed in place, the way addRecord does.
+        store.projs["SN2"]["records"].append("repair")
+        self.assertEqual(store.sync(), 1)
+        self.assertEqual(store.sync(), 0)
+
+    def testDelete(self):
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"] = "one"
+        store.projs["SN2"] = "two"
+        store.sync()
+        del store.projs["SN1"]
+        with self.assertRaises(KeyError):
+            del store.projs["SN9"]
+        store.sync()
+
+        store = pjstore.ProjectorStore(self.path)
+        self.assertEqual(list(store.projs), ["SN2"])
+
+    def testUnwrittenRecordsAreListed(self):
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"] = "one"
+        store.sync()
+        store.projs["SN2"] = "two"
+        self.assertEqual(sorted(store.projs), ["SN1", "SN2"])
+        self.assertEqual(len(store.projs), 2)
+        del store.projs["SN2"]
+        self.assertEqual(list(store.projs), ["SN1"])
+
+    def testForget(self):
+        store = pjstore.ProjectorStore(self.path)
+        store.projs["SN1"] = "one"
+        store.sync()
+
+        other = pjstore.ProjectorStore(self.path)
+        other.projs["SN1"] = "changed"
+        other.sync()
+
+        self.assertEqual(store.projs["SN1"], "one")
+        store.forget()
+        self.assertEqual(store.projs["SN1"], "changed")
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.oldDirectory = os.path.join(self.directory, "old")
+        os.mkdir(self.oldDirectory)
+        self.oldPath = os.path.join(self.oldDirectory, "projector3.db")
+        shelf = shelve.open(self.oldPath)
+        shelf["projs"] = {"SN1": "one", "SN2": "two"}
+        shelf["projControls"] = {1: "control one"}
+        shelf.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testOldDatabaseIsRefused(self):
+        with self.assertRaises(pjstore.OldDatabase):
+            pjstore.ProjectorStore(self.oldPath)
+
+    def testConvert(self):
+        before = fileContents(self.oldDirectory)
+        store = pjstore.ProjectorStore(os.path.join(self.directory, "projector4.db"))
+        self.assertEqual(pjstore.convert(self.oldPath, store), (2, 1))
+
+        # The old one is just as it was, and still reads as a shelf.
+        self.assertEqual(fileContents(self.oldDirectory), before)
+        shelf = shelve.open(self.oldPath, "r")
+        self.assertEqual(shelf["projs"]["SN2"], "two")
+        shelf.close()
+
+        store = pjstore.ProjectorStore(os.path.join(self.directory, "projector4.db"))
+        self.assertEqual(store.projs["SN1"], "one")
+        self.assertEqual(store.projControls[1], "control one")
+
+    def testConvertNewDatabase(self):
+        store = pjstore.ProjectorStore(os.path.join(self.directory, "projector4.db"))
+        store.projs["SN1"] = "one"
+        store.sync()
+        with self.assertRaises(ValueError):
+            pjstore.convert(os.path.join(self.directory, "projector4.db"), store)
+
+
+class SerialIndexTest(unittest.TestCase):
+
+    SERIALS = ["W217WOCY00053", "W217WOCY00153", "W316XQAB00012", "SN1", "TESTBENCH"]
+
+    def setUp(self):
+        self.index = pjstore.SerialIndex(self.SERIALS)
+
+    def check(self, fragment):
+        self.assertEqual(self.index.find(fragment),
+                         sorted(serial for serial in self.SERIALS if fragment in serial))
+
+    def testFind(self):
+        for fragment in ["", "0", "53", "W21", "00053", "WOCY001", "W217WOCY00053", "XQ", "nope", "3W"]:
+            self.check(fragment)
+
+    def testLiteral(self):
+        # The fragment is text, not a regular expression.
+        self.assertEqual(self.index.find("W.17"), [])
+        self.assertEqual(self.index.find("S.*"), [])
+        self.index.add("S.*1")
+        self.assertEqual(self.index.find("S.*"), ["S.*1"])
+
+    def testAddAndDiscard(self):
+        self.index.add("W217WOCY99999")
+        self.assertEqual(self.index.find("WOCY9"), ["W217WOCY99999"])
+        self.index.discard("W217WOCY00053")
+        self.assertEqual(self.index.find("0053"), [])
+        self.assertEqual(self.index.find("W217"), ["W217WOCY00153", "W217WOCY99999"])
+        # Discarding one that isn't there is all right.
+        self.index.discard("W217WOCY00053")
+        self.assertNotIn("0053", self.index.grams)
+
+    def testRecordMapSearch(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = pjstore.ProjectorStore(os.path.join(directory, "projectors"))
+            for serial in self.SERIALS:
+                store.projs[serial] = {"records": []}
+            self.assertEqual(store.projs.search("0053"), ["W217WOCY00053"])
+            # The index keeps up with changes after it's made.
+            store.projs["W999WOCY00053"] = {"records": []}
+            del store.projs["W217WOCY00053"]
+            self.assertEqual(store.projs.search("0053"), ["W999WOCY00053"])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
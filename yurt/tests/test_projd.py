@@ -0,0 +1,296 @@
+#
+# Tests for projd.py, the daemon that answers for the projectors'
+# network addresses.
+#
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import projd
+
+
+def freePort():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class ParseTest(unittest.TestCase):
+
+    def testParseProjectors(self):
+        self.assertEqual(projd.parseProjectors(["100:38", "102:40"]), [(100, 38), (102, 40)])
+        self.assertEqual(projd.parseProjectors(["101-103:0"]), [(101, 0), (102, 1), (103, 2)])
+
+    def testFixCommand(self):
+        self.assertEqual(projd.fixCommand("red.off ?\r\n"), "op red.offset ?")
+        self.assertEqual(projd.fixCommand("bright  = 5\r\n"), "op brightness = 5")
+        self.assertEqual(projd.fixCommand(" power ?\n"), "op power ?")
+        self.assertEqual(projd.fixCommand("\r\n"), "")
+
+
+class LineReaderTest(unittest.TestCase):
+
+    def readLines(self, chunks, limit=projd.MAXLINE):
+        """
+        Feeds the chunks to a LineReader, and returns what it reads, with
+        "too long" for each ValueError.
+        """
+        async def read():
+            stream = asyncio.StreamReader()
+            for chunk in chunks:
+                stream.feed_data(chunk)
+            stream.feed_eof()
+            lines = projd.LineReader(stream, limit)
+            result = []
+            while True:
+                try:
+                    line = await lines.readline()
+                except ValueError:
+                    result.append("too long")
+                    continue
+                if line is None:
+                    return result
+                result.append(line)
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(read())
+        finally:
+            loop.close()
+
+    def testLineEndings(self):
+        self.assertEqual(self.readLines([b"power ?\r\nlamp ?\nred.offset ?\r"]),
+                         [b"power ?", b"", b"lamp ?", b"red.offset ?"])
+
+    def testLinesSplitAcrossReads(self):
+        self.assertEqual(self.readLines([b"pow", b"er ?\nla", b"mp ?"]), [b"power ?", b"lamp ?"])
+
+    def testTooLong(self):
+        self.assertEqual(self.readLines([b"x" * 30, b"x" * 30 + b"\npower ?\n"], limit=16),
+                         ["too long", b"power ?"])
+        self.assertEqual(self.readLines([b"x" * 30], limit=16), ["too long"])
+
+
+class FakeBroker(object):
+    """
+    Answers broker requests on 127.0.0.1, with an ACK that gives back
+    the command.  With hangUp, it reads the request and hangs up
+    instead.
+    """
+    def __init__(self, loop, hangUp=False):
+        self.hangUp = hangUp
+        self.requests = []
+        self.writers = []
+        self.server = loop.run_until_complete(asyncio.start_server(self.serve, "127.0.0.1", 0))
+        self.address = "127.0.0.1:{0}".format(self.server.sockets[0].getsockname()[1])
+
+    async def serve(self, reader, writer):
+        self.writers.append(writer)
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line.decode("utf-8"))
+            self.requests.append(request)
+            if self.hangUp:
+                break
+            replies = [{"status": "ACK", "text": "({0})\r\n".format(cmd)} for cmd in request["cmds"]]
+            writer.write((json.dumps({"replies": replies}) + "\n").encode("utf-8"))
+        writer.close()
+
+    def disconnect(self):
+        for writer in self.writers:
+            writer.close()
+
+    def close(self):
+        self.server.close()
+
+
+class ProjdTest(unittest.TestCase):
+    """
+    Runs projd on 127.0.0.1, sending its commands through a fake broker.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.broker = FakeBroker(self.loop)
+        self.port = freePort()
+        self.projd = projd.Projd({7: ("SN7", "switch01", 3), 8: ("none", "switch01", 4)},
+                                 "127.0.0.", self.port, self.broker.address)
+        self.loop.run_until_complete(self.projd.listen([(1, 7), (2, 8), (3, 9)]))
+
+    def tearDown(self):
+        self.projd.close()
+        self.broker.close()
+        # Let the connections see they're closed.
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.loop.close()
+
+    def testCommand(self):
+        async def talk():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(b"red.off  ?\r\n")
+            reply = await asyncio.wait_for(reader.readline(), 10)
+            writer.close()
+            return reply
+
+        self.assertEqual(self.loop.run_until_complete(talk()), b"OP (op red.offset ?)\r\n")
+        self.assertEqual(self.broker.requests[0]["proj"], "proj07")
+        self.assertEqual((self.broker.requests[0]["switch"], self.broker.requests[0]["port"]), ("switch01", 3))
+
+    def testPipelined(self):
+        async def talk():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(b"power ?\nlamp ?\n" + b"x" * (projd.MAXLINE + 1) + b"\nred.off ?\n")
+            replies = [await asyncio.wait_for(reader.readline(), 10) for i in range(4)]
+            writer.close()
+            return replies
+
+        replies = self.loop.run_until_complete(talk())
+        self.assertEqual(replies[:2], [b"OP (op power ?)\r\n", b"OP (op lamp ?)\r\n"])
+        self.assertTrue(replies[2].startswith(b"OP ERR: line longer than"))
+        self.assertEqual(replies[3], b"OP (op red.offset ?)\r\n")
+
+    def testMetrics(self):
+        metricsPort = freePort()
+        self.loop.run_until_complete(self.projd.serveMetrics("127.0.0.1:{0}".format(metricsPort)))
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection("127.0.0.1", metricsPort)
+            writer.write("GET {0} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(path).encode("latin-1"))
+            response = await asyncio.wait_for(reader.read(), 10)
+            writer.close()
+            return response.decode("utf-8")
+
+        self.loop.run_until_complete(self.projd.run(7, "op power ?"))
+        response = self.loop.run_until_complete(get("/metrics"))
+        self.assertTrue(response.startswith("HTTP/1.0 200 OK\r\n"))
+        self.assertIn('projd_replies_total{projector="proj07",status="ACK"} 1\n', response)
+        self.assertIn('projd_round_trip_seconds_count{projector="proj07"} 1\n', response)
+        self.assertTrue(self.loop.run_until_complete(get("/")).startswith("HTTP/1.0 404"))
+
+    def testUnknownProjectors(self):
+        self.assertIn("never heard of projector 9", self.loop.run_until_complete(self.projd.run(9, "op power ?")))
+        self.assertIn("no projector installed at 8", self.loop.run_until_complete(self.projd.run(8, "op power ?")))
+
+
+class CommandQueueTest(unittest.TestCase):
+    """
+    Runs a CommandQueue with a stand-in for sending the commands, which
+    waits until it's told to answer.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sent = []
+        self.answers = asyncio.Queue()
+        self.metrics = projd.ProjectorMetrics()
+        self.queue = projd.CommandQueue(self.send, self.metrics)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    async def send(self, cmd):
+        self.sent.append(cmd)
+        await self.answers.get()
+        return "{0} {1}".format(cmd, len(self.sent))
+
+    def finish(self, futures):
+        async def answerAll():
+            while not all(future.done() for future in futures):
+                self.answers.put_nowait(None)
+                await asyncio.sleep(0)
+            return [future.result() for future in futures]
+        return self.loop.run_until_complete(answerAll())
+
+    def testInOrder(self):
+        futures = [self.queue.submit(cmd) for cmd in ["op power = 1", "op red.offset = 3", "op power ?"]]
+        self.assertEqual(self.finish(futures),
+                         ["op power = 1 1", "op red.offset = 3 2", "op power ? 3"])
+        self.assertEqual(len(self.queue), 0)
+
+    def testQueriesAreShared(self):
+        futures = [self.queue.submit(cmd) for cmd in ["op status.check ?", "op power ?",
+                                                      "op status.check ?", "op  status.check  ?"]]
+        replies = self.finish(futures)
+        self.assertEqual(self.sent, ["op status.check ?", "op power ?", "op  status.check  ?"])
+        self.assertEqual(replies[0], replies[2])
+        self.assertEqual((self.metrics.commands, self.metrics.shared), (4, 1))
+        self.assertEqual(sum(self.metrics.queueWait.counts), 3)
+
+    def testQueriesAreNotSharedAcrossWrites(self):
+        futures = [self.queue.submit(cmd) for cmd in ["op power ?", "op power = 1", "op power ?",
+                                                      "op power = 1", "op prerr", "op prerr"]]
+        self.finish(futures)
+        # The writes both go, and so does the query after the write.
+        # 'op prerr' doesn't change anything, so it's shared.
+        self.assertEqual(self.sent, ["op power ?", "op power = 1", "op power ?",
+                                     "op power = 1", "op prerr"])
+
+    def testQueryAfterItsBeenSentIsSentAgain(self):
+        first = self.queue.submit("op power ?")
+        self.loop.run_until_complete(asyncio.sleep(0))
+        second = self.queue.submit("op power ?")
+        self.finish([first, second])
+        self.assertEqual(self.sent, ["op power ?", "op power ?"])
+
+    def testErrors(self):
+        async def broken(cmd):
+            raise OSError("no switch")
+        queue = projd.CommandQueue(broken, self.metrics)
+        future = queue.submit("op power ?")
+        self.assertEqual(self.loop.run_until_complete(future), "ERR: no switch\n")
+        self.assertEqual(self.metrics.replies, {"ERR": 1})
+
+
+class MetricsTest(unittest.TestCase):
+
+    def testHistogram(self):
+        histogram = projd.Histogram((0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.format("wait", 'projector="proj07"'),
+                         ['wait_bucket{projector="proj07",le="0.1"} 2',
+                          'wait_bucket{projector="proj07",le="1.0"} 3',
+                          'wait_bucket{projector="proj07",le="+Inf"} 4',
+                          'wait_sum{projector="proj07"} 3.65',
+                          'wait_count{projector="proj07"} 4'])
+
+    def testFormatMetrics(self):
+        metrics = {7: projd.ProjectorMetrics(), 12: projd.ProjectorMetrics()}
+        metrics[7].commands = 3
+        metrics[7].countReply("ACK")
+        metrics[7].countReply("ACK")
+        metrics[7].countReply("timeout")
+        text = projd.formatMetrics(metrics, {7: {"a client"}, 12: set()}, {7: [], 12: ["x", "y"]})
+        lines = text.splitlines()
+
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn("# TYPE projd_commands_total counter", lines)
+        self.assertIn('projd_commands_total{projector="proj07"} 3', lines)
+        self.assertIn('projd_commands_total{projector="proj12"} 0', lines)
+        self.assertIn('projd_replies_total{projector="proj07",status="ACK"} 2', lines)
+        self.assertIn('projd_replies_total{projector="proj07",status="timeout"} 1', lines)
+        self.assertIn('projd_round_trip_seconds_count{projector="proj12"} 0', lines)
+        self.assertIn('projd_connections{projector="proj07"} 1', lines)
+        self.assertIn('projd_queue_depth{projector="proj12"} 2', lines)
+        # Every sample line's name belongs to the family declared above it.
+        family = None
+        for line in lines:
+            if line.startswith("# TYPE "):
+                family = line.split()[2]
+            elif not line.startswith("#"):
+                self.assertTrue(line.startswith(family), line)
+
+
+if __name__ == "__main__":
+    unittest.main()
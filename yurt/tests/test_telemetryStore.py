@@ -0,0 +1,128 @@
+#
+# Tests for telemetryStore.py, the time series of projector readings.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+
+import telemetryStore
+from telemetryStore import TelemetryStore
+
+# The range queries need NumPy; recording doesn't.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DAY = 86400
+
+
+class EncodeTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        for numbers in [[0], [5, 5, 5, 5], [1000, 1001, 999, -3, 2 ** 40],
+                        list(range(1451606400, 1451606400 + 64 * DAY, DAY))]:
+            self.assertEqual(telemetryStore.decode(telemetryStore.encode(numbers)), numbers)
+
+    def testSteadyNumbersPackSmall(self):
+        times = list(range(1451606400, 1451606400 + 365 * DAY, DAY))
+        self.assertLess(len(telemetryStore.encode(times)), 100)
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testDecodeArray(self):
+        numbers = [7, 3, 12, 12, -40]
+        self.assertEqual(list(telemetryStore.decodeArray(telemetryStore.encode(numbers))), numbers)
+
+
+class TelemetryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = TelemetryStore(os.path.join(self.directory, "telemetry.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def recordDays(self, count, start=0):
+        for day in range(start, start + count):
+            self.store.record([("SN1", "lampHours", 100 + day),
+                               ("SN2", "lampHours", 500)], when=day * DAY)
+
+    def count(self, table):
+        self.store.c.execute("SELECT COUNT(*) FROM {}".format(table))
+        return self.store.c.fetchone()[0]
+
+    def testSkipsValuesThatArentNumbers(self):
+        self.assertEqual(self.store.record([("SN1", "lampHours", "none"),
+                                            ("SN1", "totalHours", "12")], when=0), 1)
+        self.assertEqual(self.store.projectors(), ["SN1"])
+
+    def testPacksFullChunks(self):
+        self.recordDays(telemetryStore.CHUNKSIZE + 3)
+        self.assertEqual(self.count("Chunks"), 2)
+        self.assertEqual(self.count("Recent"), 2 * 3)
+        self.store.compact()
+        self.assertEqual(self.count("Chunks"), 4)
+        self.assertEqual(self.count("Recent"), 0)
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testSeries(self):
+        self.recordDays(telemetryStore.CHUNKSIZE + 3)
+        times, values = self.store.series("SN1", "lampHours")
+        self.assertEqual(list(times), [day * DAY for day in range(telemetryStore.CHUNKSIZE + 3)])
+        self.assertEqual(list(values), [100 + day for day in range(telemetryStore.CHUNKSIZE + 3)])
+
+        # Both ends are included, and the range spans a chunk and the
+        # recent samples.
+        times, values = self.store.series("SN1", "lampHours", 60 * DAY, 65 * DAY)
+        self.assertEqual(list(values), list(range(160, 166)))
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testLateSamplesAreSorted(self):
+        self.recordDays(telemetryStore.CHUNKSIZE, start=10)
+        self.recordDays(3)
+        self.store.compact()
+        times, values = self.store.series("SN1", "lampHours")
+        self.assertEqual(list(times), sorted(times))
+        self.assertEqual(list(values), [100 + day for day in range(telemetryStore.CHUNKSIZE + 10) if not 3 <= day < 10])
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testRollups(self):
+        # Day 0 is a Thursday, so the first week is days 0 to 6.
+        self.recordDays(14)
+        rollups = self.store.rollup("SN1", "lampHours", "week")
+        self.assertEqual(list(rollups["time"]), [0, 7 * DAY])
+        self.assertEqual(list(rollups["count"]), [7, 7])
+        self.assertEqual(list(rollups["minimum"]), [100, 107])
+        self.assertEqual(list(rollups["maximum"]), [106, 113])
+        self.assertEqual(list(rollups["mean"]), [103.0, 110.0])
+        self.assertEqual(list(rollups["last"]), [106, 113])
+
+        rollups = self.store.rollup("SN1", "lampHours", "week", start=8 * DAY)
+        self.assertEqual(list(rollups["count"]), [7])
+
+        rollups = self.store.rollup("SN2", "lampHours", "month")
+        self.assertEqual((list(rollups["count"]), list(rollups["mean"])), ([14], [500.0]))
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testRollupLastIsTheLatest(self):
+        self.store.record([("SN1", "lampHours", 20)], when=2 * DAY)
+        self.store.record([("SN1", "lampHours", 10)], when=1 * DAY)
+        rollups = self.store.rollup("SN1", "lampHours", "week")
+        self.assertEqual(list(rollups["last"]), [20])
+
+    @unittest.skipIf(numpy is None, "needs NumPy")
+    def testUnknownSeries(self):
+        times, values = self.store.series("SN9", "lampHours")
+        self.assertEqual(len(times), 0)
+        self.assertEqual(len(self.store.rollup("SN9", "lampHours")["time"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()